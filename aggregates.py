@@ -0,0 +1,92 @@
+"""Rebuild denormalized aggregates that have drifted from the rows they summarize"""
+
+from sqlalchemy import func, or_, select
+
+from models import db, Book, BookList, Follows, Rating, Review, User
+
+
+def batches(model, batch_size):
+    """Yield (first_id, last_id) ranges covering model's table, batch_size ids at a time"""
+
+    last_id = 0
+    while True:
+        ids = [row[0] for row in db.session.query(model.id)
+               .filter(model.id > last_id)
+               .order_by(model.id)
+               .limit(batch_size)]
+        if not ids:
+            return
+        yield ids[0], ids[-1]
+        last_id = ids[-1]
+
+
+def reconcile_rating_aggregates(batch_size=500, log=print):
+    """Recompute rating_sum and num_of_ratings for books whose values drifted.
+    Works in batches of book ids, one transaction each. Return how many books were fixed."""
+
+    true_sum = (select(func.coalesce(func.sum(Rating.score), 0))
+                .where(Rating.book_id == Book.id)
+                .scalar_subquery())
+    true_count = (select(func.count(Rating.id))
+                  .where(Rating.book_id == Book.id)
+                  .scalar_subquery())
+
+    fixed = 0
+    for first_id, last_id in batches(Book, batch_size):
+        drifted = (db.session.query(Book)
+                   .filter(Book.id.between(first_id, last_id))
+                   .filter(or_(Book.rating_sum != true_sum, Book.num_of_ratings != true_count))
+                   .update({Book.rating_sum: true_sum, Book.num_of_ratings: true_count},
+                           synchronize_session=False))
+        db.session.commit()
+
+        if drifted:
+            log(f"Books {first_id}-{last_id}: fixed {drifted}")
+        fixed += drifted
+
+    log(f"Rating aggregates reconciled, {fixed} books fixed")
+    return fixed
+
+
+def user_counter_truths():
+    """Map each User counter column to a subquery counting the rows it summarizes"""
+
+    def count(model, column):
+        return (select(func.count()).select_from(model)
+                .where(column == User.id)
+                .scalar_subquery())
+
+    return {
+        User.followers_count: count(Follows, Follows.user_being_followed_id),
+        User.following_count: count(Follows, Follows.user_following_id),
+        User.booklist_count: count(BookList, BookList.user_id),
+        User.reviews_count: count(Review, Review.user_id),
+        User.ratings_count: count(Rating, Rating.user_id),
+    }
+
+
+def reconcile_user_counters(batch_size=500, repair=True, log=print):
+    """Find users whose follower, following, booklist, review or rating counts
+    drifted, and recompute them unless repair is False.
+    Works in batches of user ids, one transaction each. Return how many users drifted."""
+
+    truths = user_counter_truths()
+    drift = or_(*[counter != truth for counter, truth in truths.items()])
+
+    drifted_total = 0
+    for first_id, last_id in batches(User, batch_size):
+        in_batch = db.session.query(User).filter(User.id.between(first_id, last_id)).filter(drift)
+
+        if repair:
+            drifted = in_batch.update(truths, synchronize_session=False)
+            db.session.commit()
+        else:
+            drifted = in_batch.count()
+
+        if drifted:
+            log(f"Users {first_id}-{last_id}: {'fixed' if repair else 'found'} {drifted}")
+        drifted_total += drifted
+
+    log(f"User counters {'reconciled' if repair else 'checked'}, "
+        f"{drifted_total} users {'fixed' if repair else 'drifted'}")
+    return drifted_total
@@ -0,0 +1,363 @@
+"""Versioned JSON API, mounted at /api/v1.
+
+Responses are {"data": ...}; lists add "next" / "prev" cursors, passed
+back as ?after= / ?before= (see pagination.py), and ?per_page=.
+?fields=id,title limits the fields returned (and, for books, the columns
+loaded). GET /api/v1/books/batch?ids=1,2,3 resolves many books at once.
+
+The API uses the same session login as the site, and like the site
+shows users, their lists, ratings, reviews and follows only to logged-in
+clients. Writes require a JSON
+body (Content-Type: application/json), which a cross-site form cannot
+send, and answer with the changed resource.
+Errors are {"error": {"status": ..., "message": ...}}.
+"""
+
+from flask import Blueprint, abort, g, jsonify, request
+from sqlalchemy.orm import load_only
+from werkzeug.exceptions import HTTPException, Unauthorized
+
+from models import db, Book, BookList, Follows, Rating, Review, User
+from pagination import keyset_paginate
+from fragments import invalidate
+from replica import read_replica
+from principal import UserGone
+from api_helper import get_all_categories, get_books_by_category, last_good_books, nyt_degraded
+from nyt_mirror import mirrored_categories, mirrored_books
+
+
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+MAX_BATCH = 100
+
+BOOK_FIELDS = ('id', 'title', 'author', 'image', 'description', 'category',
+               'avg_rating', 'num_of_ratings', 'num_of_reviews')
+USER_FIELDS = ('id', 'username', 'followers_count', 'following_count',
+               'booklist_count', 'reviews_count', 'ratings_count')
+REVIEW_FIELDS = ('id', 'book_id', 'user_id', 'summary', 'url')
+RATING_FIELDS = ('id', 'book_id', 'user_id', 'score')
+NYT_BOOK_FIELDS = ('title', 'author', 'image', 'description')
+
+# Book fields that are computed from other columns
+BOOK_FIELD_COLUMNS = {'avg_rating': ('rating_sum', 'num_of_ratings')}
+
+
+##########################################################################
+# Helpers
+
+def requested_fields(allowed):
+    """Return the fields named in ?fields=, or all of `allowed`"""
+
+    raw = request.args.get('fields')
+    if not raw:
+        return allowed
+
+    fields = tuple(field for field in raw.split(',') if field)
+    unknown = sorted(set(fields) - set(allowed))
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}")
+
+    return fields
+
+
+def serialize(obj, fields):
+    if isinstance(obj, dict):
+        return {field: obj.get(field) for field in fields}
+    return {field: getattr(obj, field) for field in fields}
+
+
+def book_query(fields):
+    """Book query loading only the columns the fields need (plus id and title)"""
+
+    columns = {'id', 'title'}
+    for field in fields:
+        columns.update(BOOK_FIELD_COLUMNS.get(field, (field,)))
+    return Book.query.options(load_only(*sorted(columns)))
+
+
+def page_response(page, fields):
+    return jsonify({
+        "data": [serialize(item, fields) for item in page.items],
+        "next": page.next_cursor,
+        "prev": page.prev_cursor,
+    })
+
+
+def login_required():
+    if not g.user:
+        abort(401, "Please log in")
+
+
+def json_body():
+    """Return the request's JSON object, rejecting anything else"""
+
+    body = request.get_json(silent=True) if request.is_json else None
+    if not isinstance(body, dict):
+        abort(400, "Expected a JSON object with Content-Type: application/json")
+    return body
+
+
+@api_v1.errorhandler(HTTPException)
+def json_error(error):
+    # abort(response) raises an HTTPException without a code
+    status = error.code or 500
+    return jsonify({"error": {"status": status, "message": error.description}}), status
+
+
+@api_v1.errorhandler(UserGone)
+def user_gone(error):
+    """The session's user was deleted; the session is already logged out"""
+
+    return json_error(Unauthorized("Please log in"))
+
+
+##########################################################################
+# Books
+
+@api_v1.route('/books')
+@read_replica
+def list_books():
+    fields = requested_fields(BOOK_FIELDS)
+    page = keyset_paginate(book_query(fields), [Book.title, Book.id], key=lambda book: (book.title, book.id))
+    return page_response(page, fields)
+
+
+@api_v1.route('/books/batch')
+@read_replica
+def batch_books():
+    """Resolve up to MAX_BATCH book ids in one query, in the order asked"""
+
+    fields = requested_fields(BOOK_FIELDS)
+
+    try:
+        ids = [int(book_id) for book_id in request.args.get('ids', '').split(',') if book_id]
+    except ValueError:
+        abort(400, "ids must be comma separated integers")
+
+    if not ids:
+        abort(400, "ids is required")
+    if len(ids) > MAX_BATCH:
+        abort(400, f"At most {MAX_BATCH} ids per request")
+
+    books = {book.id: book for book in book_query(fields).filter(Book.id.in_(ids))}
+
+    return jsonify({
+        "data": [serialize(books[book_id], fields) for book_id in ids if book_id in books],
+        "missing": [book_id for book_id in ids if book_id not in books],
+    })
+
+
+@api_v1.route('/books/<int:book_id>')
+@read_replica
+def show_book(book_id):
+    fields = requested_fields(BOOK_FIELDS)
+    book = book_query(fields).filter(Book.id == book_id).first_or_404()
+    return jsonify({"data": serialize(book, fields)})
+
+
+@api_v1.route('/books/<int:book_id>/reviews')
+@read_replica
+def list_book_reviews(book_id):
+    fields = requested_fields(REVIEW_FIELDS)
+    page = keyset_paginate(Review.query.filter(Review.book_id == book_id), [Review.id],
+                           key=lambda review: (review.id,))
+    return page_response(page, fields)
+
+
+@api_v1.route('/books/<int:book_id>/reviews', methods=['POST'])
+def add_book_review(book_id):
+    login_required()
+    body = json_body()
+    Book.query.get_or_404(book_id)
+
+    summary = (body.get('summary') or '').strip()
+    if not summary:
+        abort(400, "summary is required")
+
+    if not Review.add(g.user.id, book_id, summary, body.get('url')):
+        db.session.rollback()
+        abort(409, "You have already reviewed this book")
+
+    invalidate('book', book_id)
+    invalidate('user', g.user.id)
+    db.session.commit()
+
+    review = Review.query.filter(Review.user_id == g.user.id, Review.book_id == book_id).one()
+    return jsonify({"data": serialize(review, REVIEW_FIELDS)}), 201
+
+
+@api_v1.route('/books/<int:book_id>/rating', methods=['PUT'])
+def rate_book(book_id):
+    login_required()
+    score = json_body().get('score')
+    Book.query.get_or_404(book_id)
+
+    if score not in range(1, 6) or isinstance(score, bool):
+        abort(400, "score must be an integer from 1 to 5")
+
+    Rating.rate(g.user.id, book_id, score)
+    invalidate('book', book_id)
+    invalidate('user', g.user.id)
+    db.session.commit()
+
+    rating = Rating.query.filter(Rating.user_id == g.user.id, Rating.book_id == book_id).one()
+    return jsonify({"data": serialize(rating, RATING_FIELDS)})
+
+
+@api_v1.route('/books/<int:book_id>/rating', methods=['DELETE'])
+def unrate_book(book_id):
+    login_required()
+
+    Rating.unrate(g.user.id, book_id)
+    invalidate('book', book_id)
+    invalidate('user', g.user.id)
+    db.session.commit()
+
+    return '', 204
+
+
+##########################################################################
+# Users, booklists, ratings, reviews and follows
+
+@api_v1.route('/users/<int:user_id>')
+@read_replica
+def show_user(user_id):
+    login_required()
+    fields = requested_fields(USER_FIELDS)
+    user = User.query.get_or_404(user_id)
+    return jsonify({"data": serialize(user, fields)})
+
+
+@api_v1.route('/users/<int:user_id>/booklist')
+@read_replica
+def list_user_booklist(user_id):
+    """Books on a user's list, in the order they were added"""
+
+    login_required()
+    fields = requested_fields(BOOK_FIELDS)
+    query = (book_query(fields)
+             .add_columns(BookList.id.label('entry_id'))
+             .join(BookList, BookList.book_id == Book.id)
+             .filter(BookList.user_id == user_id))
+    page = keyset_paginate(query, [BookList.id], key=lambda row: (row.entry_id,))
+    page.items = [row[0] for row in page.items]
+    return page_response(page, fields)
+
+
+@api_v1.route('/users/me/booklist/<int:book_id>', methods=['PUT', 'DELETE'])
+def change_my_booklist(book_id):
+    login_required()
+    Book.query.get_or_404(book_id)
+
+    if request.method == 'PUT':
+        json_body()
+        changed = BookList.add(g.user.id, book_id)
+    else:
+        changed = BookList.remove(g.user.id, book_id)
+
+    if changed:
+        Book.touch(book_id)
+        invalidate('book', book_id)
+        invalidate('user', g.user.id)
+    db.session.commit()
+
+    return '', 204
+
+
+@api_v1.route('/users/<int:user_id>/ratings')
+@read_replica
+def list_user_ratings(user_id):
+    login_required()
+    fields = requested_fields(RATING_FIELDS)
+    page = keyset_paginate(Rating.query.filter(Rating.user_id == user_id), [Rating.id],
+                           key=lambda rating: (rating.id,))
+    return page_response(page, fields)
+
+
+@api_v1.route('/users/<int:user_id>/reviews')
+@read_replica
+def list_user_reviews(user_id):
+    login_required()
+    fields = requested_fields(REVIEW_FIELDS)
+    page = keyset_paginate(Review.query.filter(Review.user_id == user_id), [Review.id],
+                           key=lambda review: (review.id,))
+    return page_response(page, fields)
+
+
+@api_v1.route('/users/<int:user_id>/followers')
+@read_replica
+def list_followers(user_id):
+    login_required()
+    fields = requested_fields(USER_FIELDS)
+    query = User.query.join(Follows, Follows.user_following_id == User.id).filter(
+        Follows.user_being_followed_id == user_id)
+    page = keyset_paginate(query, [User.username, User.id], key=lambda user: (user.username, user.id))
+    return page_response(page, fields)
+
+
+@api_v1.route('/users/<int:user_id>/following')
+@read_replica
+def list_following(user_id):
+    login_required()
+    fields = requested_fields(USER_FIELDS)
+    query = User.query.join(Follows, Follows.user_being_followed_id == User.id).filter(
+        Follows.user_following_id == user_id)
+    page = keyset_paginate(query, [User.username, User.id], key=lambda user: (user.username, user.id))
+    return page_response(page, fields)
+
+
+@api_v1.route('/users/me/following/<int:user_id>', methods=['PUT', 'DELETE'])
+def change_my_following(user_id):
+    login_required()
+    User.query.get_or_404(user_id)
+
+    if request.method == 'PUT':
+        json_body()
+        g.user.follow(user_id)
+    else:
+        g.user.unfollow(user_id)
+    db.session.commit()
+
+    return '', 204
+
+
+##########################################################################
+# NYT results
+
+@api_v1.route('/nyt/categories')
+def list_nyt_categories():
+    """Bestseller categories, from the mirror, the API or the last good copy"""
+
+    stale = nyt_degraded()
+
+    try:
+        categories = mirrored_categories() or get_all_categories()
+    except Exception:
+        categories = get_all_categories.last_good()
+        stale = True
+
+        if not categories:
+            abort(503, "Bestseller data is unavailable, please try again later")
+
+    return jsonify({"data": categories, "stale": stale})
+
+
+@api_v1.route('/nyt/lists/<category>')
+def show_nyt_list(category):
+    """Current bestsellers in a category, from the mirror, the API or the last good copy"""
+
+    fields = requested_fields(NYT_BOOK_FIELDS)
+    stale = nyt_degraded()
+
+    try:
+        books = mirrored_books(category)
+        if books is None:
+            books = get_books_by_category(category)
+    except Exception:
+        books = last_good_books(category)
+        stale = True
+
+        if books is None:
+            abort(503, "Bestseller data is unavailable, please try again later")
+
+    return jsonify({"data": [serialize(book, fields) for book in books], "stale": stale})
@@ -1,20 +1,109 @@
-import requests
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
-from confidential import API_SECRET_KEY
+from cache import make_cache
+from json_stream import iter_array_items, read_chunks
+from nyt_client import client_from_env
+from singleflight import SingleFlight
 
+try:
+    from confidential import API_SECRET_KEY
+except ImportError:
+    # No key file, e.g. when running against the local stand-in (nyt_stub.py)
+    API_SECRET_KEY = os.environ.get('NYT_API_KEY')
 
-API_BASE_URL = 'https://api.nytimes.com/svc/books/v3/'
 
 key = API_SECRET_KEY
 
+# One pooled client shared by every helper; NYT_API_BASE_URL can point it elsewhere.
+client = client_from_env(api_key=key)
 
+# Concurrent fetches of the same URL share one request, within a worker and,
+# through lock files, across the gunicorn workers on this host.
+flight = SingleFlight(
+    lock_dir=os.environ.get('NYT_SINGLEFLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'bookgenie-nyt')),
+    share_seconds=float(os.environ.get('NYT_SINGLEFLIGHT_SHARE_SECONDS', 5))
+)
+
+# NYT lists are republished about once a week, so entries stay fresh for hours
+# and an expired entry may still be served for a day while it is refreshed.
+CATEGORIES_TTL = int(os.environ.get('NYT_CATEGORIES_TTL', 24 * 60 * 60))
+BOOKS_BY_CATEGORY_TTL = int(os.environ.get('NYT_BOOKS_BY_CATEGORY_TTL', 6 * 60 * 60))
+STALE_TTL = int(os.environ.get('NYT_STALE_TTL', 24 * 60 * 60))
+WARM_CONCURRENCY = int(os.environ.get('NYT_WARM_CONCURRENCY', 8))
+
+# Shared by all workers on the host when CACHE_BACKEND=sqlite
+nyt_cache = make_cache(
+    'nyt',
+    maxsize=int(os.environ.get('NYT_CACHE_MAXSIZE', 128)),
+    stale_ttl=STALE_TTL
+)
+
+
+def cache_stats():
+    """Return hit/miss counters for the NYT cache"""
+
+    return nyt_cache.stats()
+
+
+def latency_stats():
+    """Return per-endpoint latency of calls made to the NYT API"""
+
+    return client.latency.stats()
+
+
+def nyt_degraded():
+    """Is the NYT circuit breaker open (or probing), i.e. is the API failing?"""
+
+    return client.breaker.state != client.breaker.CLOSED
+
+
+def get_json(path, params=None):
+    """GET an API path, sharing the response with concurrent callers for the same path and params"""
+
+    key = f"{path}?{urlencode(sorted((params or {}).items()))}"
+    return flight.do(key, lambda: client.get_json(path, params))
+
+
+def encode_category(category):
+    """Return the NYT list_name_encoded form of a category name"""
+
+    return category.strip().lower().replace(' ', '-')
+
+
+def fetch_list_names():
+    """Return the raw list name records from API"""
+
+    data = get_json("lists/names.json")
+    return data["results"]
+
+
+def fetch_current_list(category):
+    """Return the raw current list (metadata and books) for a category from API"""
+
+    data = get_json(f"lists/current/{category}.json")
+    return data["results"]
+
+
+def format_book(book):
+    """Keep only the fields the app shows for an API book"""
+
+    return {
+        "title": book['title'],
+        "author": book['author'],
+        "image" : book['book_image'],
+        "description":book['description']
+    }
+
+
+@nyt_cache.memoize(ttl=CATEGORIES_TTL)
 def get_all_categories():
     """Return all categories from API"""
 
-    res = requests.get(f"{API_BASE_URL}lists/names.json?api-key={key}")
-    
-    data = res.json()
-    results = data["results"]
+    results = fetch_list_names()
     
     categories = [result['list_name_encoded'] for result in results]
     categories_result = list(dict.fromkeys(categories))
@@ -23,41 +112,137 @@ def get_all_categories():
     return categories
 
 
+def normalize_title(title):
+    """Return the lookup key for a book title (case and spacing insensitive)"""
+
+    return ' '.join(title.split()).casefold()
+
+
+def build_listing(books):
+    """Return formatted books together with an index by normalized title"""
+
+    books = [format_book(book) for book in books]
+
+    by_title = {}
+    for book in books:
+        by_title.setdefault(normalize_title(book['title']), book)
+
+    return {"books": books, "by_title": by_title}
+
+
+@nyt_cache.memoize(ttl=BOOKS_BY_CATEGORY_TTL)
+def get_category_listing(encoded_category):
+    """Return a category's books from API together with an index by normalized title"""
+
+    results = fetch_current_list(encoded_category)
+    return build_listing(results["books"])
+
+
 def get_books_by_category(category):
     """Return all bestselling titles for specific category from API"""
 
-    res = requests.get(f"{API_BASE_URL}lists/current/{category}.json?api-key={key}")
-    
+    return get_category_listing(encode_category(category))["books"]
 
-    data = res.json()
-    results = data["results"]
-    books = results["books"]
 
-    book_results = []
-    for book in books:
-        book = {
-            "title": book['title'],
-            "author": book['author'],
-            "image" : book['book_image'],
-            "description":book['description']
-        }
-        book_results.append(book)
-    return book_results
+def last_good_books(category):
+    """Return the last books fetched for a category, however old, or None"""
+
+    listing = get_category_listing.last_good(encode_category(category))
+    return listing["books"] if listing else None
+
+
+def get_book_by_category_title(category, title):
+    """Return the book with this title in a category's current list, or None"""
+
+    listing = get_category_listing(encode_category(category))
+    return listing["by_title"].get(normalize_title(title))
 
 
 def get_book_by_title_author(title, author):
     """Return book with specific title and author from API"""
 
-    res = requests.get(f"{API_BASE_URL}lists/best-sellers/history.json?api-key={key}",
+    data = get_json("lists/best-sellers/history.json",
                 params={'title': title, 'author': author})
-
-    data = res.json()
     results = data["results"]
 
     return results
 
 
+def iter_overview_lists(source=None):
+    """Yield every list in an NYT overview payload, one at a time.
+
+    `source` is a path to a local dump in the shape of lists/overview.json;
+    by default the payload is streamed from API. Each list is yielded as
+    a dict with 'list_name_encoded', 'display_name', 'published_date' and
+    raw 'books', parsed as it arrives rather than after the whole payload.
+    """
+
+    if source is None:
+        chunks = client.iter_chunks("lists/overview.json")
+    else:
+        chunks = read_chunks(source)
+
+    # Filled with the scalar fields before "lists", including results.published_date
+    fields = {}
+    for item in iter_array_items(chunks, "lists", fields_out=fields):
+        yield {
+            "list_name_encoded": item['list_name_encoded'],
+            "display_name": item.get('display_name') or item.get('list_name'),
+            "published_date": fields.get('published_date') or None,
+            "books": item.get('books', [])
+        }
+
+
+def ingest_overview(source=None, on_list=None):
+    """Fill the category cache from one overview payload instead of one request per list.
+    Calls on_list(list) for each list (e.g. to mirror it). Returns the encoded names seen."""
+
+    encoded_names = []
+
+    for overview_list in iter_overview_lists(source):
+        encoded = overview_list['list_name_encoded']
+        get_category_listing.prime(build_listing(overview_list['books']), encoded)
+        encoded_names.append(encoded)
+
+        if on_list is not None:
+            on_list(overview_list)
+
+    return encoded_names
+
+
+def warm_cache(concurrency=None):
+    """Fetch the category list once, then every category's current list concurrently.
+
+    Returns a report comparing the wall time against the sequential
+    baseline, i.e. the sum of the individual fetch times.
+    """
+
+    concurrency = concurrency or WARM_CONCURRENCY
+    start = time.perf_counter()
+
+    categories = get_all_categories.refresh()
 
+    def warm(category):
+        fetch_start = time.perf_counter()
+        try:
+            get_category_listing.refresh(encode_category(category))
+            return category, time.perf_counter() - fetch_start, None
+        except Exception as e:
+            return category, time.perf_counter() - fetch_start, e
 
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='nyt-warm') as pool:
+        results = list(pool.map(warm, categories))
 
+    wall = time.perf_counter() - start
+    sequential = sum(elapsed for _, elapsed, _ in results)
+    failed = [category for category, _, error in results if error is not None]
 
+    return {
+        "categories": len(categories),
+        "warmed": len(categories) - len(failed),
+        "failed": failed,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "sequential_seconds": round(sequential, 3),
+        "speedup": round(sequential / wall, 2) if wall else None,
+    }
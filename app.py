@@ -2,20 +2,43 @@ import os
 import pdb
 import requests
 import re
+import threading
+import time
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, abort
 
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from models import db, connect_db, User, Book, Review, BookList, Follows, Rating
 
 from forms import AddUserForm, EditUserForm, LoginForm, SearchForm, AddReviewForm, EditReviewForm
 
-from api_helper import get_all_categories, get_books_by_category
+from api_helper import get_all_categories, get_books_by_category, get_book_by_category_title, warm_cache
+from api_helper import last_good_books, nyt_degraded, ingest_overview, cache_stats, latency_stats
 
+from migrations import upgrade, pending_migrations
 
-CURR_USER_KEY = "curr_user"
+from aggregates import reconcile_rating_aggregates, reconcile_user_counters
+
+from nyt_mirror import sync_bestsellers, sync_overview, mirrored_categories, mirrored_books, mirrored_list_version
+
+from pagination import keyset_paginate, page_url
+
+from search import search_users, search_books
+
+from replica import read_replica, replica_binds
+
+from principal import CURR_USER_KEY, UserGone, current_user, remember_user, forget_user
+
+from fragments import fragment, invalidate, fragment_stats
+
+from conditional import conditional
+from passwords import password_stats
+
+from api import api_v1
 
 app = Flask(__name__)
 
@@ -27,6 +50,9 @@ if uri.startswith("postgres://"):
     uri = uri.replace("postgres://", "postgresql://", 1)
 app.config['SQLALCHEMY_DATABASE_URI'] = uri
 
+# Optional read replica for routes decorated with @read_replica (see replica.py)
+app.config['SQLALCHEMY_BINDS'] = replica_binds(os.environ.get('DATABASE_REPLICA_URL')) or None
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
@@ -35,22 +61,108 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 
 toolbar = DebugToolbarExtension(app)
 
+app.jinja_env.globals['page_url'] = page_url
+app.jinja_env.globals['fragment'] = fragment
+
+app.register_blueprint(api_v1)
+
 connect_db(app)
 
-# db.drop_all()
-db.create_all()
+# Schema changes are applied by `flask db-upgrade` (see migrations.py),
+# not at import time.
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations"""
+
+    upgrade(db.engine, log=click.echo)
+
+
+@app.cli.command('db-status')
+def db_status_command():
+    """List schema migrations not yet applied"""
+
+    pending = pending_migrations(db.engine)
+    for migration in pending:
+        click.echo(f"pending {migration.version}: {migration.description}")
+    if not pending:
+        click.echo("Database schema is up to date")
+
+
+@app.cli.command('reconcile-ratings')
+@click.option('--batch-size', type=int, default=500, help="Books per transaction.")
+def reconcile_ratings_command(batch_size):
+    """Rebuild book rating sums and counts that drifted from the ratings table"""
+
+    reconcile_rating_aggregates(batch_size, log=click.echo)
+
+
+@app.cli.command('reconcile-counters')
+@click.option('--batch-size', type=int, default=500, help="Users per transaction.")
+@click.option('--check', is_flag=True, help="Only report drifted users; exit 1 if any are found.")
+def reconcile_counters_command(batch_size, check):
+    """Rebuild user follower, following, booklist, review and rating counts that drifted"""
+
+    drifted = reconcile_user_counters(batch_size, repair=not check, log=click.echo)
+    if check and drifted:
+        raise SystemExit(1)
+
+
+@app.cli.command('sync-nyt')
+@click.option('--every', type=int, default=0, help="Repeat every N seconds instead of running once.")
+@click.option('--overview', is_flag=True, help="Use the single lists/overview.json payload.")
+@click.option('--dump', type=click.Path(exists=True), default=None, help="Read an overview payload from this file.")
+def sync_nyt_command(every, overview, dump):
+    """Mirror NYT bestseller lists into the database"""
+
+    while True:
+        if overview or dump:
+            sync_overview(dump, log=click.echo)
+        else:
+            sync_bestsellers(log=click.echo)
+
+        if not every:
+            break
+        time.sleep(every)
+
+
+@app.cli.command('warm-cache')
+@click.option('--concurrency', type=int, default=None, help="Parallel NYT requests (default NYT_WARM_CONCURRENCY).")
+@click.option('--overview', is_flag=True, help="Fill the cache from the single lists/overview.json payload.")
+@click.option('--dump', type=click.Path(exists=True), default=None, help="Read an overview payload from this file.")
+def warm_cache_command(concurrency, overview, dump):
+    """Prefetch every NYT category list into the cache"""
+
+    if overview or dump:
+        start = time.perf_counter()
+        encoded_names = ingest_overview(dump)
+        click.echo(f"Warmed {len(encoded_names)} lists from overview in {time.perf_counter() - start:.3f}s")
+        return
+
+    report = warm_cache(concurrency)
+    click.echo(f"Warmed {report['warmed']}/{report['categories']} lists in {report['wall_seconds']}s "
+               f"(sequential {report['sequential_seconds']}s, {report['speedup']}x, "
+               f"concurrency {report['concurrency']})")
+    if report['failed']:
+        click.echo(f"Failed: {', '.join(report['failed'])}")
+
+
+if os.environ.get('NYT_WARM_ON_BOOT'):
+    threading.Thread(target=warm_cache, name='nyt-warm-on-boot', daemon=True).start()
 
    
 
 def add_book_to_database(category, title):
-    """Get specific from NYT api and add to database"""  
+    """Get specific book from NYT api and add it to database unless it's already there.
+    Return the book's id, or None if the book isn't on the list."""  
 
-    book_results = get_books_by_category(category)
-    
-    books = [book for book in book_results if book['title']==title]
-    book = books[0]
+    book = get_book_by_category_title(category, title)
 
-    book = Book(
+    if book is None:
+        return None
+
+    return Book.get_or_create(
                 title = book['title'],
                 author = book['author'],
                 image = book['image'],
@@ -58,9 +170,42 @@ def add_book_to_database(category, title):
                 category = category
             )
 
-    db.session.add(book)
-    db.session.commit()
-    return book
+
+##########################################################################
+# Page versions for conditional GET: (parts, last_modified) or None
+
+NYT_PAGE_MAX_AGE = int(os.environ.get('NYT_PAGE_MAX_AGE', 300))
+
+
+def results_page_version():
+    category = request.args.get('category')
+    version = mirrored_list_version(category) if category else None
+
+    if version is None:
+        return None
+
+    published_date, updated_at = version
+    return (published_date, updated_at, nyt_degraded()), updated_at
+
+
+def books_page_version():
+    count, updated_at = Book.list_version()
+    return (count, updated_at), updated_at
+
+
+def book_page_version(book_id):
+    updated_at = db.session.query(Book.updated_at).filter(Book.id == book_id).scalar()
+    return None if updated_at is None else ((updated_at,), updated_at)
+
+
+def booklists_page_version():
+    count, newest_id, users_updated_at = BookList.all_lists_version()
+    return (count, newest_id, users_updated_at), users_updated_at
+
+
+def user_page_version(user_id):
+    updated_at = db.session.query(User.updated_at).filter(User.id == user_id).scalar()
+    return None if updated_at is None else ((updated_at,), updated_at)
 
 
 ##########################################################################
@@ -87,41 +232,61 @@ def show_home2():
 
 @app.route('/')
 def show_home():
-    """Render home page including search bar for selecting a category"""
+    """Render home page including search bar for selecting a category.
+    If the NYT API is down, render from the last categories fetched
+    (never redirect to itself)."""
 
     form = SearchForm()
+    stale_data = False
 
     try: 
-        categories = get_all_categories()
+        categories = mirrored_categories() or get_all_categories()
 
-        #form.category.choices = [category.title().replace('-', " ") for category in categories]
+    except Exception as e:
+        categories = get_all_categories.last_good()
+        stale_data = True
 
-        form.category.choices = [category for category in categories]
+        if not categories:
+            categories = []
+            flash("We are experiencing some technical difficulties. Please try again later", "danger")
 
-        return render_template('home.html', form=form, categories=categories)
+    #form.category.choices = [category.title().replace('-', " ") for category in categories]
 
-    except Exception as e:
-        flash("We are experiencing some technical difficulties. Please try again later", "danger")
+    form.category.choices = [category for category in categories]
 
-        return redirect("/")
+    return render_template('home.html', form=form, categories=categories,
+                           stale_data=stale_data or nyt_degraded())
 
     
 
 @app.route('/results', methods=["GET"])
+@conditional(results_page_version, public_max_age=NYT_PAGE_MAX_AGE)
 def show_results_from_nyt_api():
-    """Handle search form on home page and return results from NYT API"""
+    """Handle search form on home page and return results from NYT API.
+    If the NYT API is down, render the last results fetched for the category."""
 
     category = request.args.get('category')
 
-    try: 
-        book_results = get_books_by_category(category)
+    if not category:
+        return redirect("/")
+
+    stale_data = False
 
-        return render_template('results.html', book_results=book_results, category=category)
+    try: 
+        book_results = mirrored_books(category)
+        if book_results is None:
+            book_results = get_books_by_category(category)
 
     except Exception as e:
-        flash("We are experiencing some technical difficulties. Please try again later", "danger")
-        
-        return redirect("/")
+        book_results = last_good_books(category)
+        stale_data = True
+
+        if book_results is None:
+            flash("We are experiencing some technical difficulties. Please try again later", "danger")
+            return redirect("/")
+
+    return render_template('results.html', book_results=book_results, category=category,
+                           stale_data=stale_data or nyt_degraded())
 
     
 
@@ -130,9 +295,8 @@ def show_details_for_book_from_nyt_api(category, book_title):
     """Show details from NYT api for specific book"""
 
     try: 
-        book_results = get_books_by_category(category)
-    
-        books = [book for book in book_results if book['title']==book_title]
+        book = get_book_by_category_title(category, book_title)
+        books = [book] if book else []
       
         return render_template('books/book_details.html', books=books, category=category)
 
@@ -151,25 +315,24 @@ def add_new_book_to_list(category, book_title):
         flash("Please signup and/or login.", "danger")
         return redirect("/")
 
-    exists = db.session.query(db.exists().where(Book.title == book_title.upper())).scalar()
+    # A book that is already saved needs no NYT call, so this works while the API is down.
+    # If several saved books share the title, the NYT list tells which author is meant.
+    book_id = Book.id_for_title(book_title)
 
-    if exists:
-        new_book = Book.query.filter_by(title=book_title.upper()).first()
+    if book_id is None:
+        book_id = add_book_to_database(category, book_title)
 
-    else:
-        new_book = add_book_to_database(category, book_title)   
+        if book_id is None:
+            flash("This book is no longer on the bestseller list", "danger")
+            return redirect("/")
     
-    booklist = BookList.query.filter(BookList.user_id==g.user.id, BookList.book_id==new_book.id).all()
-
-    if not booklist:
-        new_book = BookList(
-            user_id = g.user.id,
-            book_id = new_book.id
-            )
-
-        db.session.add(new_book)
-        db.session.commit()
+    added = BookList.add(g.user.id, book_id)
+    Book.touch(book_id)
+    invalidate('book', book_id)
+    invalidate('user', g.user.id)
+    db.session.commit()
 
+    if added:
         flash("Book added to your list", "success")
     else:
         flash("Book already on your list", "danger")
@@ -183,25 +346,27 @@ def add_new_book_to_list(category, book_title):
 
 @app.before_request
 def add_user_to_g():
-    """If the user is logged in, add them to Flask global"""
+    """If the user is logged in, add them to Flask global.
+    g.user is a LazyUser: its id and username come from the session, and
+    the User row is only loaded if a route or template needs more, or
+    before a write, so no row is written for a user deleted since login."""
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-    else:
-        g.user = None
+    g.user = current_user()
+
+    if g.user and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        g.user.load()
 
 
 def do_login(user):
     """Log in user"""
 
-    session[CURR_USER_KEY] = user.id
+    remember_user(user)
 
 
 def do_logout():
     """Logout user"""
 
-    if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
+    forget_user()
        
 
 ##########################################################################
@@ -285,16 +450,21 @@ def list_users():
 
     search = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
+    if search:
+        page = search_users(search)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%".title())).all()
+        page = keyset_paginate(User.query, [User.username, User.id], key=lambda user: (user.username, user.id))
+    users = page.items
 
-    return render_template('users/index.html', users=users)
+    followed_ids = g.user.following_ids_among(user.id for user in users)
+
+    return render_template('users/index.html', users=users, page=page, followed_ids=followed_ids)
 
 
 
 @app.route('/users/<int:user_id>')
+@read_replica
+@conditional(user_page_version, login_required=True)
 def show_user_profile(user_id):
     """Show all information on user including books saved and reviews created by user from the database ."""
 
@@ -317,7 +487,9 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    followed_ids = g.user.following_ids_among(followed_user.id for followed_user in user.following)
+
+    return render_template('users/following.html', user=user, followed_ids=followed_ids)
 
 
 
@@ -330,7 +502,9 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    followed_ids = g.user.following_ids_among(follower.id for follower in user.followers)
+
+    return render_template('users/followers.html', user=user, followed_ids=followed_ids)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -341,8 +515,8 @@ def add_follow(follow_id):
         flash("Please signup and/or login.", "danger")
         return redirect("/")
 
-    follow_id = User.query.get_or_404(follow_id)
-    g.user.following.append(follow_id)
+    followed_user = User.query.get_or_404(follow_id)
+    g.user.follow(followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -356,8 +530,7 @@ def stop_following(follow_id):
         flash("Please signup and/or login.", "danger")
         return redirect("/")
 
-    follow_id = User.query.get(follow_id)
-    g.user.following.remove(follow_id)
+    g.user.unfollow(follow_id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -371,15 +544,16 @@ def edit_profile():
         flash("Please signup and/or login.", "danger")
         return redirect("/")
 
-    user = g.user
+    user = g.user.load()
     form = EditUserForm(obj=user)
 
     if form.validate_on_submit():
-        if User.authenticate(user.username, form.password.data):
+        if user.check_password(form.password.data):
             user.username = form.username.data
             user.email = form.email.data
 
             db.session.commit()
+            do_login(user)
             return redirect(f"/users/{user.id}")
 
         flash("BookGenie is unable to verify your password, please try again.", 'danger')
@@ -395,9 +569,19 @@ def delete_user():
         flash("Please signup and/or login.", "danger")
         return redirect("/")
 
+    user = g.user.load()
     do_logout()
 
-    db.session.delete(g.user)
+    # Pages of books the user listed, reviewed or rated change when those rows go
+    book_ids = user.shown_book_ids()
+    if book_ids:
+        Book.touch(*book_ids)
+    for book_id in book_ids:
+        invalidate('book', book_id)
+
+    Rating.unrate_all_for_user(user.id)
+    User.unfollow_all(user.id)
+    db.session.delete(user)
     db.session.commit()
 
     return redirect("/signup")
@@ -425,9 +609,10 @@ def show_user_reviews(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    reviews = Review.query.filter(Review.user_id==user_id).all()
+    page = keyset_paginate(Review.query.filter(Review.user_id==user_id).options(joinedload(Review.book)),
+                           [Review.id], key=lambda review: (review.id,))
       
-    return render_template('users/reviews.html', user=user, reviews=reviews)
+    return render_template('users/reviews.html', user=user, reviews=page.items, page=page)
 
 
 @app.route('/users/<int:user_id>/ratings', methods=["GET"])
@@ -439,24 +624,56 @@ def show_user_ratings(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    ratings = Rating.query.filter(Rating.user_id==user_id).all()
+    page = keyset_paginate(Rating.query.filter(Rating.user_id==user_id).options(joinedload(Rating.book)),
+                           [Rating.id], key=lambda rating: (rating.id,))
 
-    return render_template('users/ratings.html', user=user, ratings=ratings)
+    return render_template('users/ratings.html', user=user, ratings=page.items, page=page)
+
+
+###########################################################################
+# SEARCH ROUTES
+
+@app.route('/search')
+def search():
+    """Search saved books, or users with ?type=users.
+    Takes a 'q' param in querystring; results are ranked best match first."""
+
+    search = request.args.get('q', '').strip()
+    search_type = 'users' if request.args.get('type') == 'users' else 'books'
+
+    if search_type == 'users' and not g.user:
+        flash("Please signup and/or login.", "danger")
+        return redirect("/")
+
+    page = None
+    followed_ids = set()
+
+    if search:
+        page = search_users(search) if search_type == 'users' else search_books(search)
+        if search_type == 'users':
+            followed_ids = g.user.following_ids_among(user.id for user in page.items)
+
+    return render_template('search.html', search=search, search_type=search_type,
+                           page=page, followed_ids=followed_ids)
 
 
 ###########################################################################
 # BOOKS ROUTES
 
 @app.route("/books")
+@read_replica
+@conditional(books_page_version)
 def show_all_books():
     """Show list of all books in database"""
 
-    books = Book.query.order_by(Book.title).all()
-    return render_template("books/index.html", books=books)
+    page = keyset_paginate(Book.query, [Book.title, Book.id], key=lambda book: (book.title, book.id))
+    return render_template("books/index.html", books=page.items, page=page)
 
 
 
 @app.route("/books/<int:book_id>")
+@read_replica
+@conditional(book_page_version, login_required=True)
 def show_book_details_from_db(book_id):
     """Display details about a specific book in database including reviews, users and ratings"""
 
@@ -482,28 +699,20 @@ def rate_book(book_id):
         flash("Please signup and/or login.", "danger")
         return redirect("/")
    
-    new_score = request.form.get("book-rating")
-    book = Book.query.get_or_404(book_id)
-    user_id = g.user.id
-
-    rating = Rating.query.filter(Rating.user_id==user_id, Rating.book_id==book_id).first()
+    try:
+        new_score = int(request.form.get("book-rating"))
+    except (TypeError, ValueError):
+        new_score = None
 
-    if not rating:
-        rating = Rating(score=new_score, user_id=user_id, book_id=book_id)
-    else: 
-        rating.score = new_score
-
-    db.session.add(rating)
-    
-    rating_scores = [int(rating.score) for rating in book.ratings]
-    if rating_scores:
-        avg_rating = round(sum(rating_scores) / len(rating_scores), 2)
-    
-    book.avg_rating = avg_rating
+    book = Book.query.get_or_404(book_id)
 
-    num_of_ratings = len(rating_scores)
-    book.num_of_ratings = num_of_ratings
+    if new_score not in range(1, 6):
+        flash("Please choose a rating from 1 to 5", "danger")
+        return redirect(f"/books/{book.id}")
 
+    Rating.rate(g.user.id, book.id, new_score)
+    invalidate('book', book.id)
+    invalidate('user', g.user.id)
     db.session.commit()
 
     return redirect(f"/books/{book.id}")
@@ -512,12 +721,17 @@ def rate_book(book_id):
 # BOOKLISTS ROUTES
 
 @app.route("/booklists")
+@read_replica
+@conditional(booklists_page_version)
 def show_all_booklists():
     """Show list of all booklists in database"""
 
-    booklists = BookList.query.all()
-    users = User.query.all()
-    return render_template("booklists/index.html", booklists=booklists, users=users)
+    with_booklist = db.exists().where(BookList.user_id == User.id)
+    page = keyset_paginate(db.session.query(User.id).filter(with_booklist),
+                           [User.id], key=lambda row: (row.id,))
+
+    users = BookList.grouped_by_user(user_ids=[row.id for row in page.items]) if page.items else []
+    return render_template("booklists/index.html", users=users, page=page)
 
     
 @app.route('/booklists/<int:user_id>/add/<int:book_id>', methods=["POST"])
@@ -530,23 +744,16 @@ def add_saved_book_to_booklist(user_id, book_id):
 
     new_book_for_list = Book.query.get_or_404(book_id)
 
-    booklist = BookList.query.filter(BookList.user_id==g.user.id).all()
-    
-    curr_books = [book.id for book in booklist]
+    added = BookList.add(g.user.id, new_book_for_list.id)
+    Book.touch(new_book_for_list.id)
+    invalidate('book', new_book_for_list.id)
+    invalidate('user', g.user.id)
+    db.session.commit()
 
-    if new_book_for_list.id in curr_books:
+    if not added:
         flash("This book is already on your list", "danger")
         return redirect(f"/users/{g.user.id}")
 
-    else:
-        new_book_for_list = BookList(
-        user_id = g.user.id,
-        book_id = new_book_for_list.id
-        )
-
-    db.session.add(new_book_for_list)
-    db.session.commit()
-
     flash("Book added to your list", "success")
     return redirect(f"/users/{g.user.id}")
  
@@ -563,11 +770,13 @@ def remove_book_from_booklist(user_id, book_id):
         flash("Access unauthorized.", "danger")
         return redirect(f"/users/{g.user.id}")
     
-    booklist = BookList.query.filter(BookList.user_id==user_id, BookList.book_id==book_id).first()
-
-    user = User.query.get_or_404(user_id)
+    if not BookList.remove(user_id, book_id):
+        flash("That book is not on your list", "danger")
+        return redirect(f"/users/{g.user.id}")
 
-    db.session.delete(booklist)
+    Book.touch(book_id)
+    invalidate('book', book_id)
+    invalidate('user', user_id)
     db.session.commit()
     flash("Book deleted from your list", "success")
 
@@ -587,35 +796,32 @@ def add_review(book_id):
     user = g.user
     book = Book.query.get_or_404(book_id)
     
-    reviews = Review.query.filter(Review.user_id==g.user.id).all()
-
-    user_reviews = [review.user_id for review in book.reviews]
-
-    if user.id in user_reviews:
-        flash("You have already submitted a review for this book!", "danger")
-        return redirect(f"/books/{book.id}")
-
-
     form = AddReviewForm()
 
     if form.validate_on_submit():
         summary = form.summary.data
         url = form.url.data
 
-        new_review = Review(summary=summary, url=url, user_id=g.user.id, book_id=book.id)
-
-        db.session.add(new_review)
-        db.session.commit()
-
-        num_of_reviews = len(book.reviews)
-        book.num_of_reviews = num_of_reviews
+        if not Review.add(g.user.id, book.id, summary, url):
+            db.session.rollback()
+            flash("You have already submitted a review for this book!", "danger")
+            return redirect(f"/books/{book.id}")
 
+        invalidate('book', book.id)
+        invalidate('user', g.user.id)
         db.session.commit()
 
         flash ("Review created successfully", "success")
         return redirect(f"/users/{g.user.id}")
 
-    return render_template('reviews/new.html', form=form, book=book, user=user, reviews=reviews)
+    already_reviewed = db.session.query(
+        db.exists().where(Review.user_id == user.id).where(Review.book_id == book.id)).scalar()
+
+    if already_reviewed:
+        flash("You have already submitted a review for this book!", "danger")
+        return redirect(f"/books/{book.id}")
+
+    return render_template('reviews/new.html', form=form, book=book, user=user)
 
 
 
@@ -638,6 +844,8 @@ def edit_review(review_id):
     if form.validate_on_submit():
         review.summary = form.summary.data
         review.url = form.url.data
+        Book.touch(review.book_id)
+        User.touch(review.user_id)
 
         db.session.commit()
         flash("Review updated", "success")
@@ -661,12 +869,37 @@ def delete_review(review_id):
         flash("Access unauthorized", "danger")
         return redirect(f"/users/{g.user.id}")
     
-    db.session.delete(review)
+    Review.remove(review.user_id, review.book_id)
+    Book.touch(review.book_id)
+    invalidate('book', review.book_id)
+    invalidate('user', review.user_id)
     db.session.commit()
     flash("Review deleted", "success")
     
     return redirect(f"/users/{g.user.id}")    
 
+##########################################################################
+# CACHE STATS
+
+# Addresses allowed to read /stats/cache, besides this host
+STATS_ALLOWED_ADDRS = {'127.0.0.1', '::1', *filter(None, os.environ.get('STATS_ALLOWED_ADDRS', '').split(','))}
+
+
+@app.route('/stats/cache')
+def show_cache_stats():
+    """Hit ratios and sizes of this worker's caches, as JSON.
+    Only answered for local requests or STATS_ALLOWED_ADDRS."""
+
+    if request.remote_addr not in STATS_ALLOWED_ADDRS:
+        abort(404)
+
+    return jsonify({
+        "fragments": fragment_stats(),
+        "nyt": cache_stats(),
+        "nyt_latency": latency_stats(),
+        "passwords": password_stats(),
+    })
+
  ##########################################################################
  
 
@@ -677,4 +910,12 @@ def page_not_found(e):
     return render_template('404.html'), 404
 
 
+@app.errorhandler(UserGone)
+def user_gone(e):
+    """Log out a session whose user was deleted and send it home"""
+
+    flash("Please signup and/or login.", "danger")
+    return redirect("/")
+
+
 
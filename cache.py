@@ -0,0 +1,394 @@
+"""TTL cache with LRU eviction and stale-while-revalidate.
+
+Entries live in this process (MemoryBackend) or in a SQLite file shared
+by every gunicorn worker on the host (SQLiteBackend); `make_cache`
+picks one from the CACHE_BACKEND environment variable. Values must be
+JSON-serializable when they may end up in SQLite.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+class CacheEntry:
+    """A cached value and the times it stops being fresh and stops being usable"""
+
+    __slots__ = ('value', 'fresh_until', 'stale_until')
+
+    def __init__(self, value, fresh_until, stale_until):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+    def __repr__(self):
+        """Provide helpful representation when printed"""
+
+        return f"<CacheEntry fresh_until={self.fresh_until} stale_until={self.stale_until}>"
+
+
+class MemoryBackend:
+    """Entries held in this process, evicted least recently used first"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the CacheEntry for key (marking it recently used) or None"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        """Store entry under key. Return how many entries were evicted."""
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            evicted = 0
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Entries in a SQLite file (WAL mode) shared by every process on the host.
+
+    Values are stored as JSON, never pickled, so whoever can write the
+    file can't run code in the app. The file and its directory are only
+    readable by the app's user. Each namespace is bounded to `maxsize`
+    rows; the least recently used rows go first. Recency is only rewritten when older than
+    `touch_interval` seconds so reads rarely need a write.
+    """
+
+    def __init__(self, path, namespace='default', maxsize=256, touch_interval=60):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    fresh_until REAL NOT NULL,
+                    stale_until REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )""")
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS cache_entries_lru
+                ON cache_entries (namespace, accessed_at)""")
+
+    def _connect(self):
+        """Return this thread's connection (a new one after a fork)"""
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+            os.close(os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600))
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)).fetchone()
+        return row[0]
+
+    def get(self, key):
+        conn = self._connect()
+        key = repr(key)
+        row = conn.execute(
+            "SELECT value, fresh_until, stale_until, accessed_at FROM cache_entries "
+            "WHERE namespace = ? AND key = ?", (self.namespace, key)).fetchone()
+
+        if row is None:
+            return None
+
+        now = time.time()
+        if now - row[3] > self.touch_interval:
+            conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                         (now, self.namespace, key))
+
+        try:
+            return CacheEntry(json.loads(row[0]), row[1], row[2])
+        except Exception:
+            # Written by an incompatible version of the code
+            return None
+
+    def set(self, key, entry):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries "
+                "(namespace, key, value, fresh_until, stale_until, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, repr(key), json.dumps(entry.value),
+                 entry.fresh_until, entry.stale_until, time.time()))
+            evicted = conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                "  SELECT key FROM cache_entries WHERE namespace = ?"
+                "  ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.maxsize)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return evicted
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                                (self.namespace, repr(key)))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+
+class TTLCache:
+    """Bounded cache keyed by hashable keys.
+
+    Entries are fresh for `ttl` seconds, then may still be served for
+    `stale_ttl` more seconds while a background refresh runs.
+    The least recently used entry is evicted once `maxsize` is reached.
+    Expired entries are kept until evicted so `last_good` can serve them
+    when the source is down.
+    Storage is delegated to a backend (MemoryBackend by default); the
+    hit/miss counters are per process.
+    """
+
+    def __init__(self, maxsize=256, ttl=3600, stale_ttl=0, clock=time.time, backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.backend = backend if backend is not None else MemoryBackend(maxsize)
+
+        self._lock = threading.RLock()
+        self._refreshing = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def __len__(self):
+        return len(self.backend)
+
+    def __contains__(self, key):
+        return self.lookup(key)[0] is not None
+
+    def lookup(self, key):
+        """Return (entry, is_fresh) for key, or (None, False) if missing or expired.
+        Does not touch the hit/miss counters."""
+
+        entry = self.backend.get(key)
+        if entry is None:
+            return None, False
+
+        now = self.clock()
+        if now >= entry.stale_until:
+            return None, False
+
+        return entry, now < entry.fresh_until
+
+    def get(self, key, default=None):
+        """Return the cached value for key, fresh or stale, or default"""
+
+        entry, _ = self.lookup(key)
+        return default if entry is None else entry.value
+
+    def last_good(self, key, default=None):
+        """Return the last value stored under key even if it has expired"""
+
+        entry = self.backend.get(key)
+        return default if entry is None else entry.value
+
+    def set(self, key, value, ttl=None, stale_ttl=None):
+        """Store value under key"""
+
+        ttl = self.ttl if ttl is None else ttl
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        now = self.clock()
+
+        evicted = self.backend.set(key, CacheEntry(value, now + ttl, now + ttl + stale_ttl))
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def delete(self, key):
+        """Remove key if present"""
+
+        self.backend.delete(key)
+
+    def clear(self):
+        """Remove every entry and reset counters"""
+
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.stale_hits = self.misses = 0
+            self.evictions = self.refreshes = self.refresh_errors = 0
+
+    def stats(self):
+        """Return hit/miss counters as a dict"""
+
+        size = len(self.backend)
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "size": size,
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+    def get_or_load(self, key, loader, ttl=None, stale_ttl=None):
+        """Return cached value for key, calling loader() on a miss.
+
+        A stale entry is returned at once and loader() is re-run on a
+        background thread to replace it.
+        """
+
+        entry, fresh = self.lookup(key)
+
+        if entry is not None and fresh:
+            with self._lock:
+                self.hits += 1
+            return entry.value
+
+        if entry is not None:
+            with self._lock:
+                self.stale_hits += 1
+            self._refresh_in_background(key, loader, ttl, stale_ttl)
+            return entry.value
+
+        with self._lock:
+            self.misses += 1
+        value = loader()
+        self.set(key, value, ttl, stale_ttl)
+        return value
+
+    def _refresh_in_background(self, key, loader, ttl, stale_ttl):
+        """Start one refresh thread for key unless one is already running"""
+
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                value = loader()
+                self.set(key, value, ttl, stale_ttl)
+                with self._lock:
+                    self.refreshes += 1
+            except Exception:
+                # Keep serving the stale value; the next stale hit retries.
+                with self._lock:
+                    self.refresh_errors += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f"cache-refresh-{key}", daemon=True).start()
+
+    def memoize(self, ttl=None, stale_ttl=None, prefix=None):
+        """Decorator caching a function's return value by its arguments"""
+
+        def decorator(func):
+            name = prefix or func.__name__
+
+            def make_key(args, kwargs):
+                return (name, args, tuple(sorted(kwargs.items())))
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.get_or_load(make_key(args, kwargs), lambda: func(*args, **kwargs), ttl, stale_ttl)
+
+            def refresh(*args, **kwargs):
+                """Call func now and store the result, fresh or not"""
+
+                value = func(*args, **kwargs)
+                self.set(make_key(args, kwargs), value, ttl, stale_ttl)
+                return value
+
+            def prime(value, *args, **kwargs):
+                """Store value as the result for these arguments without calling func"""
+
+                self.set(make_key(args, kwargs), value, ttl, stale_ttl)
+
+            def last_good(*args, **kwargs):
+                """Return the last result stored for these arguments, however old, or None"""
+
+                return self.last_good(make_key(args, kwargs))
+
+            wrapper.uncached = func
+            wrapper.refresh = refresh
+            wrapper.prime = prime
+            wrapper.last_good = last_good
+            wrapper.cache = self
+            return wrapper
+
+        return decorator
+
+
+def default_sqlite_path():
+    """The shared cache file under $XDG_CACHE_HOME (or ~/.cache), not a guessable /tmp name"""
+
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'bookgenie', 'cache.sqlite3')
+
+
+def make_cache(namespace, maxsize=256, ttl=3600, stale_ttl=0):
+    """Return a TTLCache for namespace on the backend named by CACHE_BACKEND.
+
+    CACHE_BACKEND=sqlite shares entries between processes through the file
+    at CACHE_SQLITE_PATH (by default in the app user's cache directory);
+    anything else keeps them in this process.
+    """
+
+    if os.environ.get('CACHE_BACKEND', 'memory') == 'sqlite':
+        path = os.environ.get('CACHE_SQLITE_PATH', default_sqlite_path())
+        backend = SQLiteBackend(path, namespace=namespace, maxsize=maxsize)
+    else:
+        backend = MemoryBackend(maxsize)
+
+    return TTLCache(maxsize=maxsize, ttl=ttl, stale_ttl=stale_ttl, backend=backend)
@@ -0,0 +1,76 @@
+"""Conditional GET for read pages.
+
+    @app.route("/books/<int:book_id>")
+    @conditional(lambda book_id: book_page_version(book_id), login_required=True)
+
+The version function returns (parts, last_modified) describing the data
+a page shows, from a query far cheaper than building the page, or None
+to skip the check. The ETag is a hash of those parts, the URL and the
+viewer. A request whose If-None-Match / If-Modified-Since still matches
+gets a bare 304 without the view running at all. Views that send
+anonymous visitors to log in pass login_required=True, so those visitors
+always reach the view's own check instead of a 304.
+
+Pages for anonymous visitors are the same for everyone and may be cached
+by a CDN for `public_max_age` seconds; pages for logged-in users are
+private and revalidated on every visit.
+"""
+
+import hashlib
+from functools import wraps
+
+from flask import g, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def conditional(version, public_max_age=0, login_required=False):
+    """Decorate a GET view with ETag / Last-Modified validation"""
+
+    def decorator(view):
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pending flash messages must be rendered, so never answer 304 over them
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            if login_required and not g.user:
+                return view(*args, **kwargs)
+
+            found = version(*args, **kwargs)
+            if found is None:
+                return view(*args, **kwargs)
+
+            parts, last_modified = found
+            viewer_id = g.user.id if g.user else None
+            etag = make_etag(request.full_path, viewer_id, parts)
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+
+            if viewer_id is None and public_max_age:
+                response.cache_control.public = True
+                response.cache_control.max_age = public_max_age
+            else:
+                if viewer_id is not None:
+                    response.cache_control.private = True
+                response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,58 @@
+"""Shared setup for tests that use the test database.
+
+Import this module before `app` so the app is pointed at the test database:
+
+    from db_testcase import DatabaseTestCase
+    from app import app
+
+Each DatabaseTestCase class starts from a freshly created schema, whatever
+an earlier module (e.g. the migration tests) left behind, and each test
+starts with every table empty.
+"""
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import text
+
+# Set an environmental variable to use a different database for tests
+
+os.environ['DATABASE_URL'] = "postgresql:///book_app-test"
+
+
+from models import db
+from app import app
+
+# Disable WTForms use of CSRF during testing.
+app.config['WTF_CSRF_ENABLED'] = False
+
+# Tables of the baseline schema that the migration tests may leave behind
+LEFTOVER_TABLES = ('schema_migrations', 'rating')
+
+
+def recreate_schema():
+    """Drop every table, including ones the models don't know, and create the models' tables"""
+
+    db.session.remove()
+    with db.engine.begin() as conn:
+        for table in (*LEFTOVER_TABLES, *reversed(db.metadata.sorted_tables)):
+            conn.execute(text(f'DROP TABLE IF EXISTS {getattr(table, "name", table)} CASCADE'))
+    db.create_all()
+
+
+class DatabaseTestCase(TestCase):
+    """Base case: a new schema per test class, empty tables per test"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        recreate_schema()
+
+    def setUp(self):
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        super().tearDown()
@@ -0,0 +1,124 @@
+"""Cached HTML fragments for templates, invalidated by writes.
+
+Wrap a part of a template that depends on one book or user:
+
+    {% call fragment('book-card', 'book', book.id) %}
+      ... markup using book ...
+    {% endcall %}
+
+Any extra arguments (e.g. whether the viewer owns the page) become part
+of the key. Keys include a version token per (entity, id). Committing a
+change to a Book, User, Review, Rating or BookList row through the ORM
+replaces the tokens of the entities it touches, so stale fragments are
+simply never looked up again. Writes made with Core statements (upsert,
+bulk update) call invalidate() themselves.
+
+Versions live in the cache backend chosen by CACHE_BACKEND. Only with
+CACHE_BACKEND=sqlite does a write in one gunicorn worker invalidate the
+fragments of the others, so on any other backend fragments are rendered
+every time rather than cached. FRAGMENT_TTL bounds how long anything not
+covered above (e.g. a renamed reviewer) can stay stale.
+"""
+
+import os
+import uuid
+
+from markupsafe import Markup
+from sqlalchemy import event
+
+from cache import SQLiteBackend, make_cache
+from models import db, Book, BookList, Rating, Review, User
+from replica import RoutingSession
+
+
+FRAGMENT_TTL = int(os.environ.get('FRAGMENT_TTL', 600))
+PENDING_KEY = 'fragment_invalidations'
+
+fragment_cache = make_cache(
+    'fragments',
+    maxsize=int(os.environ.get('FRAGMENT_CACHE_MAXSIZE', 2048)),
+    ttl=FRAGMENT_TTL
+)
+
+version_cache = make_cache(
+    'fragment-versions',
+    maxsize=int(os.environ.get('FRAGMENT_CACHE_MAXSIZE', 2048)),
+    ttl=FRAGMENT_TTL
+)
+
+# A version bumped in one worker's memory leaves the other workers serving
+# stale HTML, so fragments are only cached when versions are shared
+enabled = isinstance(version_cache.backend, SQLiteBackend)
+
+
+def entity_version(entity, entity_id):
+    """Return the current version token for an entity, creating one if needed.
+    A missing token is replaced by a new one, never reset, so old keys stay dead."""
+
+    key = f"{entity}:{entity_id}"
+    version = version_cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex[:12]
+        version_cache.set(key, version)
+    return version
+
+
+def bump(entity, entity_id):
+    version_cache.set(f"{entity}:{entity_id}", uuid.uuid4().hex[:12])
+
+
+def fragment(name, entity, entity_id, *variants, caller):
+    """Jinja `call` block helper: return the cached HTML for this fragment,
+    rendering the block only on a miss"""
+
+    if not enabled:
+        return Markup(caller())
+
+    key = ':'.join([name, entity, str(entity_id), entity_version(entity, entity_id)]
+                   + [str(variant) for variant in variants])
+    return Markup(fragment_cache.get_or_load(key, lambda: str(caller())))
+
+
+def invalidate(entity, entity_id):
+    """Drop an entity's fragments once the current transaction commits"""
+
+    db.session.info.setdefault(PENDING_KEY, set()).add((entity, entity_id))
+
+
+def fragment_stats():
+    """Return hit/miss counters (including hit_ratio) for the fragment cache"""
+
+    return {**fragment_cache.stats(), "enabled": enabled}
+
+
+def entities_of(obj):
+    """The (entity, id) pairs whose fragments show this row"""
+
+    if isinstance(obj, Book):
+        return [('book', obj.id)]
+    if isinstance(obj, User):
+        return [('user', obj.id)]
+    if isinstance(obj, (Review, Rating, BookList)):
+        return [('book', obj.book_id), ('user', obj.user_id)]
+    return []
+
+
+# On the session class, like replica.py's listeners: listening on db.session
+# would register on the sessionmaker's subclass and hide those
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_flushed(session, flush_context):
+    pending = session.info.setdefault(PENDING_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        pending.update(pair for pair in entities_of(obj) if pair[1] is not None)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def bump_committed(session):
+    for entity, entity_id in session.info.pop(PENDING_KEY, ()):
+        bump(entity, entity_id)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_rolled_back(session):
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,142 @@
+"""Incremental reading of one large array inside a JSON document.
+
+Only one array element is decoded at a time, so a payload of many
+megabytes never has to exist as one tree of Python objects.
+"""
+
+import codecs
+import json
+import re
+
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[\s,]*')
+_space = re.compile(r'\s*')
+
+
+def read_chunks(path, chunk_size=64 * 1024):
+    """Yield a file's bytes in chunks"""
+
+    with open(path, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = f.read(chunk_size)
+
+
+def iter_text(chunks):
+    """Decode an iterable of byte (or str) chunks into str chunks"""
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+
+    for chunk in chunks:
+        yield chunk if isinstance(chunk, str) else decoder.decode(chunk)
+
+    yield decoder.decode(b'', final=True)
+
+
+def iter_array_items(chunks, key, fields_out=None):
+    """Yield each element of the first array stored under `key` in a JSON document.
+
+    Elements are expected to be objects or arrays, which can't be
+    mistaken for complete when cut at a chunk boundary.
+    `chunks` is an iterable of bytes or str. Scalar fields (strings,
+    numbers, booleans, null) met before the array are stored in
+    `fields_out` (a dict) by name if given, the first one of each name
+    winning, so callers can read e.g. a date that precedes the array.
+    """
+
+    chunks = iter_text(chunks)
+    buffer = ''
+    pos = 0
+    exhausted = False
+
+    def read_more():
+        nonlocal buffer, pos, exhausted
+        try:
+            buffer = buffer[pos:] + next(chunks)
+        except StopIteration:
+            exhausted = True
+        else:
+            pos = 0
+
+    # Walk the tokens before the array, keeping track of which strings are keys
+    containers = []
+    expecting_key = False
+    field = None
+
+    while True:
+        pos = _space.match(buffer, pos).end()
+
+        if pos >= len(buffer):
+            if exhausted:
+                raise ValueError(f"No array under key {key!r} in JSON stream")
+            read_more()
+            continue
+
+        char = buffer[pos]
+
+        if char in '{[':
+            if char == '[' and field == key and containers and containers[-1] == '{':
+                pos += 1
+                break
+            containers.append(char)
+            expecting_key = char == '{'
+            field = None
+            pos += 1
+        elif char in '}]':
+            if containers:
+                containers.pop()
+            expecting_key = False
+            field = None
+            pos += 1
+        elif char == ',':
+            expecting_key = bool(containers) and containers[-1] == '{'
+            pos += 1
+        elif char == ':':
+            pos += 1
+        else:
+            try:
+                value, end = _decoder.raw_decode(buffer, pos)
+            except ValueError:
+                value, end = None, None
+
+            # A token running to the end of the buffer may be cut short (e.g. a number)
+            if end is None or (end == len(buffer) and not exhausted):
+                if exhausted:
+                    raise ValueError(f"No array under key {key!r} in JSON stream")
+                read_more()
+                continue
+
+            if expecting_key:
+                field = value
+                expecting_key = False
+            else:
+                if field is not None and fields_out is not None:
+                    fields_out.setdefault(field, value)
+                field = None
+            pos = end
+
+    buffer = buffer[pos:]
+
+    exhausted = False
+    while True:
+        pos = _whitespace.match(buffer).end()
+
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        try:
+            item, end = _decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # The element is not complete yet; read more
+            if exhausted:
+                raise ValueError(f"JSON stream ended inside array {key!r}")
+            try:
+                buffer = buffer[pos:] + next(chunks)
+            except StopIteration:
+                exhausted = True
+            continue
+
+        buffer = buffer[end:]
+        yield item
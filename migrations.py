@@ -0,0 +1,304 @@
+"""Versioned schema migrations.
+
+Run pending migrations with:
+
+    FLASK_APP=app flask db-upgrade
+
+Each migration runs once and is recorded in `schema_migrations`.
+Migrations marked `online` run outside a transaction so that Postgres can
+build their indexes with CREATE INDEX CONCURRENTLY, without locking
+writes on the table.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+
+class Migration:
+    """One schema change"""
+
+    def __init__(self, version, description, up, online=False):
+        self.version = version
+        self.description = description
+        self.up = up
+        self.online = online
+
+    def __repr__(self):
+        """Provide helpful representation when printed"""
+
+        return f"<Migration {self.version} {self.description}>"
+
+
+##########################################################################
+# Helpers used by migrations
+
+def has_table(conn, table):
+    return inspect(conn).has_table(table)
+
+
+def has_column(conn, table, column):
+    return any(col['name'] == column for col in inspect(conn).get_columns(table))
+
+
+def add_column_if_missing(conn, table, column, ddl_type):
+    """ALTER TABLE ... ADD COLUMN unless the column exists"""
+
+    if not has_column(conn, table, column):
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl_type}'))
+
+
+def create_index(conn, name, table, columns, unique=False, using=None):
+    """Create an index if it doesn't exist; concurrently on Postgres.
+    A Postgres index left invalid by an interrupted concurrent build is rebuilt.
+    `columns` may be expressions; `using` picks a Postgres index method such as gin."""
+
+    unique_sql = 'UNIQUE ' if unique else ''
+    column_sql = ', '.join(columns)
+    using_sql = f'USING {using} ' if using else ''
+
+    if conn.dialect.name != 'postgresql':
+        conn.execute(text(f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({column_sql})'))
+        return
+
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"), {"name": name}).scalar()
+    if invalid:
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+
+    conn.execute(text(
+        f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {using_sql}({column_sql})'))
+
+
+def delete_duplicates(conn, table, columns):
+    """Keep only the lowest id for each combination of columns"""
+
+    column_sql = ', '.join(columns)
+    conn.execute(text(
+        f'DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {column_sql})'))
+
+
+##########################################################################
+# Migrations, oldest first. Never edit one that has shipped; add a new one.
+
+def baseline(conn):
+    """Create any missing tables from the models.
+    The ratings table used to be created as `rating`; rename it first."""
+
+    from models import db
+
+    if has_table(conn, 'rating') and not has_table(conn, 'ratings'):
+        conn.execute(text('ALTER TABLE rating RENAME TO ratings'))
+
+    db.metadata.create_all(bind=conn, checkfirst=True)
+
+
+def bestseller_mirror_columns(conn):
+    """Columns added to categories for the NYT mirror"""
+
+    add_column_if_missing(conn, 'categories', 'list_name_encoded', 'VARCHAR')
+    add_column_if_missing(conn, 'categories', 'position', 'INTEGER')
+    add_column_if_missing(conn, 'categories', 'published_date', 'DATE')
+    add_column_if_missing(conn, 'categories', 'updated_at', 'TIMESTAMP')
+    conn.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS categories_list_name_encoded_key ON categories (list_name_encoded)'))
+
+
+def dedupe_user_book_rows(conn):
+    """Remove duplicate (user_id, book_id) rows so they can be made unique"""
+
+    for table in ('booklists', 'ratings', 'reviews'):
+        delete_duplicates(conn, table, ['user_id', 'book_id'])
+
+
+def user_book_unique_and_foreign_key_indexes(conn):
+    """Unique (user_id, book_id) indexes, which also serve lookups by user_id,
+    plus indexes on the remaining foreign keys"""
+
+    create_index(conn, 'uq_booklists_user_book', 'booklists', ['user_id', 'book_id'], unique=True)
+    create_index(conn, 'uq_ratings_user_book', 'ratings', ['user_id', 'book_id'], unique=True)
+    create_index(conn, 'uq_reviews_user_book', 'reviews', ['user_id', 'book_id'], unique=True)
+
+    create_index(conn, 'ix_booklists_book_id', 'booklists', ['book_id'])
+    create_index(conn, 'ix_ratings_book_id', 'ratings', ['book_id'])
+    create_index(conn, 'ix_reviews_book_id', 'reviews', ['book_id'])
+    create_index(conn, 'ix_follows_user_following_id', 'follows', ['user_following_id'])
+
+
+def rating_aggregate_columns(conn):
+    """Keep a running rating sum and count on books; the average is derived from them"""
+
+    add_column_if_missing(conn, 'books', 'rating_sum', 'INTEGER NOT NULL DEFAULT 0')
+
+    conn.execute(text(
+        'UPDATE books SET '
+        'rating_sum = COALESCE((SELECT SUM(score) FROM ratings WHERE ratings.book_id = books.id), 0), '
+        'num_of_ratings = (SELECT COUNT(*) FROM ratings WHERE ratings.book_id = books.id)'))
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('ALTER TABLE books ALTER COLUMN num_of_ratings SET DEFAULT 0'))
+        conn.execute(text('ALTER TABLE books ALTER COLUMN num_of_ratings SET NOT NULL'))
+
+    if has_column(conn, 'books', 'avg_rating'):
+        conn.execute(text('ALTER TABLE books DROP COLUMN avg_rating'))
+
+
+def search_indexes(conn):
+    """Trigram indexes for substring and fuzzy matching, and a full-text
+    index over title, author and description (see search.py).
+    Postgres only; other databases search in Python, as do servers without
+    the pg_trgm extension, which get only the full-text index."""
+
+    if conn.dialect.name != 'postgresql':
+        return
+
+    trigram_available = conn.execute(text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar() is not None
+
+    if trigram_available:
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+        create_index(conn, 'ix_users_username_trgm', 'users', ['lower(username) gin_trgm_ops'], using='gin')
+        create_index(conn, 'ix_books_title_trgm', 'books', ['lower(title) gin_trgm_ops'], using='gin')
+        create_index(conn, 'ix_books_author_trgm', 'books', ['lower(author) gin_trgm_ops'], using='gin')
+    create_index(conn, 'ix_books_search_document', 'books', [
+        "to_tsvector('english', coalesce(title, '') || ' ' || coalesce(author, '') || ' ' "
+        "|| coalesce(description, ''))"], using='gin')
+
+
+def book_natural_keys(conn):
+    """Add books.natural_key and fill it for existing rows.
+    Rows whose key collides with an older book get their id appended,
+    so the unique index can be built; merge them by hand if needed."""
+
+    from models import book_natural_key
+
+    add_column_if_missing(conn, 'books', 'natural_key', 'VARCHAR')
+
+    seen = set()
+    updates = []
+    rows = conn.execute(text('SELECT id, title, author FROM books WHERE natural_key IS NULL ORDER BY id'))
+    for book_id, title, author in rows.fetchall():
+        key = book_natural_key(title, author)
+        if key in seen:
+            key = f"{key}#{book_id}"
+        seen.add(key)
+        updates.append({"key": key, "id": book_id})
+
+    if updates:
+        conn.execute(text('UPDATE books SET natural_key = :key WHERE id = :id'), updates)
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('ALTER TABLE books ALTER COLUMN natural_key SET NOT NULL'))
+
+
+def book_natural_key_index(conn):
+    """Books are identified by natural_key; titles alone no longer have to be unique,
+    but keep an index on them for sorting and title lookups"""
+
+    create_index(conn, 'books_natural_key_key', 'books', ['natural_key'], unique=True)
+    create_index(conn, 'ix_books_title', 'books', ['title'])
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('ALTER TABLE books DROP CONSTRAINT IF EXISTS books_title_key'))
+
+
+USER_COUNTER_SQL = {
+    'followers_count': 'SELECT COUNT(*) FROM follows WHERE follows.user_being_followed_id = users.id',
+    'following_count': 'SELECT COUNT(*) FROM follows WHERE follows.user_following_id = users.id',
+    'booklist_count': 'SELECT COUNT(*) FROM booklists WHERE booklists.user_id = users.id',
+    'reviews_count': 'SELECT COUNT(*) FROM reviews WHERE reviews.user_id = users.id',
+    'ratings_count': 'SELECT COUNT(*) FROM ratings WHERE ratings.user_id = users.id',
+}
+
+
+def user_counter_columns(conn):
+    """Follower, following, booklist, review and rating counts on users"""
+
+    for column in USER_COUNTER_SQL:
+        add_column_if_missing(conn, 'users', column, 'INTEGER NOT NULL DEFAULT 0')
+
+    assignments = ', '.join(f'{column} = ({sql})' for column, sql in USER_COUNTER_SQL.items())
+    conn.execute(text(f'UPDATE users SET {assignments}'))
+
+
+def updated_at_columns(conn):
+    """When a book's or user's page last changed, for HTTP validators"""
+
+    for table in ('books', 'users'):
+        add_column_if_missing(conn, table, 'updated_at', 'TIMESTAMP')
+        conn.execute(text(f'UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL'))
+
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN updated_at SET NOT NULL'))
+
+
+MIGRATIONS = [
+    Migration('0001', "baseline tables", baseline),
+    Migration('0002', "NYT mirror columns on categories", bestseller_mirror_columns),
+    Migration('0003', "remove duplicate booklist, rating and review rows", dedupe_user_book_rows),
+    Migration('0004', "user/book unique indexes and foreign key indexes",
+              user_book_unique_and_foreign_key_indexes, online=True),
+    Migration('0005', "running rating sum and count on books", rating_aggregate_columns),
+    Migration('0006', "trigram and full-text search indexes", search_indexes, online=True),
+    Migration('0007', "natural key column on books", book_natural_keys),
+    Migration('0008', "unique natural key index on books", book_natural_key_index, online=True),
+    Migration('0009', "follower, following, booklist, review and rating counts on users", user_counter_columns),
+    Migration('0010', "updated_at on books and users", updated_at_columns),
+]
+
+
+##########################################################################
+# Runner
+
+def ensure_migrations_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version VARCHAR PRIMARY KEY, description VARCHAR, applied_at TIMESTAMP NOT NULL)'))
+
+
+def applied_versions(engine):
+    """Return the set of versions already applied"""
+
+    ensure_migrations_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+def record(conn, migration):
+    conn.execute(
+        text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'),
+        {"v": migration.version, "d": migration.description, "t": datetime.utcnow()})
+
+
+def upgrade(engine, log=print):
+    """Apply every pending migration in order. Return the versions applied."""
+
+    applied = []
+
+    for migration in pending_migrations(engine):
+        log(f"Applying {migration.version}: {migration.description}")
+
+        if migration.online:
+            with engine.connect() as conn:
+                autocommit = conn.execution_options(isolation_level="AUTOCOMMIT")
+                migration.up(autocommit)
+                record(autocommit, migration)
+        else:
+            with engine.begin() as conn:
+                migration.up(conn)
+                record(conn, migration)
+
+        applied.append(migration.version)
+
+    if not applied:
+        log("Database schema is up to date")
+
+    return applied
@@ -1,12 +1,17 @@
 """SQLAlchemy models for BookApp"""
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import exc
+import re
+import unicodedata
+from datetime import datetime
 
-bcrypt = Bcrypt()
+from sqlalchemy import exc, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.hybrid import hybrid_property
 
-db = SQLAlchemy()
+from replica import RoutingSQLAlchemy
+from passwords import hash_password, check_password, needs_rehash
+
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -14,6 +19,10 @@ class Follows(db.Model):
 
     __tablename__ = 'follows'
 
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id'),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -32,6 +41,10 @@ class BookList(db.Model):
 
     __tablename__ = 'booklists'
 
+    __table_args__ = (
+        db.Index('uq_booklists_user_book', 'user_id', 'book_id', unique=True),
+        db.Index('ix_booklists_book_id', 'book_id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -55,6 +68,58 @@ class BookList(db.Model):
 
         return f"<BookList {self.id} {self.user_id} {self.book_id}>"
 
+    @classmethod
+    def add(cls, user_id, book_id):
+        """Put a book on a user's list and count it. Return False if it was already there."""
+
+        added = upsert(cls, [{"user_id": user_id, "book_id": book_id}], ['user_id', 'book_id']).rowcount
+        if added:
+            User.adjust_counters(user_id, booklist_count=1)
+        return bool(added)
+
+    @classmethod
+    def remove(cls, user_id, book_id):
+        """Take a book off a user's list. Return False if it wasn't there."""
+
+        removed = (db.session.query(cls)
+                   .filter(cls.user_id == user_id, cls.book_id == book_id)
+                   .delete(synchronize_session=False))
+        if removed:
+            User.adjust_counters(user_id, booklist_count=-1)
+        return bool(removed)
+
+    @classmethod
+    def all_lists_version(cls):
+        """(entries, newest entry, latest user change) for validating the booklists page"""
+
+        return db.session.query(
+            func.count(cls.id), func.max(cls.id),
+            select(func.max(User.updated_at)).scalar_subquery()).one()
+
+    @classmethod
+    def grouped_by_user(cls, user_ids=None):
+        """Return every user that has saved books (or just those in user_ids),
+        with those books, from one query.
+        Only the columns the booklists page shows are loaded:
+        [{"id", "username", "booklist": [{"id", "image", "title"}, ...]}, ...]
+        """
+
+        query = (db.session.query(User.id, User.username, Book.id, Book.image, Book.title)
+                 .join(cls, cls.user_id == User.id)
+                 .join(Book, Book.id == cls.book_id))
+        if user_ids is not None:
+            query = query.filter(User.id.in_(list(user_ids)))
+
+        rows = query.order_by(User.id, cls.id).all()
+
+        users = []
+        for user_id, username, book_id, image, title in rows:
+            if not users or users[-1]["id"] != user_id:
+                users.append({"id": user_id, "username": username, "booklist": []})
+            users[-1]["booklist"].append({"id": book_id, "image": image, "title": title})
+
+        return users
+
     
 
 class User(db.Model):
@@ -85,6 +150,17 @@ class User(db.Model):
         nullable=False
     )
 
+    # Denormalized counts shown on profile pages; kept in step by the
+    # methods that add and remove the rows, and by `flask reconcile-counters`
+    followers_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    booklist_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    reviews_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    ratings_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # When anything shown on the profile page last changed; used for ETags
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
     followers = db.relationship(
         "User",
         secondary="follows",
@@ -109,17 +185,98 @@ class User(db.Model):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
 
+    def shown_book_ids(self):
+        """Ids of the books whose pages show this user: listed, reviewed or rated"""
+
+        listed = select(BookList.book_id).where(BookList.user_id == self.id)
+        reviewed = select(Review.book_id).where(Review.user_id == self.id)
+        rated = select(Rating.book_id).where(Rating.user_id == self.id)
+        return [row[0] for row in db.session.execute(listed.union(reviewed, rated))]
+
+    @classmethod
+    def touch(cls, user_id):
+        """Mark the profile page as changed, e.g. after one of the user's reviews is edited"""
+
+        db.session.query(cls).filter(cls.id == user_id).update(
+            {cls.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+    @classmethod
+    def adjust_counters(cls, user_id, **deltas):
+        """Atomically add to a user's counters in SQL, e.g. adjust_counters(id, booklist_count=1)"""
+
+        db.session.query(cls).filter(cls.id == user_id).update(
+            {getattr(cls, name): getattr(cls, name) + delta for name, delta in deltas.items()},
+            synchronize_session=False)
+
+    def follow(self, other_user_id):
+        """Follow another user and count it on both sides. Return False if already following."""
+
+        added = upsert(Follows, [{"user_being_followed_id": other_user_id, "user_following_id": self.id}],
+                       ['user_being_followed_id', 'user_following_id']).rowcount
+        if added:
+            User.adjust_counters(self.id, following_count=1)
+            User.adjust_counters(other_user_id, followers_count=1)
+        return bool(added)
+
+    def unfollow(self, other_user_id):
+        """Stop following another user. Return False if not following."""
+
+        removed = (db.session.query(Follows)
+                   .filter(Follows.user_following_id == self.id,
+                           Follows.user_being_followed_id == other_user_id)
+                   .delete(synchronize_session=False))
+        if removed:
+            User.adjust_counters(self.id, following_count=-1)
+            User.adjust_counters(other_user_id, followers_count=-1)
+        return bool(removed)
+
+    @classmethod
+    def unfollow_all(cls, user_id):
+        """Remove every follow to or from a user, e.g. before deleting the user,
+        and take them out of the other users' counters"""
+
+        followed_ids = select(Follows.user_being_followed_id).where(Follows.user_following_id == user_id)
+        follower_ids = select(Follows.user_following_id).where(Follows.user_being_followed_id == user_id)
+
+        db.session.query(cls).filter(cls.id.in_(followed_ids)).update(
+            {cls.followers_count: cls.followers_count - 1}, synchronize_session=False)
+        db.session.query(cls).filter(cls.id.in_(follower_ids)).update(
+            {cls.following_count: cls.following_count - 1}, synchronize_session=False)
+
+        db.session.query(Follows).filter(
+            (Follows.user_following_id == user_id) | (Follows.user_being_followed_id == user_id)
+        ).delete(synchronize_session=False)
+
+    @staticmethod
+    def follow_exists(follower_id, followed_id):
+        """Does user `follower_id` follow user `followed_id`? One primary-key EXISTS query."""
+
+        return db.session.query(db.exists().where(
+            Follows.user_following_id == follower_id).where(
+            Follows.user_being_followed_id == followed_id)).scalar()
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return User.follow_exists(other_user.id, self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_user`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return User.follow_exists(self.id, other_user.id)
+
+    def following_ids_among(self, user_ids):
+        """Return the subset of `user_ids` this user follows, in one query"""
+
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+
+        rows = (db.session.query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids))
+                .all())
+        return {row[0] for row in rows}
 
     @classmethod
     def signup(cls, username, email, password):
@@ -127,7 +284,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hash_password(password)
 
         try: 
             user = User(
@@ -154,19 +311,53 @@ class User(db.Model):
 
         user = cls.query.filter_by(username=username).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if user and user.check_password(password):
+            return user
 
         return False
 
+    def check_password(self, password):
+        """Does password match this user's? On a match, a hash made with an
+        older cost factor is replaced by one at the current cost."""
+
+        if not check_password(self.password, password):
+            return False
+
+        if needs_rehash(self.password):
+            self.password = hash_password(password)
+            db.session.commit()
+
+        return True
+
+
+def normalize_key_part(value):
+    """Lowercase, strip accents and punctuation, collapse spaces"""
+
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char)).casefold()
+    return ' '.join(re.sub(r'[\W_]+', ' ', value).split())
+
+
+def book_natural_key(title, author):
+    """The identity of a book: normalized title and author"""
+
+    return f"{normalize_key_part(title)}|{normalize_key_part(author)}"
+
+
+def default_natural_key(context):
+    params = context.get_current_parameters()
+    return book_natural_key(params.get('title'), params.get('author'))
+
 
 class Book(db.Model):
     """An individual book."""
 
     __tablename__ = 'books'
 
+    __table_args__ = (
+        db.Index('ix_books_title', 'title'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -175,10 +366,16 @@ class Book(db.Model):
 
     title = db.Column(
         db.String,
-        nullable=False,
-        unique=True
+        nullable=False
     )  
 
+    natural_key = db.Column(
+        db.String,
+        nullable=False,
+        unique=True,
+        default=default_natural_key
+    )
+
     image = db.Column(
         db.String,
         nullable = True
@@ -204,14 +401,18 @@ class Book(db.Model):
         nullable = True
     )
 
-    avg_rating = db.Column(
-        db.Float,
-        nullable=True
+    rating_sum = db.Column(
+        db.Integer,
+        nullable = False,
+        default = 0,
+        server_default = '0'
     )
 
     num_of_ratings = db.Column(
         db.Integer,
-        nullable = True
+        nullable = False,
+        default = 0,
+        server_default = '0'
     )
 
     num_of_reviews = db.Column(
@@ -219,6 +420,84 @@ class Book(db.Model):
         nullable = True
     )
 
+    # When anything shown on the book page last changed; used for ETags.
+    # Set on every UPDATE of the row, including the SQL aggregate updates.
+    updated_at = db.Column(
+        db.DateTime,
+        nullable = False,
+        default = datetime.utcnow,
+        onupdate = datetime.utcnow
+    )
+
+    @hybrid_property
+    def avg_rating(self):
+        """Average score, derived from the running sum and count"""
+
+        if not self.num_of_ratings:
+            return None
+        return round(self.rating_sum / self.num_of_ratings, 2)
+
+    @avg_rating.expression
+    def avg_rating(cls):
+        return cls.rating_sum * 1.0 / func.nullif(cls.num_of_ratings, 0)
+
+    @classmethod
+    def get_or_create(cls, title, author, **fields):
+        """Return the id of the book with this title and author, inserting it
+        if it's new. One INSERT ... ON CONFLICT round trip on Postgres."""
+
+        key = book_natural_key(title, author)
+        row = dict(fields, title=title, author=author, natural_key=key)
+
+        if db.session().get_bind().dialect.name != 'postgresql':
+            upsert(cls, [row], ['natural_key'])
+            return db.session.query(cls.id).filter(cls.natural_key == key).scalar()
+
+        # A no-op update, so that RETURNING also yields the id of an existing row
+        stmt = postgresql.insert(cls.__table__).values(row)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['natural_key'],
+            set_={'natural_key': stmt.excluded.natural_key}
+        ).returning(cls.__table__.c.id)
+
+        return db.session.execute(stmt).scalar()
+
+    @classmethod
+    def id_for_title(cls, title, author=None):
+        """Return the id of the saved book with this title (and author, if given).
+        Return None if there is none, or if books by different authors share
+        the title and no author was given."""
+
+        if author is not None:
+            return db.session.query(cls.id).filter(cls.natural_key == book_natural_key(title, author)).scalar()
+
+        prefix = f"{normalize_key_part(title)}|"
+        ids = [row.id for row in db.session.query(cls.id)
+               .filter(cls.natural_key.startswith(prefix, autoescape=True))
+               .limit(2)]
+        return ids[0] if len(ids) == 1 else None
+
+    @classmethod
+    def touch(cls, *book_ids):
+        """Mark book pages as changed, e.g. after one of their reviews is edited"""
+
+        db.session.query(cls).filter(cls.id.in_(book_ids)).update(
+            {cls.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+    @classmethod
+    def list_version(cls):
+        """(number of books, latest change) for validating the books page"""
+
+        return db.session.query(func.count(cls.id), func.max(cls.updated_at)).one()
+
+    @classmethod
+    def adjust_rating_aggregates(cls, book_id, score_delta, count_delta):
+        """Atomically add to a book's rating sum and count in SQL"""
+
+        db.session.query(cls).filter(cls.id == book_id).update({
+            cls.rating_sum: cls.rating_sum + score_delta,
+            cls.num_of_ratings: cls.num_of_ratings + count_delta
+        }, synchronize_session=False)
     
     def __repr__(self):
         """Provide helpful representation when printed"""
@@ -231,6 +510,11 @@ class Review(db.Model):
 
     __tablename__ = 'reviews'
 
+    __table_args__ = (
+        db.Index('uq_reviews_user_book', 'user_id', 'book_id', unique=True),
+        db.Index('ix_reviews_book_id', 'book_id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -266,11 +550,52 @@ class Review(db.Model):
 
         return f"<Review {self.id} {self.summary}>"
 
+    @classmethod
+    def add(cls, user_id, book_id, summary, url=None):
+        """Add a user's review of a book and count it on the user and the book.
+        Return False if the user already reviewed the book."""
+
+        added = upsert(cls, [{"summary": summary, "url": url, "user_id": user_id, "book_id": book_id}],
+                       ['user_id', 'book_id']).rowcount
+        if not added:
+            return False
+
+        User.adjust_counters(user_id, reviews_count=1)
+        cls.recount_book(book_id)
+        return True
+
+    @classmethod
+    def remove(cls, user_id, book_id):
+        """Delete a user's review of a book and uncount it on the user and the book.
+        Return False if the user hadn't reviewed the book."""
+
+        removed = cls.query.filter(cls.user_id == user_id, cls.book_id == book_id).delete(
+            synchronize_session=False)
+        if not removed:
+            return False
+
+        User.adjust_counters(user_id, reviews_count=-1)
+        cls.recount_book(book_id)
+        return True
+
+    @classmethod
+    def recount_book(cls, book_id):
+        """Set the book's num_of_reviews from its reviews"""
+
+        review_count = select(func.count(cls.id)).where(cls.book_id == book_id).scalar_subquery()
+        db.session.query(Book).filter(Book.id == book_id).update(
+            {Book.num_of_reviews: review_count}, synchronize_session=False)
+
 
 class Rating(db.Model):
     """Individual rating"""
 
-    __tablename = 'ratings'
+    __tablename__ = 'ratings'
+
+    __table_args__ = (
+        db.Index('uq_ratings_user_book', 'user_id', 'book_id', unique=True),
+        db.Index('ix_ratings_book_id', 'book_id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -304,9 +629,68 @@ class Rating(db.Model):
 
         return f"<Rating {self.id} {self.book_id} {self.user_id}>"
 
+    @classmethod
+    def _locked_score(cls, user_id, book_id):
+        return (db.session.query(cls.score)
+                .filter(cls.user_id == user_id, cls.book_id == book_id)
+                .with_for_update()
+                .scalar())
+
+    @classmethod
+    def rate(cls, user_id, book_id, score):
+        """Insert or change a user's rating and adjust the book's aggregates to match.
+        Runs in the caller's transaction; commit afterwards."""
+
+        old_score = cls._locked_score(user_id, book_id)
+
+        if old_score is None:
+            inserted = upsert(cls, [{"user_id": user_id, "book_id": book_id, "score": score}],
+                              ['user_id', 'book_id']).rowcount
+            if inserted:
+                Book.adjust_rating_aggregates(book_id, score, 1)
+                User.adjust_counters(user_id, ratings_count=1)
+                return
+
+            # A concurrent request inserted it first
+            old_score = cls._locked_score(user_id, book_id)
+
+        db.session.query(cls).filter(cls.user_id == user_id, cls.book_id == book_id).update(
+            {cls.score: score}, synchronize_session=False)
+        Book.adjust_rating_aggregates(book_id, score - old_score, 0)
+
+    @classmethod
+    def unrate(cls, user_id, book_id):
+        """Delete a user's rating and take it out of the book's aggregates"""
+
+        old_score = cls._locked_score(user_id, book_id)
+
+        if old_score is None:
+            return
+
+        db.session.query(cls).filter(cls.user_id == user_id, cls.book_id == book_id).delete(
+            synchronize_session=False)
+        Book.adjust_rating_aggregates(book_id, -old_score, -1)
+        User.adjust_counters(user_id, ratings_count=-1)
+
+    @classmethod
+    def unrate_all_for_user(cls, user_id):
+        """Take all of a user's ratings out of their books' aggregates, e.g. before deleting the user"""
+
+        user_score = (db.session.query(cls.score)
+                      .filter(cls.user_id == user_id, cls.book_id == Book.id)
+                      .scalar_subquery())
+        rated_book_ids = select(cls.book_id).where(cls.user_id == user_id)
+
+        db.session.query(Book).filter(Book.id.in_(rated_book_ids)).update({
+            Book.rating_sum: Book.rating_sum - user_score,
+            Book.num_of_ratings: Book.num_of_ratings - 1
+        }, synchronize_session=False)
+
+        db.session.query(cls).filter(cls.user_id == user_id).delete(synchronize_session=False)
+
 
 class Category(db.Model):
-    """An individual category"""
+    """An individual category (NYT bestseller list)"""
 
     __tablename__ = 'categories'
 
@@ -320,6 +704,29 @@ class Category(db.Model):
         db.String,
         nullable = False
     )
+
+    list_name_encoded = db.Column(
+        db.String,
+        nullable = True,
+        unique = True
+    )
+
+    position = db.Column(
+        db.Integer,
+        nullable = True
+    )
+
+    published_date = db.Column(
+        db.Date,
+        nullable = True
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable = True
+    )
+
+    bestsellers = db.relationship('BestSeller', backref='category', order_by='BestSeller.rank')
     
     def __repr__(self):
         """Provide helpful representation when printed"""
@@ -327,6 +734,64 @@ class Category(db.Model):
         return f"<Category {self.id} {self.category_name}>"
 
 
+class BestSeller(db.Model):
+    """A book on the current NYT list for a category, mirrored from the API"""
+
+    __tablename__ = 'bestsellers'
+
+    __table_args__ = (
+        db.UniqueConstraint('category_id', 'title'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True
+    )
+
+    category_id = db.Column(
+        db.Integer,
+        db.ForeignKey('categories.id', ondelete='cascade'),
+        nullable = False
+    )
+
+    rank = db.Column(
+        db.Integer,
+        nullable = True
+    )
+
+    title = db.Column(
+        db.String,
+        nullable = False
+    )
+
+    author = db.Column(
+        db.String,
+        nullable = False
+    )
+
+    image = db.Column(
+        db.String,
+        nullable = True
+    )
+
+    description = db.Column(
+        db.Text,
+        nullable = True
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable = False,
+        default = datetime.utcnow
+    )
+
+    def __repr__(self):
+        """Provide helpful representation when printed"""
+
+        return f"<BestSeller {self.id} {self.category_id} #{self.rank} {self.title}>"
+
+
 class Author(db.Model):
     """An individual author"""
 
@@ -360,6 +825,28 @@ class Author(db.Model):
 
 
 
+def upsert(model, rows, index_elements, update_columns=None):
+    """INSERT rows into model's table, resolving conflicts on index_elements.
+    Conflicting rows get update_columns overwritten, or are skipped when
+    update_columns is empty. Works on Postgres and SQLite.
+    """
+
+    dialect = db.session().get_bind().dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+
+    stmt = insert(model.__table__).values(rows)
+
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+
+    return db.session.execute(stmt)
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
     You should call this in your Flask app.
@@ -0,0 +1,284 @@
+"""Shared HTTP client for the NYT Books API"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_BASE_URL = 'https://api.nytimes.com/svc/books/v3/'
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class NYTApiError(Exception):
+    """Raised when the NYT API can't be reached or answers with an error"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(NYTApiError):
+    """Raised without calling the API while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Fail fast after repeated API failures.
+
+    Opens after `failure_threshold` consecutive failures. While open every
+    call is refused until `reset_timeout` seconds have passed, then one
+    trial call is let through (half-open); its outcome closes or re-opens
+    the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return
+
+        raise CircuitOpenError("NYT API circuit is open; not calling the API")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_running:
+                    self.times_opened += 1
+                self.opened_at = self.clock()
+            self.trial_running = False
+
+
+class LatencyRecorder:
+    """Keep the most recent request latencies per endpoint"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok=True):
+        """Add one sample for endpoint"""
+
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+            if not ok:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def stats(self):
+        """Return count, errors and latency percentiles (ms) per endpoint"""
+
+        with self._lock:
+            results = {}
+            for endpoint, samples in self._samples.items():
+                ordered = sorted(samples)
+                pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+                results[endpoint] = {
+                    "count": self._counts[endpoint],
+                    "errors": self._errors.get(endpoint, 0),
+                    "p50_ms": pick(0.50),
+                    "p95_ms": pick(0.95),
+                    "max_ms": round(ordered[-1] * 1000, 1),
+                }
+            return results
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._errors.clear()
+
+
+class NYTClient:
+    """Pooled, timed-out, retrying client for the NYT Books API.
+
+    One instance is shared by every helper in api_helper so connections
+    are kept alive between calls. `deadline` bounds the seconds one call
+    may spend on all its attempts and backoff together, well below
+    gunicorn's 30 second worker timeout.
+    """
+
+    def __init__(self, base_url=None, api_key=None, connect_timeout=3.05, read_timeout=10,
+                 max_retries=3, backoff_base=0.5, backoff_max=8, pool_size=10, breaker=None,
+                 deadline=20):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/') + '/'
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.latency = LatencyRecorder()
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to sleep before retry number `attempt` (full jitter)"""
+
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get_json(self, path, params=None):
+        """GET base_url + path and return the decoded JSON body.
+        Retries connection errors, timeouts, 429 and 5xx answers with
+        jittered exponential backoff; raises NYTApiError once out of retries
+        or out of time (see `deadline`).
+        Raises CircuitOpenError at once while the circuit breaker is open.
+        """
+
+        return self._guarded(lambda: self._get_with_retries(path, params).json())
+
+    def iter_chunks(self, path, params=None, chunk_size=64 * 1024):
+        """Yield the body of base_url + path in byte chunks as it arrives.
+        Retries and the circuit breaker apply to getting the response headers.
+        """
+
+        res = self._guarded(lambda: self._get_with_retries(path, params, stream=True))
+
+        try:
+            yield from res.iter_content(chunk_size)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise NYTApiError(f"NYT API response for {path} was cut off: {e}")
+        finally:
+            res.close()
+
+    def _guarded(self, call):
+        """Run call() through the circuit breaker"""
+
+        self.breaker.before_call()
+
+        try:
+            result = call()
+        except NYTApiError as e:
+            if e.status is None or e.status in RETRY_STATUSES:
+                self.breaker.record_failure()
+            else:
+                # A 4xx is our request's fault, not an outage
+                self.breaker.record_success()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+
+        self.breaker.record_success()
+        return result
+
+    def _get_with_retries(self, path, params, stream=False):
+        """Return the first successful response for path, retrying as get_json describes"""
+
+        url = self.base_url + path.lstrip('/')
+        params = dict(params or {})
+        if self.api_key:
+            params['api-key'] = self.api_key
+
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            # No attempt may run past the deadline
+            remaining = deadline_at - time.monotonic()
+            timeout = tuple(min(limit, remaining) for limit in self.timeout)
+
+            start = time.perf_counter()
+            retry_after = None
+            try:
+                res = self.session.get(url, params=params, timeout=timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.latency.record(path, time.perf_counter() - start, ok=False)
+                error = NYTApiError(f"NYT API request to {path} failed: {e}")
+            else:
+                self.latency.record(path, time.perf_counter() - start, ok=res.ok)
+
+                if res.ok:
+                    return res
+
+                res.close()
+                error = NYTApiError(f"NYT API returned {res.status_code} for {path}", res.status_code)
+                if res.status_code not in RETRY_STATUSES:
+                    raise error
+
+                try:
+                    retry_after = float(res.headers.get('Retry-After'))
+                except (TypeError, ValueError):
+                    retry_after = None
+
+            if attempt >= self.max_retries:
+                raise error
+
+            # Give up rather than start an attempt with no time left to connect
+            delay = self.backoff(attempt, retry_after)
+            if time.monotonic() + delay + self.timeout[0] > deadline_at:
+                raise error
+
+            time.sleep(delay)
+            attempt += 1
+
+
+def client_from_env(api_key=None):
+    """Build a client configured from NYT_* environment variables"""
+
+    return NYTClient(
+        base_url=os.environ.get('NYT_API_BASE_URL', DEFAULT_BASE_URL),
+        api_key=api_key,
+        connect_timeout=float(os.environ.get('NYT_CONNECT_TIMEOUT', 3.05)),
+        read_timeout=float(os.environ.get('NYT_READ_TIMEOUT', 10)),
+        max_retries=int(os.environ.get('NYT_MAX_RETRIES', 3)),
+        deadline=float(os.environ.get('NYT_DEADLINE', 20)),
+        pool_size=int(os.environ.get('NYT_POOL_SIZE', 10)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.environ.get('NYT_BREAKER_THRESHOLD', 5)),
+            reset_timeout=float(os.environ.get('NYT_BREAKER_RESET_SECONDS', 30)),
+        ),
+    )
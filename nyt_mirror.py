@@ -0,0 +1,174 @@
+"""Mirror NYT bestseller lists into the database and read them back"""
+
+import time
+from datetime import datetime, date
+
+from models import db, upsert, Category, BestSeller
+from api_helper import encode_category, fetch_list_names, fetch_current_list, ingest_overview
+
+
+def parse_date(value):
+    """Return a date from an NYT 'YYYY-MM-DD' string, or None"""
+
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def sync_categories(results=None):
+    """Upsert every NYT list name into categories. Return the encoded names in API order."""
+
+    results = fetch_list_names() if results is None else results
+
+    encoded_names = list(dict.fromkeys(result['list_name_encoded'] for result in results))
+    rows = [
+        {
+            "list_name_encoded": encoded,
+            "category_name": encoded.title().replace('-', " "),
+            "position": position
+        }
+        for position, encoded in enumerate(encoded_names)
+    ]
+
+    if rows:
+        upsert(Category, rows, ['list_name_encoded'], ['category_name', 'position'])
+        db.session.commit()
+
+    return encoded_names
+
+
+def sync_list(encoded, results=None):
+    """Replace the mirrored books of one list with its current NYT books"""
+
+    results = fetch_current_list(encoded) if results is None else results
+    now = datetime.utcnow()
+
+    upsert(
+        Category,
+        [{
+            "list_name_encoded": encoded,
+            "category_name": encoded.title().replace('-', " "),
+            "published_date": parse_date(results.get('published_date')),
+            "updated_at": now
+        }],
+        ['list_name_encoded'],
+        ['published_date', 'updated_at']
+    )
+    category_id = db.session.query(Category.id).filter(Category.list_name_encoded == encoded).scalar()
+
+    rows = list({
+        book['title']: {
+            "category_id": category_id,
+            "rank": book.get('rank'),
+            "title": book['title'],
+            "author": book['author'],
+            "image": book.get('book_image'),
+            "description": book.get('description'),
+            "updated_at": now
+        }
+        for book in results.get('books', [])
+    }.values())
+
+    if rows:
+        upsert(BestSeller, rows, ['category_id', 'title'], ['rank', 'author', 'image', 'description', 'updated_at'])
+
+    # Books that dropped off the list were not touched by this sync
+    BestSeller.query.filter(
+        BestSeller.category_id == category_id,
+        BestSeller.updated_at < now
+    ).delete(synchronize_session=False)
+
+    db.session.commit()
+    return len(rows)
+
+
+def sync_bestsellers(log=print):
+    """Mirror every NYT list and its current books. Return (lists, books, failed)."""
+
+    start = time.perf_counter()
+    encoded_names = sync_categories()
+    num_books = 0
+    failed = []
+
+    for encoded in encoded_names:
+        try:
+            num_books += sync_list(encoded)
+        except Exception as e:
+            db.session.rollback()
+            failed.append(encoded)
+            log(f"Failed to sync {encoded}: {e}")
+
+    log(f"Synced {len(encoded_names) - len(failed)} lists, {num_books} books "
+        f"in {time.perf_counter() - start:.1f}s")
+
+    return len(encoded_names), num_books, failed
+
+
+def sync_overview(source=None, log=print):
+    """Mirror every list from one overview payload (API or local dump at `source`).
+    The same pass fills the NYT cache. Return (lists, books, failed)."""
+
+    start = time.perf_counter()
+    counts = {"books": 0}
+    failed = []
+
+    def mirror_list(overview_list):
+        encoded = overview_list['list_name_encoded']
+        try:
+            counts["books"] += sync_list(encoded, overview_list)
+        except Exception as e:
+            db.session.rollback()
+            failed.append(encoded)
+            log(f"Failed to sync {encoded}: {e}")
+
+    encoded_names = ingest_overview(source, on_list=mirror_list)
+
+    log(f"Synced {len(encoded_names) - len(failed)} lists, {counts['books']} books "
+        f"from overview in {time.perf_counter() - start:.1f}s")
+
+    return len(encoded_names), counts["books"], failed
+
+
+##########################################################################
+# Readers used by the views
+
+def mirrored_categories():
+    """Return category names from the mirror in NYT order, or [] if never synced"""
+
+    rows = (db.session.query(Category.category_name)
+            .filter(Category.list_name_encoded.isnot(None))
+            .order_by(Category.position, Category.id)
+            .all())
+
+    return [row.category_name for row in rows]
+
+
+def mirrored_books(category):
+    """Return mirrored books for a category in rank order, or None if the list was never synced"""
+
+    encoded = encode_category(category)
+
+    rows = (db.session.query(BestSeller.title, BestSeller.author, BestSeller.image, BestSeller.description)
+            .join(Category, Category.id == BestSeller.category_id)
+            .filter(Category.list_name_encoded == encoded)
+            .order_by(BestSeller.rank)
+            .all())
+
+    if not rows:
+        return None
+
+    return [
+        {"title": row.title, "author": row.author, "image": row.image, "description": row.description}
+        for row in rows
+    ]
+
+
+def mirrored_list_version(category):
+    """(published_date, updated_at) of a mirrored list, or None if it was never synced"""
+
+    row = (db.session.query(Category.published_date, Category.updated_at)
+           .filter(Category.list_name_encoded == encode_category(category))
+           .first())
+
+    return None if row is None or row.updated_at is None else tuple(row)
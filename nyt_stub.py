@@ -0,0 +1,281 @@
+"""Local stand-in for the NYT Books API endpoints used by api_helper.
+
+Serves recorded fixtures from a directory, or deterministic synthetic
+data when no fixture exists, with optional latency and error injection.
+
+Run it like:
+
+    python nyt_stub.py serve --port 5001 --latency-ms 150 --error-rate 0.05
+
+and point the app at it:
+
+    NYT_API_BASE_URL=http://localhost:5001/svc/books/v3/ flask run
+
+Record real responses into fixtures (needs an API key):
+
+    python nyt_stub.py record --out fixtures/nyt
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+
+from flask import Flask, jsonify, request, abort
+
+
+PREFIX = '/svc/books/v3'
+
+SYNTHETIC_CATEGORIES = [
+    "combined-print-and-e-book-fiction", "combined-print-and-e-book-nonfiction",
+    "hardcover-fiction", "hardcover-nonfiction", "trade-fiction-paperback",
+    "paperback-nonfiction", "advice-how-to-and-miscellaneous", "childrens-middle-grade-hardcover",
+    "picture-books", "series-books", "young-adult-hardcover", "audio-fiction",
+    "audio-nonfiction", "business-books", "graphic-books-and-manga", "mass-market-monthly",
+    "middle-grade-paperback-monthly", "young-adult-paperback-monthly",
+]
+
+
+class StubConfig:
+    """Latency, error injection and fixture settings for the stand-in"""
+
+    def __init__(self, fixtures_dir=None, latency_ms=0, jitter_ms=0, error_rate=0.0,
+                 error_status=503, books_per_list=15, seed=1):
+        self.fixtures_dir = fixtures_dir
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.books_per_list = books_per_list
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls):
+        """Build settings from NYT_STUB_* environment variables"""
+
+        return cls(
+            fixtures_dir=os.environ.get('NYT_STUB_FIXTURES'),
+            latency_ms=float(os.environ.get('NYT_STUB_LATENCY_MS', 0)),
+            jitter_ms=float(os.environ.get('NYT_STUB_JITTER_MS', 0)),
+            error_rate=float(os.environ.get('NYT_STUB_ERROR_RATE', 0)),
+            error_status=int(os.environ.get('NYT_STUB_ERROR_STATUS', 503)),
+            books_per_list=int(os.environ.get('NYT_STUB_BOOKS_PER_LIST', 15)),
+            seed=int(os.environ.get('NYT_STUB_SEED', 1)),
+        )
+
+
+##########################################################################
+# Synthetic payloads in the same shape as the real API
+
+def synthetic_names():
+    """Payload for lists/names.json"""
+
+    return {
+        "status": "OK",
+        "num_results": len(SYNTHETIC_CATEGORIES),
+        "results": [
+            {
+                "list_name": category.replace('-', ' ').title(),
+                "display_name": category.replace('-', ' ').title(),
+                "list_name_encoded": category,
+                "oldest_published_date": "2008-06-08",
+                "newest_published_date": "2022-05-01",
+                "updated": "WEEKLY",
+            }
+            for category in SYNTHETIC_CATEGORIES
+        ],
+    }
+
+
+def synthetic_book(category, rank, rng):
+    """One book entry as returned inside a list"""
+
+    title = f"{category.replace('-', ' ').upper()} BOOK {rank}"
+    author = f"Author {rng.randint(1, 500)}"
+    return {
+        "rank": rank,
+        "title": title,
+        "author": author,
+        "book_image": f"https://example.invalid/covers/{category}/{rank}.jpg",
+        "description": f"Synthetic description for {title.title()} by {author}.",
+        "primary_isbn13": f"978{rng.randint(10 ** 9, 10 ** 10 - 1)}",
+        "publisher": "Stub House",
+        "weeks_on_list": rng.randint(0, 52),
+    }
+
+
+def synthetic_list(category, config):
+    """Payload for lists/current/{category}.json"""
+
+    encoded = category.lower().replace(' ', '-')
+    rng = random.Random(f"{config.seed}:{encoded}")
+    return {
+        "status": "OK",
+        "num_results": config.books_per_list,
+        "last_modified": "2022-05-04T22:10:23-04:00",
+        "results": {
+            "list_name": encoded.replace('-', ' ').title(),
+            "list_name_encoded": encoded,
+            "display_name": encoded.replace('-', ' ').title(),
+            "bestsellers_date": "2022-04-30",
+            "published_date": "2022-05-15",
+            "books": [synthetic_book(encoded, rank, rng) for rank in range(1, config.books_per_list + 1)],
+        },
+    }
+
+
+def synthetic_overview(config):
+    """Payload for lists/overview.json"""
+
+    lists = []
+    for list_id, encoded in enumerate(SYNTHETIC_CATEGORIES, start=1):
+        current = synthetic_list(encoded, config)["results"]
+        lists.append({
+            "list_id": list_id,
+            "list_name": current["list_name"],
+            "list_name_encoded": encoded,
+            "display_name": current["display_name"],
+            "updated": "WEEKLY",
+            "books": current["books"],
+        })
+
+    return {
+        "status": "OK",
+        "num_results": sum(len(overview_list["books"]) for overview_list in lists),
+        "results": {
+            "bestsellers_date": "2022-04-30",
+            "published_date": "2022-05-15",
+            "lists": lists,
+        },
+    }
+
+
+def synthetic_history(title, author):
+    """Payload for lists/best-sellers/history.json"""
+
+    return {
+        "status": "OK",
+        "num_results": 1,
+        "results": [
+            {"title": (title or "").upper(), "author": author or "", "description": "", "publisher": "Stub House"}
+        ],
+    }
+
+
+##########################################################################
+# App
+
+def load_fixture(config, *parts):
+    """Return decoded fixture at fixtures_dir/parts, or None if missing"""
+
+    if not config.fixtures_dir:
+        return None
+
+    path = os.path.join(config.fixtures_dir, *parts)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def create_app(config=None):
+    """Create the stand-in Flask app"""
+
+    config = config or StubConfig.from_env()
+    stub = Flask(__name__)
+    stub.config['NYT_STUB'] = config
+    # Keep the API's key order: e.g. published_date comes before the lists in overview.json
+    stub.config['JSON_SORT_KEYS'] = False
+    rng = random.Random(config.seed)
+
+    @stub.before_request
+    def inject_latency_and_errors():
+        """Sleep and/or fail according to the stub settings"""
+
+        delay = config.latency_ms + (rng.uniform(0, config.jitter_ms) if config.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+        if config.error_rate and rng.random() < config.error_rate:
+            return jsonify({"status": "ERROR", "fault": "injected"}), config.error_status
+
+    @stub.route(f'{PREFIX}/lists/names.json')
+    def names():
+        return jsonify(load_fixture(config, 'names.json') or synthetic_names())
+
+    @stub.route(f'{PREFIX}/lists/current/<category>.json')
+    def current_list(category):
+        encoded = category.lower().replace(' ', '-')
+        data = load_fixture(config, 'current', f'{encoded}.json')
+
+        if data is None and encoded not in SYNTHETIC_CATEGORIES:
+            abort(404)
+
+        return jsonify(data or synthetic_list(encoded, config))
+
+    @stub.route(f'{PREFIX}/lists/overview.json')
+    def overview():
+        return jsonify(load_fixture(config, 'overview.json') or synthetic_overview(config))
+
+    @stub.route(f'{PREFIX}/lists/best-sellers/history.json')
+    def history():
+        data = load_fixture(config, 'history.json')
+        return jsonify(data or synthetic_history(request.args.get('title'), request.args.get('author')))
+
+    return stub
+
+
+def record_fixtures(out_dir):
+    """Save live responses for every endpoint the app uses into out_dir"""
+
+    from api_helper import client
+
+    os.makedirs(os.path.join(out_dir, 'current'), exist_ok=True)
+
+    with open(os.path.join(out_dir, 'overview.json'), 'w') as f:
+        json.dump(client.get_json("lists/overview.json"), f)
+
+    names_data = client.get_json("lists/names.json")
+    with open(os.path.join(out_dir, 'names.json'), 'w') as f:
+        json.dump(names_data, f)
+
+    encoded_names = dict.fromkeys(result['list_name_encoded'] for result in names_data['results'])
+    for encoded in encoded_names:
+        with open(os.path.join(out_dir, 'current', f'{encoded}.json'), 'w') as f:
+            json.dump(client.get_json(f"lists/current/{encoded}.json"), f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the NYT Books API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="serve fixtures")
+    serve.add_argument('--port', type=int, default=5001)
+    serve.add_argument('--fixtures', default=os.environ.get('NYT_STUB_FIXTURES'))
+    serve.add_argument('--latency-ms', type=float, default=0)
+    serve.add_argument('--jitter-ms', type=float, default=0)
+    serve.add_argument('--error-rate', type=float, default=0)
+    serve.add_argument('--error-status', type=int, default=503)
+    serve.add_argument('--books-per-list', type=int, default=15)
+    serve.add_argument('--seed', type=int, default=1)
+
+    record = commands.add_parser('record', help="record live responses as fixtures")
+    record.add_argument('--out', default='fixtures/nyt')
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record_fixtures(args.out)
+    else:
+        stub_config = StubConfig(
+            fixtures_dir=args.fixtures,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+            books_per_list=args.books_per_list,
+            seed=args.seed,
+        )
+        create_app(stub_config).run(port=args.port, threaded=True)
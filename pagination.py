@@ -0,0 +1,204 @@
+"""Keyset (cursor) pagination.
+
+Pages are selected with WHERE (sort columns) > (cursor values) on a
+stable sort that ends with a unique column, so each page costs the same
+index range scan however deep it is, unlike OFFSET.
+Cursors are opaque URL-safe strings passed as ?after= or ?before=.
+"""
+
+import base64
+import json
+import os
+from decimal import Decimal
+
+from flask import abort, request, url_for
+from sqlalchemy import tuple_
+
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 24))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+
+
+class Page:
+    """One page of results and the cursors to its neighbours"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, per_page=DEFAULT_PAGE_SIZE):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        """Provide helpful representation when printed"""
+
+        return f"<Page {len(self.items)} items next={self.next_cursor} prev={self.prev_cursor}>"
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the values in a cursor, or None if it is missing or malformed"""
+
+    if not cursor:
+        return None
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        return None
+
+    return values if isinstance(values, list) else None
+
+
+def page_size_from_request():
+    """Return ?per_page= clamped to 1..MAX_PAGE_SIZE, or the default"""
+
+    try:
+        per_page = int(request.args.get('per_page', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        per_page = DEFAULT_PAGE_SIZE
+
+    return max(1, min(per_page, MAX_PAGE_SIZE))
+
+
+def cursor_values(after=None, before=None):
+    """Return (after_values, before_values), read from the request unless given.
+    At most one of them is set."""
+
+    if after is None and before is None:
+        after = request.args.get('after')
+        before = request.args.get('before')
+
+    after_values = decode_cursor(after)
+    before_values = decode_cursor(before) if after_values is None else None
+    return after_values, before_values
+
+
+def cursor_types(column):
+    """The JSON value types a cursor may hold for a sort column"""
+
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return (str, int, float)
+
+    if python_type in (float, Decimal):
+        return (int, float)
+    return (python_type,)
+
+
+def check_cursor(values, sort_columns):
+    """Reject (400) cursor values that don't fit the sort columns, which
+    would otherwise fail in the database"""
+
+    if values is None:
+        return
+
+    if len(values) != len(sort_columns) or any(
+            isinstance(value, bool) or not isinstance(value, cursor_types(column))
+            for value, column in zip(values, sort_columns)):
+        abort(400, "Invalid page cursor")
+
+
+def keyset_paginate(query, sort_columns, key, after=None, before=None, per_page=None):
+    """Return a Page of `query` ordered ascending by `sort_columns`.
+
+    `sort_columns` must end with a unique column (usually the id) and
+    `key(item)` must return an item's values for those columns.
+    `after` / `before` are cursors from a previous Page; by default they
+    and the page size are read from the current request. A cursor whose
+    values don't match the sort columns is answered with a 400.
+    """
+
+    per_page = per_page or page_size_from_request()
+    after_values, before_values = cursor_values(after, before)
+    check_cursor(after_values, sort_columns)
+    check_cursor(before_values, sort_columns)
+    columns = tuple_(*sort_columns)
+
+    if before_values is not None:
+        rows = (query.filter(columns < tuple_(*before_values))
+                .order_by(*[column.desc() for column in sort_columns])
+                .limit(per_page + 1)
+                .all())
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after_values is not None:
+            query = query.filter(columns > tuple_(*after_values))
+
+        rows = query.order_by(*sort_columns).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_next = len(rows) > per_page
+        has_prev = after_values is not None
+
+    return Page(
+        items,
+        next_cursor=encode_cursor(key(items[-1])) if items and has_next else None,
+        prev_cursor=encode_cursor(key(items[0])) if items and has_prev else None,
+        per_page=per_page
+    )
+
+
+def paginate_sorted(items, key, after=None, before=None, per_page=None):
+    """Return a Page of `items`, already sorted ascending by `key(item)`.
+    The in-memory counterpart of keyset_paginate; cursors are interchangeable."""
+
+    per_page = per_page or page_size_from_request()
+    after_values, before_values = cursor_values(after, before)
+
+    try:
+        if before_values is not None:
+            earlier = [item for item in items if list(key(item)) < before_values]
+        else:
+            later = [item for item in items if after_values is None or list(key(item)) > after_values]
+    except TypeError:
+        # A cursor that doesn't match the sort key; start from the first page
+        before_values = after_values = None
+        later = items
+
+    if before_values is not None:
+        page_items = earlier[-per_page:]
+        has_prev = len(earlier) > per_page
+        has_next = True
+    else:
+        page_items = later[:per_page]
+        has_next = len(later) > per_page
+        has_prev = after_values is not None
+
+    return Page(
+        page_items,
+        next_cursor=encode_cursor(key(page_items[-1])) if page_items and has_next else None,
+        prev_cursor=encode_cursor(key(page_items[0])) if page_items and has_prev else None,
+        per_page=per_page
+    )
+
+
+def page_url(after=None, before=None):
+    """URL of the current page with its cursor replaced; used by the pager macro"""
+
+    args = {name: value for name, value in request.args.items() if name not in ('after', 'before')}
+    if after:
+        args['after'] = after
+    if before:
+        args['before'] = before
+
+    return url_for(request.endpoint, **dict(request.view_args or {}, **args))
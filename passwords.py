@@ -0,0 +1,202 @@
+"""Password hashing in a bounded process pool.
+
+bcrypt is deliberately slow, and run in the request worker a burst of
+logins keeps every worker busy on CPU while other routes queue behind
+them. Hashing and checking run in a small pool of processes instead
+(HASH_WORKERS per app worker; 0 runs them inline). At most HASH_QUEUE_LIMIT
+operations wait for the pool; past that, or after HASH_QUEUE_TIMEOUT
+seconds waiting, requests get a 503 instead of piling up. So does an
+operation the pool hasn't finished within HASH_RESULT_TIMEOUT seconds.
+If a pool process dies, the pool is replaced and the operation retried
+once, then run inline.
+
+BCRYPT_LOG_ROUNDS sets the cost of new hashes. Existing hashes made with a
+different cost are replaced on the user's next successful login
+(see needs_rehash).
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+from nyt_client import LatencyRecorder
+
+
+BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 2))
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', 16))
+HASH_QUEUE_TIMEOUT = float(os.environ.get('HASH_QUEUE_TIMEOUT', 5))
+HASH_RESULT_TIMEOUT = float(os.environ.get('HASH_RESULT_TIMEOUT', 30))
+
+
+class HashQueueFull(ServiceUnavailable):
+    """Raised when too many password operations are already waiting"""
+
+    description = "Too many logins right now, please try again in a moment."
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+
+class PasswordHasher:
+    """Run bcrypt in a process pool, bounding how much work may wait for it"""
+
+    def __init__(self, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT,
+                 queue_timeout=HASH_QUEUE_TIMEOUT, log_rounds=BCRYPT_LOG_ROUNDS,
+                 result_timeout=HASH_RESULT_TIMEOUT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.log_rounds = log_rounds
+        self.result_timeout = result_timeout
+        self.latency = LatencyRecorder()
+
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_limit)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.rejected = 0
+        self.pool_restarts = 0
+
+    def _executor(self):
+        """The pool for this process, started on first use so that
+        gunicorn workers each start their own after forking"""
+
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """Drop a broken pool so the next call starts a fresh one"""
+
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self.pool_restarts += 1
+        pool.shutdown(wait=False)
+
+    def _in_pool(self, fn, *args):
+        for attempt in range(2):
+            pool = self._executor()
+            try:
+                future = pool.submit(fn, *args)
+                return future.result(timeout=self.result_timeout)
+            except BrokenProcessPool:
+                self._discard_pool(pool)
+            except TimeoutError:
+                future.cancel()
+                with self._lock:
+                    self.rejected += 1
+                raise HashQueueFull()
+
+        # The pool broke twice running this; don't leave the user waiting on a third
+        return fn(*args)
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HashQueueFull()
+
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        start = time.monotonic()
+        ok = False
+        try:
+            if self.workers:
+                result = self._in_pool(fn, *args)
+            else:
+                result = fn(*args)
+            ok = True
+            return result
+        finally:
+            self.latency.record(operation, time.monotonic() - start, ok=ok)
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def hash(self, password):
+        """Return a bcrypt hash of password at the configured cost"""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        return self._run('hash', _hash, password, self.log_rounds)
+
+    def check(self, hashed, password):
+        """Does password match the bcrypt hash?"""
+
+        if not hashed or not password:
+            return False
+
+        return self._run('check', _check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was this hash made with a different cost than the configured one?"""
+
+        try:
+            return int(hashed.split('$')[2]) != self.log_rounds
+        except (AttributeError, IndexError, ValueError):
+            return True
+
+    def stats(self):
+        """Return pool size, cost, queue depth, rejections and latency percentiles"""
+
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "log_rounds": self.log_rounds,
+                "queue_depth": max(self.in_flight - max(self.workers, 1), 0),
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "rejected": self.rejected,
+                "pool_restarts": self.pool_restarts,
+                "latency": self.latency.stats(),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown()
+            self._pool = None
+
+
+hasher = PasswordHasher()
+
+
+def hash_password(password):
+    return hasher.hash(password)
+
+
+def check_password(hashed, password):
+    return hasher.check(hashed, password)
+
+
+def needs_rehash(hashed):
+    return hasher.needs_rehash(hashed)
+
+
+def password_stats():
+    """Return the password hasher's queue depth and latency, as JSON-able dict"""
+
+    return hasher.stats()
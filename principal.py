@@ -0,0 +1,86 @@
+"""The logged-in user, without a database query until one is needed"""
+
+from flask import session
+
+from models import User
+
+
+CURR_USER_KEY = "curr_user"
+CURR_USERNAME_KEY = "curr_username"
+
+
+class UserGone(Exception):
+    """Raised when the session's user no longer exists. The app redirects
+    to the home page; the API answers with a JSON 401."""
+
+
+class LazyUser:
+    """Stands in for the logged-in User.
+
+    `id` and `username` come from the signed session cookie; the row is
+    loaded on first access to anything else, so requests that only need
+    the id (or nothing) run no user query. Use load() where a real User
+    instance is needed, e.g. to pass to db.session.delete().
+    """
+
+    def __init__(self, user_id, username=None):
+        object.__setattr__(self, 'id', user_id)
+        object.__setattr__(self, '_username', username)
+        object.__setattr__(self, '_user', None)
+
+    def __repr__(self):
+        """Provide helpful representation when printed"""
+
+        return f"<LazyUser #{self.id}: {self._username} {'loaded' if self.loaded else 'not loaded'}>"
+
+    @property
+    def username(self):
+        if self._username is None:
+            return self.load().username
+        return self._username
+
+    @property
+    def loaded(self):
+        return self._user is not None
+
+    def load(self):
+        """Return the User row, logging out a session whose user no longer
+        exists (and raising UserGone)"""
+
+        if self._user is None:
+            user = User.query.get(self.id)
+
+            if user is None:
+                forget_user()
+                raise UserGone()
+
+            object.__setattr__(self, '_user', user)
+
+        return self._user
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.load(), name, value)
+
+
+def remember_user(user):
+    """Put the user's id and username in the session"""
+
+    session[CURR_USER_KEY] = user.id
+    session[CURR_USERNAME_KEY] = user.username
+
+
+def forget_user():
+    session.pop(CURR_USER_KEY, None)
+    session.pop(CURR_USERNAME_KEY, None)
+
+
+def current_user():
+    """Return a LazyUser for the session, or None if nobody is logged in"""
+
+    if CURR_USER_KEY not in session:
+        return None
+
+    return LazyUser(session[CURR_USER_KEY], session.get(CURR_USERNAME_KEY))
@@ -0,0 +1,124 @@
+"""Route read-only queries to a read replica.
+
+Set DATABASE_REPLICA_URL to enable it; without one every query goes to
+the primary, as before. Reads are sent to the replica only when asked:
+
+    @app.route('/books')
+    @read_replica
+    def show_all_books(): ...
+
+or, for a single query inside any route:
+
+    with reading_from_replica():
+        books = Book.query.all()
+
+Everything else, and every read in a session that has already written,
+goes to the primary so a request sees its own writes. After a request
+commits a write, the browser's next REPLICA_PIN_SECONDS of requests also
+read from the primary, so the page it is redirected to isn't served from
+a replica that hasn't caught up yet.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_app_context, has_request_context, session as flask_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+
+
+REPLICA_BIND = 'replica'
+REPLICA_PIN_SECONDS = float(os.environ.get('REPLICA_PIN_SECONDS', 5))
+PRIMARY_UNTIL_KEY = 'read_primary_until'
+
+
+def replica_requested():
+    return has_app_context() and g.get('_read_replica', 0) > 0
+
+
+def pinned_by_recent_write():
+    return has_request_context() and flask_session.get(PRIMARY_UNTIL_KEY, 0) > time.time()
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends reads to the replica bind when the current
+    request asked for it and nothing has been written yet"""
+
+    def __init__(self, db, **options):
+        self._routing_db = db
+        self.wrote = False
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kw):
+        # The scoped session passes bind= and SQLAlchemy's private event
+        # flags; an explicit bind wins, and SignallingSession.get_bind
+        # accepts no keyword arguments, so the flags stop here
+        if bind is not None:
+            return bind
+
+        is_dml = getattr(clause, 'is_dml', False)
+        if is_dml or getattr(clause, '_for_update_arg', None) is not None:
+            self.wrote = self.wrote or is_dml
+            return super().get_bind(mapper, clause)
+
+        if (not self.wrote
+                and REPLICA_BIND in (self.app.config.get('SQLALCHEMY_BINDS') or {})
+                and replica_requested()
+                and not pinned_by_recent_write()):
+            return self._routing_db.get_engine(self.app, bind=REPLICA_BIND)
+
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def pin_flushing_session(session, flush_context, instances):
+    session.wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def pin_browser_after_write(session):
+    """Keep this browser on the primary for a few seconds after it wrote"""
+
+    if session.wrote and has_request_context():
+        flask_session[PRIMARY_UNTIL_KEY] = time.time() + REPLICA_PIN_SECONDS
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy using RoutingSession"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@contextmanager
+def reading_from_replica():
+    """Send reads inside this block to the replica, unless the session has written"""
+
+    g._read_replica = g.get('_read_replica', 0) + 1
+    try:
+        yield
+    finally:
+        g._read_replica -= 1
+
+
+def read_replica(view):
+    """Decorate a read-only view so its queries go to the replica"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with reading_from_replica():
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+def replica_binds(url):
+    """SQLALCHEMY_BINDS for a replica url, or {} if there is none"""
+
+    if not url:
+        return {}
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return {REPLICA_BIND: url}
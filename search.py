@@ -0,0 +1,220 @@
+"""Ranked, case-insensitive search over users and books.
+
+On Postgres the queries are served by the pg_trgm and full-text indexes
+created in migration 0006:
+
+  - trigram GIN indexes on lower(username), lower(title), lower(author)
+    answer substring (LIKE '%q%') and fuzzy (`%`) matches
+  - a GIN index on the title/author/description tsvector answers word
+    matches, ranked with ts_rank
+
+On a Postgres without pg_trgm, names and titles are matched by
+substring (ILIKE) and books also by the full-text index; only misspellings
+are lost. Other databases (SQLite test runs) use a small in-process
+TrigramIndex that scores the same fields with the same rules.
+"""
+
+import re
+
+from sqlalchemy import case, func, literal, or_, text
+
+from models import db, User, Book
+from pagination import keyset_paginate, paginate_sorted
+
+
+TEXT_SEARCH_CONFIG = 'english'
+
+# pg_trgm's default similarity threshold for the `%` operator
+SIMILARITY_THRESHOLD = 0.3
+
+# Added to the rank of a result that contains the query as a substring,
+# so exact fragments outrank fuzzy matches
+SUBSTRING_BONUS = 1.0
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+##########################################################################
+# Pure-Python fallback
+
+def trigrams(value):
+    """pg_trgm-style trigrams: each lowercased word padded with two spaces
+    in front and one behind"""
+
+    grams = set()
+    for word in WORD_RE.findall(value.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    """Share of trigrams the two strings have in common, from 0 to 1"""
+
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+class TrigramIndex:
+    """In-memory stand-in for the Postgres search indexes.
+
+    Each document has short `fuzzy` fields (names, titles) matched by
+    substring or trigram similarity, and optional long `words` text
+    matched when it contains every word of the query.
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    def add(self, key, fuzzy, words=''):
+        self.documents[key] = ([value.lower() for value in fuzzy if value],
+                               set(WORD_RE.findall((words or '').lower())))
+
+    def __len__(self):
+        return len(self.documents)
+
+    def score(self, query, key):
+        """Return the rank of document `key` for `query`, or None if it doesn't match"""
+
+        query = query.lower().strip()
+        fuzzy, words = self.documents[key]
+
+        best = max((similarity(value, query) for value in fuzzy), default=0.0)
+        contains = any(query in value for value in fuzzy)
+        query_words = set(WORD_RE.findall(query))
+        word_match = bool(query_words) and query_words <= words
+
+        if not (contains or word_match or best >= SIMILARITY_THRESHOLD):
+            return None
+
+        rank = best + (SUBSTRING_BONUS if contains else 0.0)
+        if word_match:
+            rank += len(query_words) / max(len(words), 1)
+        return rank
+
+    def search(self, query):
+        """Return [(rank, key), ...] for matching documents, best first"""
+
+        results = []
+        for key in self.documents:
+            rank = self.score(query, key)
+            if rank is not None:
+                results.append((rank, key))
+
+        results.sort(key=lambda result: (-result[0], result[1]))
+        return results
+
+
+##########################################################################
+# Queries
+
+_trigram_support = {}
+
+
+def search_mode():
+    """'trigram' on Postgres with the pg_trgm extension, 'fulltext' on other
+    Postgres databases, 'python' elsewhere; pg_trgm is checked once per database"""
+
+    bind = db.session().get_bind()
+    if bind.dialect.name != 'postgresql':
+        return 'python'
+
+    url = str(bind.url)
+    if url not in _trigram_support:
+        _trigram_support[url] = db.session.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar() is not None
+    return 'trigram' if _trigram_support[url] else 'fulltext'
+
+
+def ranked_page(query, rank, model):
+    """Keyset-paginate (model, sort_key) rows best rank first; sort_key is -rank"""
+
+    sort_key = -rank
+    rows = query.add_columns(sort_key.label('sort_key'))
+    page = keyset_paginate(rows, [sort_key, model.id], key=lambda row: (row.sort_key, row[0].id))
+    page.items = [row[0] for row in page.items]
+    return page
+
+
+def fallback_page(index, query, model):
+    """Paginate TrigramIndex results and load just that page's rows"""
+
+    ranked = [(-rank, key) for rank, key in index.search(query)]
+    page = paginate_sorted(ranked, key=lambda result: result)
+
+    ids = [key for _, key in page.items]
+    by_id = {row.id: row for row in model.query.filter(model.id.in_(ids))} if ids else {}
+    page.items = [by_id[key] for key in ids if key in by_id]
+    return page
+
+
+def search_users(query):
+    """Return a Page of users whose username matches `query`, best first"""
+
+    query = query.strip()
+    mode = search_mode()
+
+    if mode == 'python':
+        index = TrigramIndex()
+        for user_id, username in db.session.query(User.id, User.username):
+            index.add(user_id, [username])
+        return fallback_page(index, query, User)
+
+    needle = query.lower()
+    username = func.lower(User.username)
+    contains = username.contains(needle, autoescape=True)
+    rank = case((contains, literal(SUBSTRING_BONUS)), else_=literal(0.0))
+
+    if mode == 'fulltext':
+        return ranked_page(User.query.filter(contains), rank, User)
+
+    rank = func.similarity(username, needle) + rank
+    matches = User.query.filter(or_(contains, username.op('%')(needle)))
+    return ranked_page(matches, rank, User)
+
+
+def search_books(query):
+    """Return a Page of books matching `query` by title, author or description, best first"""
+
+    query = query.strip()
+    mode = search_mode()
+
+    if mode == 'python':
+        index = TrigramIndex()
+        for book_id, title, author, description in db.session.query(
+                Book.id, Book.title, Book.author, Book.description):
+            index.add(book_id, [title, author], ' '.join(filter(None, [title, author, description])))
+        return fallback_page(index, query, Book)
+
+    needle = query.lower()
+    title, author = func.lower(Book.title), func.lower(Book.author)
+    document = book_document()
+    words = func.plainto_tsquery(TEXT_SEARCH_CONFIG, query)
+    contains = or_(title.contains(needle, autoescape=True), author.contains(needle, autoescape=True))
+
+    rank = (case((contains, literal(SUBSTRING_BONUS)), else_=literal(0.0))
+            + func.ts_rank(document, words))
+
+    if mode == 'fulltext':
+        return ranked_page(Book.query.filter(or_(contains, document.op('@@')(words))), rank, Book)
+
+    rank = func.greatest(func.similarity(title, needle), func.similarity(author, needle)) + rank
+    matches = Book.query.filter(or_(
+        contains,
+        title.op('%')(needle),
+        author.op('%')(needle),
+        document.op('@@')(words),
+    ))
+    return ranked_page(matches, rank, Book)
+
+
+def book_document():
+    """The tsvector indexed by ix_books_search_document; must match it exactly
+    for Postgres to use the index"""
+
+    return func.to_tsvector(
+        TEXT_SEARCH_CONFIG,
+        func.coalesce(Book.title, '') + ' ' + func.coalesce(Book.author, '') + ' '
+        + func.coalesce(Book.description, ''))
@@ -0,0 +1,140 @@
+"""Coalesce concurrent calls for the same key into one call.
+
+Within a process, callers that arrive while a call for their key is in
+flight wait for it and share its result. Across processes (gunicorn
+workers on one host) the leader of each process takes an exclusive lock
+file for the key, and the result is left in a small JSON file that the
+other workers read instead of repeating the call if it is recent enough.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (e.g. Windows): coalesce within the process only
+    fcntl = None
+
+
+class _Call:
+    """One in-flight call and its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run at most one call per key at a time and share its result"""
+
+    def __init__(self, lock_dir=None, share_seconds=5):
+        self.lock_dir = lock_dir
+        self.share_seconds = share_seconds
+
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.coalesced = 0
+        self.shared = 0
+
+        if self.lock_dir and fcntl:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def stats(self):
+        """Return how many calls ran and how many were avoided"""
+
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "shared_across_processes": self.shared,
+                "in_flight": len(self._calls),
+            }
+
+    def do(self, key, fn):
+        """Return fn(), unless a call for key is already running, then return its result"""
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self._call_across_processes(key, fn)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _call_across_processes(self, key, fn):
+        """Call fn under the key's lock file, reusing a result another process just stored"""
+
+        if not (self.lock_dir and fcntl):
+            return self._count(fn)
+
+        path = os.path.join(self.lock_dir, hashlib.sha1(key.encode()).hexdigest())
+
+        with open(f"{path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                shared = self._read_shared(f"{path}.json")
+                if shared is not None:
+                    with self._lock:
+                        self.shared += 1
+                    return shared
+
+                value = self._count(fn)
+                self._write_shared(f"{path}.json", value)
+                return value
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _count(self, fn):
+        with self._lock:
+            self.calls += 1
+        return fn()
+
+    def _read_shared(self, path):
+        """Return the stored result at path if written within share_seconds, else None"""
+
+        try:
+            if time.time() - os.path.getmtime(path) > self.share_seconds:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_shared(self, path, value):
+        """Atomically store a JSON result at path; unserializable results are not shared"""
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.lock_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.unlink(tmp_path)
+            except (OSError, NameError):
+                pass
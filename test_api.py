@@ -0,0 +1,158 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api.py
+
+
+import base64
+import json
+from unittest.mock import MagicMock, patch
+
+from db_testcase import DatabaseTestCase
+from models import db, User, Book, Rating
+
+from app import app, CURR_USER_KEY
+from nyt_client import NYTApiError
+
+
+class ApiTestCase(DatabaseTestCase):
+    """Test the /api/v1 endpoints"""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User.signup("testuser", "test@test.com", "password")
+        books = [Book(title=f"Book {n}", description="TestDescription", author="TestAuthor")
+                 for n in range(5)]
+        db.session.add_all(books)
+        db.session.commit()
+
+        self.user_id = user.id
+        self.book_ids = [book.id for book in books]
+        self.client = app.test_client()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def test_batch_books(self):
+        """Are batched books returned in the order asked, with missing ids listed?"""
+
+        ids = [self.book_ids[2], self.book_ids[0], 999999]
+        resp = self.client.get(f"/api/v1/books/batch?ids={','.join(map(str, ids))}&fields=id,title")
+        body = resp.get_json()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(body["data"], [{"id": self.book_ids[2], "title": "Book 2"},
+                                        {"id": self.book_ids[0], "title": "Book 0"}])
+        self.assertEqual(body["missing"], [999999])
+
+    def test_unknown_field(self):
+        """Is an unknown field a JSON 400?"""
+
+        resp = self.client.get("/api/v1/books?fields=id,password")
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("password", resp.get_json()["error"]["message"])
+
+    def test_cursor_pagination(self):
+        """Do the next cursors walk every book exactly once?"""
+
+        titles = []
+        url = "/api/v1/books?per_page=2&fields=title"
+        while url:
+            body = self.client.get(url).get_json()
+            titles.extend(book["title"] for book in body["data"])
+            url = body["next"] and f"/api/v1/books?per_page=2&fields=title&after={body['next']}"
+
+        self.assertEqual(titles, [f"Book {n}" for n in range(5)])
+
+    def test_invalid_cursor(self):
+        """Is a well-formed cursor with the wrong values refused with a 400?"""
+
+        for values in ([{"a": 1}, "x"], ["Book 1"], ["Book 1", "x"], ["Book 1", True]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            resp = self.client.get(f"/api/v1/books?after={cursor}")
+
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.get_json()["error"]["status"], 400)
+
+    def test_write_requires_login(self):
+        """Are writes refused for anonymous clients?"""
+
+        resp = self.client.put(f"/api/v1/books/{self.book_ids[0]}/rating", json={"score": 4})
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(Rating.query.count(), 0)
+
+    def test_write_requires_json(self):
+        """Is a form-encoded write rejected?"""
+
+        with self.client as c:
+            self.login(c)
+            resp = c.put(f"/api/v1/books/{self.book_ids[0]}/rating", data={"score": 4})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(Rating.query.count(), 0)
+
+    def test_rate_and_list(self):
+        """Does rating a book show up in the book and the user's ratings?"""
+
+        book_id = self.book_ids[0]
+        with self.client as c:
+            self.login(c)
+            resp = c.put(f"/api/v1/books/{book_id}/rating", json={"score": 4})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json()["data"]["score"], 4)
+
+            resp = c.put(f"/api/v1/users/me/booklist/{book_id}", json={})
+            self.assertEqual(resp.status_code, 204)
+
+            ratings = c.get(f"/api/v1/users/{self.user_id}/ratings").get_json()
+            self.assertEqual([rating["book_id"] for rating in ratings["data"]], [book_id])
+
+            booklist = c.get(f"/api/v1/users/{self.user_id}/booklist?fields=id").get_json()
+            self.assertEqual(booklist["data"], [{"id": book_id}])
+
+            user = c.get(f"/api/v1/users/{self.user_id}?fields=ratings_count,booklist_count").get_json()
+            self.assertEqual(user["data"], {"ratings_count": 1, "booklist_count": 1})
+
+        book = self.client.get(f"/api/v1/books/{book_id}?fields=avg_rating,num_of_ratings").get_json()
+        self.assertEqual(book["data"], {"avg_rating": 4, "num_of_ratings": 1})
+
+    def test_user_reads_require_login(self):
+        """Are users and their lists hidden from anonymous clients, as on the site?"""
+
+        for path in ("", "/booklist", "/ratings", "/reviews", "/followers", "/following"):
+            resp = self.client.get(f"/api/v1/users/{self.user_id}{path}")
+
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.get_json()["error"]["status"], 401)
+
+    def test_nyt_categories_when_api_is_down(self):
+        """Are the last good categories served, flagged stale, or else a 503?"""
+
+        categories = MagicMock(side_effect=NYTApiError("down"))
+        categories.last_good.return_value = ["Hardcover Fiction"]
+
+        with patch("api.mirrored_categories", return_value=[]), patch("api.get_all_categories", categories):
+            body = self.client.get("/api/v1/nyt/categories").get_json()
+            self.assertEqual(body, {"data": ["Hardcover Fiction"], "stale": True})
+
+            categories.last_good.return_value = None
+            resp = self.client.get("/api/v1/nyt/categories")
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp.get_json()["error"]["status"], 503)
+
+    def test_write_by_deleted_user(self):
+        """Does a session whose user was deleted get a JSON 401?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 999999
+
+            resp = c.put(f"/api/v1/books/{self.book_ids[0]}/rating", json={"score": 4})
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(resp.get_json()["error"]["status"], 401)
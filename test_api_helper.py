@@ -0,0 +1,171 @@
+"""NYT helper tests, run against the local stand-in."""
+
+# run these tests like:
+#
+#    python -m unittest test_api_helper.py
+
+
+import io
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+
+import api_helper
+from api_helper import (nyt_cache, warm_cache, get_books_by_category, get_book_by_category_title,
+                        normalize_title, iter_overview_lists)
+from nyt_stub import PREFIX, SYNTHETIC_CATEGORIES, StubConfig, create_app
+from singleflight import SingleFlight
+
+
+class StubTransport(BaseAdapter):
+    """Answer the client's requests from the nyt_stub app, counting them"""
+
+    def __init__(self, config):
+        super().__init__()
+        self.app = create_app(config)
+        self.paths = []
+        self._lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        # Serve the path under the stub's prefix, wherever NYT_API_BASE_URL points
+        url = urlsplit(request.url)
+        path = PREFIX + url.path[len(urlsplit(api_helper.client.base_url).path) - 1:]
+        with self._lock:
+            self.paths.append(path)
+
+        answer = self.app.test_client().get(path, query_string=url.query)
+
+        response = requests.Response()
+        response.status_code = answer.status_code
+        response.raw = io.BytesIO(answer.data)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class NYTHelperTestCase(TestCase):
+    """Base case: the shared client talks to a fresh stand-in, with an empty
+    cache and no results shared through lock files from earlier tests"""
+
+    def setUp(self):
+        self.fixtures = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.fixtures.name, 'current'))
+
+        self.transport = StubTransport(StubConfig(fixtures_dir=self.fixtures.name, books_per_list=3))
+        self.adapters = dict(api_helper.client.session.adapters)
+        api_helper.client.session.mount('https://', self.transport)
+        api_helper.client.session.mount('http://', self.transport)
+        api_helper.client.breaker.record_success()
+        self.flight = api_helper.flight
+        api_helper.flight = SingleFlight()
+        nyt_cache.clear()
+
+    def tearDown(self):
+        api_helper.client.session.adapters.clear()
+        api_helper.client.session.adapters.update(self.adapters)
+        api_helper.flight = self.flight
+        nyt_cache.clear()
+        self.fixtures.cleanup()
+
+    def write_fixture(self, data, *parts):
+        with open(os.path.join(self.fixtures.name, *parts), 'w') as f:
+            json.dump(data, f)
+
+
+class WarmCacheTestCase(NYTHelperTestCase):
+    """Test warming every category list concurrently"""
+
+    def test_warm_cache_fills_every_list(self):
+        """Does warming fetch each list once, so later reads make no request?"""
+
+        self.write_fixture({"results": [{"list_name_encoded": "hardcover-fiction"},
+                                        {"list_name_encoded": "picture-books"}]}, 'names.json')
+
+        report = warm_cache(concurrency=2)
+
+        self.assertEqual((report["categories"], report["warmed"], report["failed"]), (2, 2, []))
+        self.assertEqual(report["concurrency"], 2)
+        self.assertEqual(sorted(self.transport.paths), [
+            "/svc/books/v3/lists/current/hardcover-fiction.json",
+            "/svc/books/v3/lists/current/picture-books.json",
+            "/svc/books/v3/lists/names.json",
+        ])
+
+        requests_made = len(self.transport.paths)
+        self.assertEqual(len(get_books_by_category("Picture Books")), 3)
+        self.assertEqual(len(self.transport.paths), requests_made)
+
+    def test_warm_cache_reports_failures(self):
+        """Is a list that can't be fetched reported, without stopping the others?"""
+
+        self.write_fixture({"results": [{"list_name_encoded": "hardcover-fiction"},
+                                        {"list_name_encoded": "no-such-list"}]}, 'names.json')
+
+        report = warm_cache(concurrency=2)
+
+        self.assertEqual(report["warmed"], 1)
+        self.assertEqual(report["failed"], ["No Such List"])
+
+
+class TitleLookupTestCase(NYTHelperTestCase):
+    """Test finding a book in a category's cached list by normalized title"""
+
+    def setUp(self):
+        super().setUp()
+        self.write_fixture({"results": {"list_name_encoded": "hardcover-fiction", "books": [
+            {"title": "THE  MIDNIGHT LIBRARY", "author": "Matt Haig", "book_image": "a.jpg", "description": "One"},
+            {"title": "Project Hail Mary", "author": "Andy Weir", "book_image": "b.jpg", "description": "Two"},
+        ]}}, 'current', 'hardcover-fiction.json')
+
+    def test_normalize_title(self):
+        """Are case and runs of whitespace ignored?"""
+
+        self.assertEqual(normalize_title("  The\tMidnight   LIBRARY "), "the midnight library")
+
+    def test_lookup_ignores_case_and_spacing(self):
+        """Is a book found whatever the title's case and spacing?"""
+
+        book = get_book_by_category_title("Hardcover Fiction", "the midnight library")
+
+        self.assertEqual(book, {"title": "THE  MIDNIGHT LIBRARY", "author": "Matt Haig",
+                                "image": "a.jpg", "description": "One"})
+        self.assertEqual(get_book_by_category_title("Hardcover Fiction", "PROJECT HAIL MARY")["author"],
+                         "Andy Weir")
+
+    def test_missing_title(self):
+        """Is a title that isn't on the list None?"""
+
+        self.assertIsNone(get_book_by_category_title("Hardcover Fiction", "Not On The List"))
+
+    def test_lookups_share_one_fetch(self):
+        """Do lookups in the same category reuse the one cached list?"""
+
+        get_book_by_category_title("Hardcover Fiction", "the midnight library")
+        get_book_by_category_title("hardcover fiction", "project hail mary")
+        get_books_by_category("Hardcover Fiction")
+
+        self.assertEqual(self.transport.paths, ["/svc/books/v3/lists/current/hardcover-fiction.json"])
+
+
+class OverviewTestCase(NYTHelperTestCase):
+    """Test reading every list from the streamed overview payload"""
+
+    def test_iter_overview_lists(self):
+        """Does each list carry its books and the payload's published date?"""
+
+        lists = list(iter_overview_lists())
+
+        self.assertEqual(len(lists), len(SYNTHETIC_CATEGORIES))
+        self.assertEqual(lists[0]["list_name_encoded"], SYNTHETIC_CATEGORIES[0])
+        self.assertEqual(lists[0]["published_date"], "2022-05-15")
+        self.assertEqual(len(lists[0]["books"]), 3)
+        self.assertEqual(self.transport.paths, ["/svc/books/v3/lists/overview.json"])
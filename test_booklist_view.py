@@ -0,0 +1,108 @@
+"""Booklist View tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_booklist_view.py
+
+
+import re
+
+from sqlalchemy import event
+
+from db_testcase import DatabaseTestCase
+from models import db, User, Book, BookList
+
+from app import app
+
+
+class BookListViewTestCase(DatabaseTestCase):
+    """Test views for booklists."""
+
+    def setUp(self):
+        """Create test client and sample books."""
+
+        super().setUp()
+
+        books = [
+            Book(title=f"TestBook{n}", description="TestDescription", author="TestAuthor", image=f"cover{n}.jpg")
+            for n in range(3)
+        ]
+        db.session.add_all(books)
+        db.session.commit()
+
+        # Keep ids, not instances: each request removes the session and detaches them
+        self.book_ids = [book.id for book in books]
+
+        self.client = app.test_client()
+
+    def add_users_with_books(self, count, start=0):
+        """Add `count` users, each with every sample book on their list"""
+
+        for n in range(start, start + count):
+            user = User(username=f"reader{n}", email=f"reader{n}@test.com", password="HASHED_PASSWORD")
+            db.session.add(user)
+            db.session.flush()
+            db.session.add_all([BookList(user_id=user.id, book_id=book_id) for book_id in self.book_ids])
+
+        db.session.commit()
+
+    def count_queries(self, url):
+        """GET url and return (response, number of SQL statements run)"""
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = self.client.get(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        return resp, len(statements)
+
+    def test_booklists_show_users_and_books(self):
+        """Are users and their saved book covers displayed?"""
+
+        self.add_users_with_books(2)
+
+        resp = self.client.get("/booklists")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("reader0's Booklist", html)
+        self.assertIn("cover2.jpg", html)
+
+    def test_booklists_query_count_is_constant(self):
+        """Does the page run the same number of queries for 2 users as for 20?"""
+
+        self.add_users_with_books(2)
+        resp, few_users_queries = self.count_queries("/booklists")
+        self.assertEqual(resp.status_code, 200)
+
+        self.add_users_with_books(18, start=2)
+        resp, many_users_queries = self.count_queries("/booklists")
+        self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(few_users_queries, many_users_queries)
+
+    def test_booklists_are_paginated(self):
+        """Does each page show per_page users and link to the next page?"""
+
+        self.add_users_with_books(3)
+
+        resp = self.client.get("/booklists?per_page=2")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("reader1's Booklist", html)
+        self.assertNotIn("reader2's Booklist", html)
+
+        next_url = re.search(r'href="([^"]*after=[^"]*)"', html).group(1).replace("&amp;", "&")
+        resp = self.client.get(next_url)
+        html = resp.get_data(as_text=True)
+
+        self.assertIn("reader2's Booklist", html)
+        self.assertNotIn("reader0's Booklist", html)
+        self.assertIn("before=", html)
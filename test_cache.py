@@ -0,0 +1,180 @@
+"""TTL cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+
+import json
+import os
+import pickle
+import sqlite3
+import stat
+import tempfile
+import threading
+from unittest import TestCase
+
+from cache import TTLCache, SQLiteBackend
+
+
+class FakeClock:
+    """Clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTestCase(TestCase):
+    """Test TTL cache"""
+
+    def setUp(self):
+        """Create a cache driven by a fake clock"""
+
+        self.clock = FakeClock()
+        self.cache = TTLCache(maxsize=2, ttl=10, stale_ttl=5, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        """Is the loader only called on a miss?"""
+
+        calls = []
+        loader = lambda: calls.append(1) or "value"
+
+        self.assertEqual(self.cache.get_or_load("k", loader), "value")
+        self.assertEqual(self.cache.get_or_load("k", loader), "value")
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry evicted at maxsize?"""
+
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expiry(self):
+        """Is an entry dropped once past its stale window?"""
+
+        self.cache.set("a", 1)
+        self.clock.now = 16
+
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_last_good_after_expiry(self):
+        """Is the last value still available once expired?"""
+
+        self.cache.set("a", 1)
+        self.clock.now = 100
+
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.last_good("a"), 1)
+
+    def test_stale_while_revalidate(self):
+        """Is a stale value served at once while a refresh runs?"""
+
+        self.cache.set("k", "old")
+        self.clock.now = 12
+
+        release = threading.Event()
+
+        def slow_loader():
+            release.wait(1)
+            return "new"
+
+        self.assertEqual(self.cache.get_or_load("k", slow_loader), "old")
+        self.assertEqual(self.cache.stats()["stale_hits"], 1)
+
+        release.set()
+        for thread in threading.enumerate():
+            if thread.name.startswith("cache-refresh-"):
+                thread.join(1)
+
+        self.assertEqual(self.cache.get("k"), "new")
+        self.assertEqual(self.cache.stats()["refreshes"], 1)
+
+    def test_memoize(self):
+        """Are memoized calls cached per argument?"""
+
+        calls = []
+
+        @self.cache.memoize()
+        def double(n):
+            calls.append(n)
+            return n * 2
+
+        self.assertEqual(double(2), 4)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(double(3), 6)
+        self.assertEqual(calls, [2, 3])
+
+
+class SQLiteBackendTestCase(TestCase):
+    """Test the cache backend shared between processes"""
+
+    def setUp(self):
+        """Create two caches on one SQLite file, as two workers would"""
+
+        self.tmp = tempfile.TemporaryDirectory()
+        path = self.path = os.path.join(self.tmp.name, "cache", "cache.sqlite3")
+
+        self.clock = FakeClock()
+        self.worker1 = TTLCache(ttl=10, clock=self.clock, backend=SQLiteBackend(path, "nyt", maxsize=2))
+        self.worker2 = TTLCache(ttl=10, clock=self.clock, backend=SQLiteBackend(path, "nyt", maxsize=2))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_shared_between_caches(self):
+        """Does a value stored by one worker hit in the other?"""
+
+        self.worker1.set(("books", ("hardcover-fiction",), ()), [{"title": "A"}])
+
+        self.assertEqual(self.worker2.get_or_load(("books", ("hardcover-fiction",), ()), lambda: None),
+                         [{"title": "A"}])
+        self.assertEqual(self.worker2.stats()["hits"], 1)
+
+    def test_size_bound(self):
+        """Are rows beyond maxsize evicted?"""
+
+        for key in "abc":
+            self.worker1.set(key, key)
+
+        self.assertEqual(len(self.worker2), 2)
+        self.assertEqual(self.worker1.stats()["evictions"], 1)
+
+    def test_expiry(self):
+        """Does the TTL apply to shared rows?"""
+
+        self.worker1.set("a", 1)
+        self.clock.now = 11
+
+        self.assertIsNone(self.worker2.get("a"))
+        self.assertEqual(self.worker2.last_good("a"), 1)
+
+    def test_file_is_private(self):
+        """Are the cache file and its directory readable only by this user?"""
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode), 0o700)
+
+    def test_values_are_json(self):
+        """Are values stored as JSON, and rows that aren't JSON ignored rather than unpickled?"""
+
+        self.worker1.set("a", {"books": [{"title": "A"}]})
+        conn = sqlite3.connect(self.path)
+        with conn:
+            self.assertEqual(json.loads(conn.execute("SELECT value FROM cache_entries").fetchone()[0]),
+                             {"books": [{"title": "A"}]})
+            conn.execute("UPDATE cache_entries SET value = ?", (pickle.dumps({"books": []}),))
+        conn.close()
+
+        self.assertIsNone(self.worker2.get("a"))
@@ -0,0 +1,116 @@
+"""Conditional GET tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_conditional.py
+
+
+from datetime import date, datetime
+
+from db_testcase import DatabaseTestCase
+from models import db, User, Book, Category, BestSeller
+
+from app import app, CURR_USER_KEY
+
+
+class ConditionalGetTestCase(DatabaseTestCase):
+    """Test ETags, 304 responses and Cache-Control on read pages"""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User.signup("testuser", "test@test.com", "password")
+        book = Book(title="TestBook", description="TestDescription", author="TestAuthor")
+        db.session.add(book)
+        db.session.commit()
+
+        self.user_id = user.id
+        self.book_id = book.id
+        self.client = app.test_client()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def test_unchanged_page_is_304(self):
+        """Is a revisit with the page's ETag answered with an empty 304?"""
+
+        resp = self.client.get("/books")
+        etag = resp.headers["ETag"]
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("no-cache", resp.headers["Cache-Control"])
+
+        resp = self.client.get("/books", headers={"If-None-Match": etag})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+
+    def test_write_changes_etag(self):
+        """Does rating a book change its page's ETag?"""
+
+        with self.client as c:
+            self.login(c)
+            etag = c.get(f"/books/{self.book_id}").headers["ETag"]
+            self.assertIn("private", c.get(f"/books/{self.book_id}").headers["Cache-Control"])
+
+            c.post(f"/books/{self.book_id}", data={"book-rating": "4"})
+
+            resp = c.get(f"/books/{self.book_id}", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_etag_depends_on_viewer(self):
+        """Is a logged-in page not revalidated against an anonymous visitor's ETag?"""
+
+        etag = self.client.get("/booklists").headers["ETag"]
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get("/booklists", headers={"If-None-Match": etag})
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_login_pages_redirect_anonymous_revisits(self):
+        """Is an anonymous visitor sent to log in even with matching validators?"""
+
+        for url in (f"/books/{self.book_id}", f"/users/{self.user_id}"):
+            resp = self.client.get(url, headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertNotIn("ETag", resp.headers)
+
+    def test_book_page_etag_per_viewer(self):
+        """Does another user's revisit with the first user's ETag get the full page?"""
+
+        other = User.signup("otheruser", "other@test.com", "password")
+        db.session.commit()
+        other_id = other.id
+
+        with self.client as c:
+            self.login(c)
+            etag = c.get(f"/books/{self.book_id}").headers["ETag"]
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = other_id
+            resp = c.get(f"/books/{self.book_id}", headers={"If-None-Match": etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_public_nyt_results(self):
+        """Can a CDN cache mirrored NYT results for anonymous visitors?"""
+
+        category = Category(category_name="Hardcover Fiction", list_name_encoded="hardcover-fiction",
+                            published_date=date(2022, 5, 15), updated_at=datetime(2022, 5, 15, 12))
+        db.session.add(category)
+        db.session.flush()
+        db.session.add(BestSeller(category_id=category.id, rank=1, title="TESTBOOK", author="TestAuthor",
+                                  updated_at=datetime(2022, 5, 15, 12)))
+        db.session.commit()
+
+        resp = self.client.get("/results?category=Hardcover Fiction")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("public", resp.headers["Cache-Control"])
+        self.assertIn("max-age", resp.headers["Cache-Control"])
+        self.assertEqual(resp.headers["Last-Modified"], "Sun, 15 May 2022 12:00:00 GMT")
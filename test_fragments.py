@@ -0,0 +1,136 @@
+"""Template fragment cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_fragments.py
+
+
+from unittest import TestCase
+
+from flask import session
+
+from db_testcase import DatabaseTestCase
+from models import db, User, Book, Rating, Review
+
+from app import app, CURR_USER_KEY
+import fragments
+from fragments import fragment_cache, invalidate
+from replica import PRIMARY_UNTIL_KEY
+
+
+class FragmentCacheTestCase(DatabaseTestCase):
+    """Test caching and invalidation of template fragments"""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.signup("testuser", "test@test.com", "password")
+        self.book = Book(title="TestBook", description="TestDescription", author="TestAuthor")
+        db.session.add(self.book)
+        db.session.commit()
+
+        # One request context for the whole test: popping it removes the
+        # session, which would drop pending invalidations between renders
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+
+        # Cache as if on the shared backend; the versions stay in this process
+        self.enabled = fragments.enabled
+        fragments.enabled = True
+
+        fragment_cache.clear()
+        self.template = app.jinja_env.from_string(
+            "{% call fragment('test', 'book', book_id) %}{{ text }}{% endcall %}")
+
+    def tearDown(self):
+        fragments.enabled = self.enabled
+        self.ctx.pop()
+        super().tearDown()
+
+    def render(self, text):
+        return self.template.render(book_id=self.book.id, text=text)
+
+    def test_fragment_is_cached(self):
+        """Is the second render served from the cache?"""
+
+        self.assertEqual(self.render("first"), "first")
+        self.assertEqual(self.render("second"), "first")
+        self.assertEqual(fragment_cache.stats()["hit_ratio"], 0.5)
+
+    def test_not_cached_without_shared_versions(self):
+        """Is every render fresh when versions can't be shared between workers?"""
+
+        fragments.enabled = False
+
+        self.assertEqual(self.render("first"), "first")
+        self.assertEqual(self.render("second"), "second")
+
+    def test_invalidate_after_commit(self):
+        """Does invalidate() take effect only once the transaction commits?"""
+
+        self.render("first")
+
+        invalidate('book', self.book.id)
+        self.assertEqual(self.render("second"), "first")
+
+        db.session.commit()
+        self.assertEqual(self.render("second"), "second")
+
+    def test_orm_write_invalidates(self):
+        """Does committing a review through the ORM invalidate its book's fragments?"""
+
+        self.render("first")
+
+        db.session.add(Review(user_id=self.user.id, book_id=self.book.id, summary="Great"))
+        db.session.commit()
+
+        self.assertEqual(self.render("second"), "second")
+
+    def test_commit_pins_browser_and_invalidates(self):
+        """With app loaded, does a commit run both the replica and the fragment listeners?"""
+
+        self.render("first")
+
+        db.session.add(Review(user_id=self.user.id, book_id=self.book.id, summary="Great"))
+        db.session.commit()
+
+        self.assertIn(PRIMARY_UNTIL_KEY, session)
+        self.assertEqual(self.render("second"), "second")
+
+    def test_deleting_rater_invalidates_book(self):
+        """Does deleting a user who only rated a book invalidate the book's fragments?"""
+
+        Rating.rate(self.user.id, self.book.id, 4)
+        db.session.commit()
+        self.render("first")
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+            c.post("/users/delete")
+
+        self.assertEqual(self.render("second"), "second")
+
+    def test_rollback_keeps_fragments(self):
+        self.render("first")
+
+        invalidate('book', self.book.id)
+        db.session.rollback()
+        db.session.commit()
+
+        self.assertEqual(self.render("second"), "first")
+
+
+class CacheStatsTestCase(TestCase):
+    """Test who may read /stats/cache"""
+
+    def test_local_request(self):
+        resp = app.test_client().get("/stats/cache")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("fragments", resp.get_json())
+
+    def test_remote_request(self):
+        resp = app.test_client().get("/stats/cache", environ_base={"REMOTE_ADDR": "203.0.113.9"})
+
+        self.assertEqual(resp.status_code, 404)
@@ -0,0 +1,72 @@
+"""Streaming JSON tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_json_stream.py
+
+
+import json
+from unittest import TestCase
+
+from json_stream import iter_array_items
+
+
+def split(text, size):
+    """Cut text into byte chunks of `size`"""
+
+    data = text.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class IterArrayItemsTestCase(TestCase):
+    """Test reading array elements from a chunked JSON document"""
+
+    def setUp(self):
+        self.payload = {
+            "status": "OK",
+            "results": {
+                "published_date": "2022-05-15",
+                "lists": [
+                    {"list_name_encoded": "hardcover-fiction", "books": [{"title": 'CAFÉ "LISTS": [', "rank": 1}]},
+                    {"list_name_encoded": "picture-books", "books": []},
+                ],
+            },
+        }
+        self.text = json.dumps(self.payload, ensure_ascii=False)
+
+    def test_items_across_small_chunks(self):
+        """Are all elements decoded when chunks cut through them (and through UTF-8)?"""
+
+        items = list(iter_array_items(split(self.text, 7), "lists"))
+
+        self.assertEqual(items, self.payload["results"]["lists"])
+
+    def test_scalar_fields_before_array(self):
+        """Are the scalar fields before the array returned, whatever the chunk size?"""
+
+        payload = {
+            "status": "OK",
+            "num_results": 12345,
+            "note": 'not the array: "lists": [',
+            "results": {"published_date": "2022-05-15", "final": True, "lists": [{"list_id": 1}]},
+        }
+
+        for size in (1, 3, 64):
+            fields = {}
+            items = list(iter_array_items(split(json.dumps(payload), size), "lists", fields_out=fields))
+
+            self.assertEqual(items, [{"list_id": 1}])
+            self.assertEqual(fields, {"status": "OK", "num_results": 12345, "note": 'not the array: "lists": [',
+                                      "published_date": "2022-05-15", "final": True})
+
+    def test_missing_key(self):
+        """Is a document without the array rejected?"""
+
+        with self.assertRaises(ValueError):
+            list(iter_array_items(split('{"results": {}}', 4), "lists"))
+
+    def test_truncated_document(self):
+        """Is a document cut off inside the array rejected?"""
+
+        with self.assertRaises(ValueError):
+            list(iter_array_items(split(self.text[:60], 8), "lists"))
@@ -0,0 +1,162 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import exc, inspect, text
+
+from models import db, Book, User
+
+# Set an environmental variable to use a different database for tests
+
+os.environ['DATABASE_URL'] = "postgresql:///book_app-test"
+
+
+from app import app
+from migrations import MIGRATIONS, upgrade, pending_migrations
+
+
+# The tables as the app created them before versioned migrations
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id SERIAL PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        email TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL)""",
+    """CREATE TABLE follows (
+        user_being_followed_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+        user_following_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+        PRIMARY KEY (user_being_followed_id, user_following_id))""",
+    """CREATE TABLE books (
+        id SERIAL PRIMARY KEY,
+        title VARCHAR NOT NULL UNIQUE,
+        image VARCHAR,
+        publication_dt DATE,
+        description TEXT NOT NULL,
+        author VARCHAR NOT NULL,
+        category VARCHAR,
+        avg_rating FLOAT,
+        num_of_ratings INTEGER,
+        num_of_reviews INTEGER)""",
+    """CREATE TABLE booklists (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+        book_id INTEGER REFERENCES books (id) ON DELETE CASCADE)""",
+    """CREATE TABLE reviews (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        book_id INTEGER NOT NULL REFERENCES books (id) ON DELETE CASCADE,
+        url VARCHAR,
+        summary TEXT NOT NULL)""",
+    """CREATE TABLE rating (
+        id SERIAL PRIMARY KEY,
+        score INTEGER NOT NULL,
+        book_id INTEGER NOT NULL REFERENCES books (id) ON DELETE CASCADE,
+        user_id INTEGER REFERENCES users (id) ON DELETE CASCADE)""",
+    """CREATE TABLE categories (
+        id SERIAL PRIMARY KEY,
+        category_name VARCHAR NOT NULL)""",
+    """CREATE TABLE authors (
+        id SERIAL PRIMARY KEY,
+        author_name VARCHAR NOT NULL,
+        race VARCHAR,
+        gender VARCHAR)""",
+]
+
+BASELINE_DATA = [
+    "INSERT INTO users (id, username, email, password) VALUES "
+    "(1, 'reader', 'reader@test.com', 'HASH'), (2, 'friend', 'friend@test.com', 'HASH')",
+    "INSERT INTO follows (user_being_followed_id, user_following_id) VALUES (1, 2)",
+    "INSERT INTO books (id, title, description, author, avg_rating, num_of_ratings) VALUES "
+    "(1, 'DUNE', 'Desert', 'Frank Herbert', 4.5, 2), (2, 'Dune', 'Reissue', 'frank herbert', NULL, NULL)",
+    # Duplicate booklist and rating rows, which the unique indexes forbid
+    "INSERT INTO booklists (user_id, book_id) VALUES (1, 1), (1, 1), (2, 1)",
+    "INSERT INTO rating (score, book_id, user_id) VALUES (5, 1, 1), (3, 1, 1), (4, 1, 2)",
+    "INSERT INTO reviews (user_id, book_id, summary) VALUES (1, 1, 'Great')",
+]
+
+
+class MigrationTestCase(TestCase):
+    """Test the migration runner on an empty database and on the baseline schema"""
+
+    def setUp(self):
+        db.session.remove()
+        with db.engine.begin() as conn:
+            for table in ('schema_migrations', 'rating', *reversed(db.metadata.sorted_tables)):
+                conn.execute(text(f'DROP TABLE IF EXISTS {getattr(table, "name", table)} CASCADE'))
+
+        self.messages = []
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_fresh_database(self):
+        """Are all migrations applied once, in order, to an empty database?"""
+
+        applied = upgrade(db.engine, log=self.messages.append)
+
+        self.assertEqual(applied, [migration.version for migration in MIGRATIONS])
+        self.assertEqual(upgrade(db.engine, log=self.messages.append), [])
+        self.assertEqual(self.messages[-1], "Database schema is up to date")
+
+        tables = set(inspect(db.engine).get_table_names())
+        self.assertTrue({table.name for table in db.metadata.sorted_tables} <= tables)
+
+    def test_only_pending_migrations_run(self):
+        """Are migrations already recorded skipped?"""
+
+        with db.engine.begin() as conn:
+            for statement in BASELINE_SCHEMA:
+                conn.execute(text(statement))
+
+        upgrade(db.engine, log=self.messages.append)
+        with db.engine.begin() as conn:
+            conn.execute(text("DELETE FROM schema_migrations WHERE version = :v"), {"v": MIGRATIONS[-1].version})
+
+        self.assertEqual([migration.version for migration in pending_migrations(db.engine)],
+                         [MIGRATIONS[-1].version])
+        self.assertEqual(upgrade(db.engine, log=self.messages.append), [MIGRATIONS[-1].version])
+
+    def test_upgrade_from_baseline(self):
+        """Does the baseline schema, with its data, upgrade to the current models?"""
+
+        with db.engine.begin() as conn:
+            for statement in BASELINE_SCHEMA + BASELINE_DATA:
+                conn.execute(text(statement))
+            for table in ('users', 'books', 'booklists', 'rating', 'reviews'):
+                conn.execute(text(f"SELECT setval('{table}_id_seq', (SELECT MAX(id) FROM {table}))"))
+
+        upgrade(db.engine, log=self.messages.append)
+
+        tables = set(inspect(db.engine).get_table_names())
+        self.assertIn('ratings', tables)
+        self.assertNotIn('rating', tables)
+        self.assertIn('bestsellers', tables)
+
+        with db.engine.connect() as conn:
+            self.assertEqual(conn.execute(text('SELECT COUNT(*) FROM booklists')).scalar(), 2)
+            self.assertEqual(conn.execute(text('SELECT score FROM ratings WHERE user_id = 1')).scalar(), 5)
+
+        dune = Book.query.get(1)
+        self.assertEqual((dune.rating_sum, dune.num_of_ratings, dune.avg_rating), (9, 2, 4.5))
+
+        # Both books normalize to the same key; the newer one gets its id appended
+        self.assertEqual(Book.query.get(2).natural_key, f"{dune.natural_key}#2")
+        self.assertIsNotNone(dune.updated_at)
+
+        reader = User.query.get(1)
+        self.assertEqual((reader.followers_count, reader.following_count, reader.booklist_count,
+                          reader.reviews_count, reader.ratings_count), (1, 0, 1, 1, 1))
+
+        with self.assertRaises(exc.IntegrityError):
+            with db.engine.begin() as conn:
+                conn.execute(text("INSERT INTO ratings (score, book_id, user_id) VALUES (1, 1, 2)"))
+
+        with db.engine.connect() as conn:
+            applied = [row[0] for row in conn.execute(text('SELECT version FROM schema_migrations ORDER BY version'))]
+        self.assertEqual(applied, [migration.version for migration in MIGRATIONS])
@@ -0,0 +1,262 @@
+"""NYT client tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_nyt_client.py
+
+
+import io
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+from requests.adapters import BaseAdapter
+
+from nyt_client import NYTClient, NYTApiError, CircuitBreaker, CircuitOpenError
+
+
+class FakeTransport(BaseAdapter):
+    """Answer requests from a script of (status, body[, headers]) tuples or
+    exceptions, recording each request and the timeout it was sent with"""
+
+    def __init__(self, *outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.sent = []
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.sent.append((request, timeout))
+        outcome = self.outcomes.pop(0)
+
+        if isinstance(outcome, Exception):
+            raise outcome
+
+        status, body, *headers = outcome
+        response = requests.Response()
+        response.status_code = status
+        response.raw = io.BytesIO(json.dumps(body).encode('utf-8'))
+        response.headers.update(headers[0] if headers else {})
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def make_client(*outcomes, **kwargs):
+    """A client whose requests are answered by a FakeTransport"""
+
+    client = NYTClient(base_url='http://nyt.test/svc/books/v3', api_key='KEY', **kwargs)
+    transport = FakeTransport(*outcomes)
+    client.session.mount('http://', transport)
+    return client, transport
+
+
+class NYTClientRetryTestCase(TestCase):
+    """Test timeouts, retries and backoff"""
+
+    def test_sends_key_and_timeouts(self):
+        """Does a request carry the api key and both timeouts?"""
+
+        client, transport = make_client((200, {"results": []}), connect_timeout=1.5, read_timeout=4)
+
+        self.assertEqual(client.get_json('lists/names.json'), {"results": []})
+
+        request, timeout = transport.sent[0]
+        self.assertEqual(request.url, 'http://nyt.test/svc/books/v3/lists/names.json?api-key=KEY')
+        self.assertEqual(timeout, (1.5, 4))
+
+    @patch('nyt_client.time.sleep')
+    def test_retries_server_errors_and_timeouts(self, sleep):
+        """Are 5xx answers and timeouts retried until a success?"""
+
+        client, transport = make_client(
+            (503, {}),
+            requests.Timeout("read timed out"),
+            requests.ConnectionError("refused"),
+            (200, {"ok": True}),
+            max_retries=3
+        )
+
+        self.assertEqual(client.get_json('lists/names.json'), {"ok": True})
+        self.assertEqual(len(transport.sent), 4)
+        self.assertEqual(sleep.call_count, 3)
+        self.assertEqual(client.latency.stats()['lists/names.json']['errors'], 3)
+
+    @patch('nyt_client.time.sleep')
+    def test_gives_up_after_max_retries(self, sleep):
+        """Is NYTApiError raised, with the status, once retries run out?"""
+
+        client, transport = make_client((500, {}), (500, {}), (500, {}), max_retries=2)
+
+        with self.assertRaises(NYTApiError) as context:
+            client.get_json('lists/names.json')
+
+        self.assertEqual(context.exception.status, 500)
+        self.assertEqual(len(transport.sent), 3)
+
+    def test_deadline_bounds_retries(self):
+        """Are later attempts' timeouts cut to the time left, and no attempt started too late?"""
+
+        now = [0.0]
+        client, transport = make_client(
+            (429, {}, {'Retry-After': '5'}),
+            (429, {}, {'Retry-After': '5'}),
+            (200, {}),
+            connect_timeout=3, read_timeout=10, max_retries=3, deadline=12
+        )
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        with patch('nyt_client.time.monotonic', lambda: now[0]), patch('nyt_client.time.sleep', sleep):
+            with self.assertRaises(NYTApiError) as context:
+                client.get_json('lists/names.json')
+
+        self.assertEqual(context.exception.status, 429)
+        self.assertEqual([timeout for _, timeout in transport.sent], [(3, 10), (3, 7)])
+        self.assertEqual(now[0], 5)
+
+    @patch('nyt_client.time.sleep')
+    def test_client_errors_are_not_retried(self, sleep):
+        """Is a 404 raised at once, without sleeping?"""
+
+        client, transport = make_client((404, {}), (200, {}))
+
+        with self.assertRaises(NYTApiError) as context:
+            client.get_json('lists/current/nope.json')
+
+        self.assertEqual(context.exception.status, 404)
+        self.assertEqual(len(transport.sent), 1)
+        sleep.assert_not_called()
+
+    @patch('nyt_client.time.sleep')
+    def test_retry_after_is_honored(self, sleep):
+        """Does a 429 with Retry-After wait that long (capped by backoff_max)?"""
+
+        client, transport = make_client(
+            (429, {}, {'Retry-After': '2'}),
+            (429, {}, {'Retry-After': '60'}),
+            (200, {}),
+            backoff_max=8
+        )
+
+        client.get_json('lists/names.json')
+
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [2.0, 8])
+
+    def test_backoff_is_jittered_and_capped(self):
+        """Does backoff stay within the exponential bound and backoff_max?"""
+
+        client = NYTClient(backoff_base=0.5, backoff_max=3)
+
+        for attempt in range(6):
+            delay = client.backoff(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(3, 0.5 * 2 ** attempt))
+
+    def test_streams_body_in_chunks(self):
+        """Does iter_chunks yield the whole body?"""
+
+        client, transport = make_client((200, {"lists": [1, 2, 3]}))
+
+        body = b''.join(client.iter_chunks('lists/overview.json', chunk_size=4))
+
+        self.assertEqual(json.loads(body), {"lists": [1, 2, 3]})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Test opening, half-open trials and closing of the circuit breaker"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        """Does the circuit open at the threshold, and refuse calls without sending them?"""
+
+        client, transport = make_client((503, {}), (503, {}), (200, {}), max_retries=0, breaker=self.breaker)
+
+        for _ in range(2):
+            with self.assertRaises(NYTApiError):
+                client.get_json('lists/names.json')
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            client.get_json('lists/names.json')
+
+        self.assertEqual(len(transport.sent), 2)
+        self.assertEqual(self.breaker.times_opened, 1)
+
+    def test_success_resets_failure_count(self):
+        """Does a success between failures keep the circuit closed?"""
+
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_client_errors_do_not_open(self):
+        """Are 4xx answers kept from counting as outages?"""
+
+        client, transport = make_client((404, {}), (404, {}), max_retries=0, breaker=self.breaker)
+
+        for _ in range(2):
+            with self.assertRaises(NYTApiError):
+                client.get_json('lists/current/nope.json')
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_trial_success_closes(self):
+        """After reset_timeout, is one trial let through, and does its success close the circuit?"""
+
+        client, transport = make_client((200, {"ok": True}), max_retries=0, breaker=self.breaker)
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+        self.assertEqual(client.get_json('lists/names.json'), {"ok": True})
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_one_trial(self):
+        """While a trial is running, are other calls refused?"""
+
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.now += 30
+
+        self.breaker.before_call()
+
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_half_open_trial_failure_reopens(self):
+        """Does a failed trial open the circuit for another reset_timeout?"""
+
+        client, transport = make_client((503, {}), max_retries=0, breaker=self.breaker)
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.now += 30
+
+        with self.assertRaises(NYTApiError):
+            client.get_json('lists/names.json')
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.times_opened, 2)
+
+        self.clock.now += 29
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
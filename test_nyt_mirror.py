@@ -0,0 +1,217 @@
+"""Bestseller mirror tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_nyt_mirror.py
+
+
+import os
+import time
+from datetime import date
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, upsert, Category, BestSeller, Book, BookList, User
+
+# Set an environmental variable to use a different database for tests
+
+os.environ['DATABASE_URL'] = "postgresql:///book_app-test"
+
+
+from app import app, CURR_USER_KEY
+import api_helper
+from api_helper import nyt_cache, get_category_listing, build_listing
+from nyt_mirror import (sync_categories, sync_list, sync_bestsellers,
+                        mirrored_categories, mirrored_books, mirrored_list_version)
+
+# Drop all tables and create new tables for each test
+db.drop_all()
+db.create_all()
+
+
+def nyt_book(title, rank, author="Some Author"):
+    return {"title": title, "rank": rank, "author": author,
+            "book_image": f"https://example.invalid/{rank}.jpg", "description": f"About {title}"}
+
+
+NAMES = [{"list_name_encoded": "hardcover-fiction"}, {"list_name_encoded": "graphic-books-and-manga"}]
+
+LISTS = {
+    "hardcover-fiction": {"published_date": "2022-05-15",
+                          "books": [nyt_book("SECOND", 2), nyt_book("FIRST", 1)]},
+    "graphic-books-and-manga": {"published_date": "2022-05-15",
+                                "books": [nyt_book("DRAWN", 1)]},
+}
+
+
+class UpsertTestCase(TestCase):
+    """Test INSERT ... ON CONFLICT through upsert()"""
+
+    def setUp(self):
+        BestSeller.query.delete()
+        Category.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_upsert_updates_or_skips(self):
+        """Does a conflicting row update the named columns, or do nothing without them?"""
+
+        row = {"list_name_encoded": "hardcover-fiction", "category_name": "Old", "position": 1}
+
+        self.assertEqual(upsert(Category, [row], ['list_name_encoded']).rowcount, 1)
+        self.assertEqual(upsert(Category, [dict(row, category_name="Skipped")], ['list_name_encoded']).rowcount, 0)
+        upsert(Category, [dict(row, category_name="New", position=5)], ['list_name_encoded'], ['category_name'])
+        db.session.commit()
+
+        category = Category.query.one()
+        self.assertEqual(category.category_name, "New")
+        self.assertEqual(category.position, 1)
+
+
+class NYTMirrorTestCase(TestCase):
+    """Test syncing NYT lists into the database and reading them back"""
+
+    def setUp(self):
+        BestSeller.query.delete()
+        Category.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_readers_before_sync(self):
+        """Do the readers report a list that was never synced?"""
+
+        self.assertEqual(mirrored_categories(), [])
+        self.assertIsNone(mirrored_books("Hardcover Fiction"))
+        self.assertIsNone(mirrored_list_version("Hardcover Fiction"))
+
+    def test_sync_list(self):
+        """Are a list's books mirrored in rank order, with its published date?"""
+
+        self.assertEqual(sync_list("hardcover-fiction", LISTS["hardcover-fiction"]), 2)
+
+        books = mirrored_books("Hardcover Fiction")
+        self.assertEqual([book["title"] for book in books], ["FIRST", "SECOND"])
+        self.assertEqual(books[0]["image"], "https://example.invalid/1.jpg")
+
+        published_date, updated_at = mirrored_list_version("Hardcover Fiction")
+        self.assertEqual(published_date, date(2022, 5, 15))
+        self.assertIsNotNone(updated_at)
+
+    def test_resync_replaces_books(self):
+        """Does a later sync update ranks and drop books that left the list?"""
+
+        sync_list("hardcover-fiction", LISTS["hardcover-fiction"])
+        sync_list("hardcover-fiction", {"published_date": "2022-05-22",
+                                        "books": [nyt_book("SECOND", 1), nyt_book("NEW", 2)]})
+
+        self.assertEqual([book["title"] for book in mirrored_books("Hardcover Fiction")], ["SECOND", "NEW"])
+        self.assertEqual(BestSeller.query.count(), 2)
+        self.assertEqual(Category.query.count(), 1)
+
+    def test_sync_categories_keeps_api_order(self):
+        """Are categories mirrored once each, in API order?"""
+
+        names = NAMES + [{"list_name_encoded": "hardcover-fiction"}]
+
+        self.assertEqual(sync_categories(names), ["hardcover-fiction", "graphic-books-and-manga"])
+        self.assertEqual(mirrored_categories(), ["Hardcover Fiction", "Graphic Books And Manga"])
+
+    @patch('nyt_mirror.fetch_current_list')
+    @patch('nyt_mirror.fetch_list_names', return_value=NAMES)
+    def test_sync_bestsellers(self, fetch_list_names, fetch_current_list):
+        """Does a full sync mirror every list, and carry on past a failing one?"""
+
+        def current_list(encoded):
+            if encoded == "graphic-books-and-manga":
+                raise RuntimeError("NYT API is down")
+            return LISTS[encoded]
+
+        fetch_current_list.side_effect = current_list
+        messages = []
+
+        lists, books, failed = sync_bestsellers(log=messages.append)
+
+        self.assertEqual((lists, books, failed), (2, 2, ["graphic-books-and-manga"]))
+        self.assertEqual(len(mirrored_books("Hardcover Fiction")), 2)
+        self.assertIsNone(mirrored_books("Graphic Books And Manga"))
+        self.assertIn("Failed to sync graphic-books-and-manga: NYT API is down", messages)
+
+
+class ResultsViewTestCase(TestCase):
+    """Test that /results serves the mirror, then the API, then the last good copy"""
+
+    def setUp(self):
+        BestSeller.query.delete()
+        Category.query.delete()
+        BookList.query.delete()
+        User.query.delete()
+        Book.query.delete()
+        db.session.commit()
+        nyt_cache.clear()
+
+        # The API is down: the circuit is open, so no request is attempted
+        self.breaker = api_helper.client.breaker
+        for _ in range(self.breaker.failure_threshold):
+            self.breaker.record_failure()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.breaker.record_success()
+        nyt_cache.clock = time.time
+        nyt_cache.clear()
+        db.session.rollback()
+
+    def test_serves_mirror(self):
+        """Is a mirrored list shown even while the API is down?"""
+
+        sync_list("hardcover-fiction", LISTS["hardcover-fiction"])
+
+        resp = self.client.get("/results?category=Hardcover+Fiction")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("FIRST", resp.get_data(as_text=True))
+
+    def test_serves_stale_copy_when_api_down(self):
+        """Is an expired cached list shown, flagged as stale, instead of redirecting?"""
+
+        get_category_listing.prime(build_listing([nyt_book("CACHED", 1)]), "hardcover-fiction")
+        nyt_cache.clock = lambda: time.time() + 10 ** 7
+
+        resp = self.client.get("/results?category=Hardcover+Fiction")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("CACHED", html)
+        self.assertIn("Bestseller data may be stale", html)
+
+    def test_redirects_without_any_copy(self):
+        """With no mirror and nothing cached, is the visitor sent home?"""
+
+        resp = self.client.get("/results?category=Hardcover+Fiction")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.location, "http://localhost/")
+
+    def test_add_saved_book_while_api_down(self):
+        """Can a book that is already saved be added to a booklist without the API?"""
+
+        user = User(username="reader", email="reader@test.com", password="HASH")
+        book = Book(title="THE MIDNIGHT LIBRARY", author="Matt Haig", description="TestDescription")
+        db.session.add_all([user, book])
+        db.session.commit()
+        user_id, book_id = user.id, book.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            resp = c.post("/results/Hardcover Fiction/books/The Midnight Library")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.location, f"http://localhost/users/{user_id}")
+        self.assertEqual([entry.book_id for entry in BookList.query.filter_by(user_id=user_id)], [book_id])
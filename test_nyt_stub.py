@@ -0,0 +1,81 @@
+"""NYT stand-in tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_nyt_stub.py
+
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from nyt_stub import PREFIX, SYNTHETIC_CATEGORIES, StubConfig, create_app
+
+
+class NYTStubTestCase(TestCase):
+    """Test fixture replay, synthetic data and error injection"""
+
+    def setUp(self):
+        self.fixtures = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.fixtures.name, 'current'))
+
+    def tearDown(self):
+        self.fixtures.cleanup()
+
+    def write_fixture(self, data, *parts):
+        with open(os.path.join(self.fixtures.name, *parts), 'w') as f:
+            json.dump(data, f)
+
+    def client(self, **settings):
+        return create_app(StubConfig(fixtures_dir=self.fixtures.name, **settings)).test_client()
+
+    def test_replays_fixtures(self):
+        """Are recorded fixtures served as they were saved?"""
+
+        names = {"status": "OK", "results": [{"list_name_encoded": "recorded-list"}]}
+        current = {"status": "OK", "results": {"list_name_encoded": "hardcover-fiction",
+                                               "books": [{"title": "RECORDED"}]}}
+        self.write_fixture(names, 'names.json')
+        self.write_fixture(current, 'current', 'hardcover-fiction.json')
+
+        client = self.client()
+
+        self.assertEqual(client.get(f"{PREFIX}/lists/names.json").get_json(), names)
+        self.assertEqual(client.get(f"{PREFIX}/lists/current/Hardcover Fiction.json").get_json(), current)
+
+    def test_synthetic_data_without_fixtures(self):
+        """Without fixtures, are lists synthesized and the same for the same seed?"""
+
+        first = self.client(books_per_list=3).get(f"{PREFIX}/lists/current/hardcover-fiction.json").get_json()
+        second = self.client(books_per_list=3).get(f"{PREFIX}/lists/current/hardcover-fiction.json").get_json()
+        names = self.client().get(f"{PREFIX}/lists/names.json").get_json()
+
+        self.assertEqual(len(first["results"]["books"]), 3)
+        self.assertEqual(first, second)
+        self.assertEqual([result["list_name_encoded"] for result in names["results"]], SYNTHETIC_CATEGORIES)
+
+    def test_unknown_category(self):
+        """Is a category with neither fixture nor synthetic data a 404?"""
+
+        resp = self.client().get(f"{PREFIX}/lists/current/no-such-list.json")
+
+        self.assertEqual(resp.status_code, 404)
+
+    def test_overview_matches_current_lists(self):
+        """Does the synthetic overview hold the same books as the current lists?"""
+
+        client = self.client(books_per_list=2)
+        overview = client.get(f"{PREFIX}/lists/overview.json").get_json()["results"]
+        current = client.get(f"{PREFIX}/lists/current/{SYNTHETIC_CATEGORIES[0]}.json").get_json()["results"]
+
+        self.assertEqual(len(overview["lists"]), len(SYNTHETIC_CATEGORIES))
+        self.assertEqual(overview["lists"][0]["books"], current["books"])
+
+    def test_error_injection(self):
+        """Does an error rate of 1 fail every request with the configured status?"""
+
+        resp = self.client(error_rate=1, error_status=502).get(f"{PREFIX}/lists/names.json")
+
+        self.assertEqual(resp.status_code, 502)
+        self.assertEqual(resp.get_json()["fault"], "injected")
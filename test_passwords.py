@@ -0,0 +1,140 @@
+"""Password hasher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from passwords import PasswordHasher, HashQueueFull
+
+
+# Run in the pool's processes, so they must be importable module functions
+
+def _exit_once(marker):
+    """Kill the pool process the first time, succeed after"""
+
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return "done"
+
+
+def _exit_in_pool(parent_pid):
+    """Kill any pool process; succeed only when run inline"""
+
+    if os.getpid() != parent_pid:
+        os._exit(1)
+    return "inline"
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing, checking, rehash detection and the queue bound"""
+
+    def test_hash_and_check_in_pool(self):
+        """Does a hash made in the process pool check against its password?"""
+
+        hasher = PasswordHasher(workers=1, log_rounds=4)
+        try:
+            hashed = hasher.hash("password")
+
+            self.assertTrue(hashed.startswith("$2b$04$"))
+            self.assertTrue(hasher.check(hashed, "password"))
+            self.assertFalse(hasher.check(hashed, "wrong"))
+            self.assertEqual(hasher.stats()["latency"]["hash"]["count"], 1)
+            self.assertEqual(hasher.stats()["latency"]["check"]["count"], 2)
+        finally:
+            hasher.shutdown()
+
+    def test_empty_password(self):
+        """Is an empty password refused for hashing and never matched?"""
+
+        hasher = PasswordHasher(workers=0, log_rounds=4)
+
+        with self.assertRaises(ValueError):
+            hasher.hash("")
+        self.assertFalse(hasher.check("$2b$04$not-a-hash", ""))
+        self.assertFalse(hasher.check("not-a-hash", "password"))
+
+    def test_needs_rehash(self):
+        """Are hashes at another cost (or unparseable) due for a rehash?"""
+
+        old = PasswordHasher(workers=0, log_rounds=4)
+        new = PasswordHasher(workers=0, log_rounds=5)
+        hashed = old.hash("password")
+
+        self.assertFalse(old.needs_rehash(hashed))
+        self.assertTrue(new.needs_rehash(hashed))
+        self.assertTrue(new.needs_rehash("plaintext"))
+        self.assertTrue(new.check(hashed, "password"))
+
+    def test_full_queue_is_rejected(self):
+        """Is work beyond the queue limit refused rather than queued?"""
+
+        hasher = PasswordHasher(workers=0, queue_limit=0, queue_timeout=0.01, log_rounds=4)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(1)
+
+        worker = threading.Thread(target=hasher._run, args=('check', slow))
+        worker.start()
+        started.wait(1)
+
+        with self.assertRaises(HashQueueFull):
+            hasher.check("$2b$04$hash", "password")
+
+        release.set()
+        worker.join()
+
+        self.assertEqual(hasher.stats()["rejected"], 1)
+        self.assertEqual(hasher.stats()["in_flight"], 0)
+
+    def test_broken_pool_is_replaced(self):
+        """Is the operation retried in a new pool after a pool process dies?"""
+
+        tmpdir = tempfile.mkdtemp()
+        hasher = PasswordHasher(workers=1, log_rounds=4)
+        try:
+            self.assertEqual(hasher._run('check', _exit_once, os.path.join(tmpdir, 'died')), "done")
+            self.assertEqual(hasher.stats()["pool_restarts"], 1)
+            self.assertTrue(hasher.check(hasher.hash("password"), "password"))
+        finally:
+            hasher.shutdown()
+            shutil.rmtree(tmpdir)
+
+    def test_pool_broken_twice_runs_inline(self):
+        """Does an operation that keeps breaking the pool fall back to running inline?"""
+
+        hasher = PasswordHasher(workers=1, log_rounds=4)
+        try:
+            self.assertEqual(hasher._run('check', _exit_in_pool, os.getpid()), "inline")
+            self.assertEqual(hasher.stats()["pool_restarts"], 2)
+            self.assertEqual(hasher.stats()["in_flight"], 0)
+        finally:
+            hasher.shutdown()
+
+    def test_slow_result_is_rejected(self):
+        """Does an operation the pool doesn't finish in time get a 503?"""
+
+        hasher = PasswordHasher(workers=1, result_timeout=0.1, log_rounds=4)
+        try:
+            with self.assertRaises(HashQueueFull):
+                hasher._run('check', _sleep, 1)
+
+            self.assertEqual(hasher.stats()["rejected"], 1)
+            self.assertEqual(hasher.stats()["in_flight"], 0)
+        finally:
+            hasher.shutdown()
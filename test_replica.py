@@ -0,0 +1,86 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replica.py
+#
+# They use two SQLite files as the primary and the replica.
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask import Flask, session
+
+from models import db, User
+from replica import PRIMARY_UNTIL_KEY, reading_from_replica, replica_binds
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test which database reads and writes are sent to"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+        self.app = Flask(__name__)
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(self.tmpdir, 'primary.db')}",
+            SQLALCHEMY_BINDS=replica_binds(f"sqlite:///{os.path.join(self.tmpdir, 'replica.db')}"),
+            SQLALCHEMY_TRACK_MODIFICATIONS=False,
+            SECRET_KEY="test",
+        )
+        db.init_app(self.app)
+
+        # The same table in both files, with a different user in each
+        with self.app.app_context():
+            for bind, username in ((None, "on-primary"), ("replica", "on-replica")):
+                engine = db.get_engine(self.app, bind=bind)
+                User.__table__.create(engine)
+                engine.execute(User.__table__.insert().values(
+                    username=username, email=f"{username}@test.com", password="HASHED_PASSWORD"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def usernames(self):
+        return sorted(user.username for user in User.query.all())
+
+    def test_reads_use_primary_by_default(self):
+        with self.app.test_request_context("/"):
+            self.assertEqual(self.usernames(), ["on-primary"])
+
+    def test_reads_use_replica_when_asked(self):
+        with self.app.test_request_context("/"):
+            with reading_from_replica():
+                self.assertEqual(self.usernames(), ["on-replica"])
+
+            self.assertEqual(self.usernames(), ["on-primary"])
+
+    def test_reads_after_write_use_primary(self):
+        """Does a request that wrote read its own writes, and pin the browser to the primary?"""
+
+        with self.app.test_request_context("/"):
+            with reading_from_replica():
+                db.session.add(User(username="new", email="new@test.com", password="HASHED_PASSWORD"))
+                db.session.commit()
+
+                self.assertEqual(self.usernames(), ["new", "on-primary"])
+                self.assertIn(PRIMARY_UNTIL_KEY, session)
+
+    def test_recent_write_pins_later_requests(self):
+        with self.app.test_request_context("/"):
+            session[PRIMARY_UNTIL_KEY] = float("inf")
+
+            with reading_from_replica():
+                self.assertEqual(self.usernames(), ["on-primary"])
+
+    def test_get_bind_through_session_proxy(self):
+        """Does the scoped session's get_bind, which passes keyword arguments, reach the router?"""
+
+        with self.app.test_request_context("/"):
+            self.assertIs(db.session.get_bind(), db.get_engine(self.app))
+
+            with reading_from_replica():
+                self.assertIs(db.session.get_bind(), db.get_engine(self.app, bind="replica"))
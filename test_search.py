@@ -0,0 +1,126 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_search.py
+
+
+import re
+from unittest import TestCase
+
+from db_testcase import DatabaseTestCase
+from models import db, User, Book
+
+from app import app, CURR_USER_KEY
+from search import TrigramIndex, search_mode, similarity
+
+
+class TrigramIndexTestCase(TestCase):
+    """Test the in-process search index"""
+
+    def setUp(self):
+        self.index = TrigramIndex()
+        self.index.add(1, ["THE SILENT PATIENT", "Alex Michaelides"], "A woman shoots her husband and never speaks again")
+        self.index.add(2, ["THE MIDNIGHT LIBRARY", "Matt Haig"], "Between life and death there is a library")
+        self.index.add(3, ["WHERE THE CRAWDADS SING", "Delia Owens"], "A marsh girl grows up alone")
+
+    def test_similarity(self):
+        """Do identical strings score 1 and unrelated ones 0?"""
+
+        self.assertEqual(similarity("library", "LIBRARY"), 1.0)
+        self.assertEqual(similarity("library", "xyz"), 0.0)
+
+    def test_substring_ranks_first(self):
+        """Does a title containing the query outrank a description match?"""
+
+        results = self.index.search("library")
+
+        self.assertEqual([key for _, key in results], [2])
+
+    def test_misspelling_matches(self):
+        """Is a close misspelling still found?"""
+
+        results = self.index.search("michaelidis")
+
+        self.assertEqual([key for _, key in results], [1])
+
+    def test_description_words_match(self):
+        """Are books found by every word of their description?"""
+
+        results = self.index.search("marsh girl")
+
+        self.assertEqual([key for _, key in results], [3])
+
+    def test_no_match(self):
+        self.assertEqual(self.index.search("zzzz"), [])
+
+
+class SearchViewTestCase(DatabaseTestCase):
+    """Test the /search route"""
+
+    def setUp(self):
+        super().setUp()
+
+        user = User.signup("testuser", "test@test.com", "password")
+        db.session.add_all([
+            User(username="Bookworm", email="worm@test.com", password="HASHED_PASSWORD"),
+            Book(title="THE MIDNIGHT LIBRARY", author="Matt Haig", description="A library of lives"),
+            Book(title="KLARA AND THE SUN", author="Kazuo Ishiguro", description="An artificial friend"),
+        ])
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = app.test_client()
+
+    def test_book_search_is_case_insensitive(self):
+        """Is a lowercase query matched against uppercase titles?"""
+
+        resp = self.client.get("/search?q=midnight")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("The Midnight Library", str(resp.data))
+        self.assertNotIn("Klara", str(resp.data))
+
+    def test_book_search_by_author(self):
+        resp = self.client.get("/search?q=ishiguro")
+
+        self.assertIn("Klara And The Sun", str(resp.data))
+
+    def test_user_search_requires_login(self):
+        resp = self.client.get("/search?q=book&type=users")
+
+        self.assertEqual(resp.status_code, 302)
+
+    def test_user_search(self):
+        """Are users matched regardless of case?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            resp = c.get("/search?q=BOOKW&type=users")
+
+        self.assertIn("Bookworm", str(resp.data))
+        self.assertNotIn("testuser</p>", str(resp.data))
+
+    def test_book_search_by_description_words(self):
+        """Are books found by words of their description, in the database?"""
+
+        with app.app_context():
+            self.assertIn(search_mode(), ('trigram', 'fulltext'))
+
+        resp = self.client.get("/search?q=artificial+friends")
+
+        self.assertIn("Klara And The Sun", str(resp.data))
+        self.assertNotIn("The Midnight Library", str(resp.data))
+
+    def test_book_search_next_page(self):
+        """Does the next-page link of a search work with its ranked cursor?"""
+
+        resp = self.client.get("/search?q=the&per_page=1")
+        html = resp.get_data(as_text=True)
+        next_url = re.search(r'href="([^"]*after=[^"]*)"', html).group(1).replace("&amp;", "&")
+
+        resp = self.client.get(next_url)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual("Klara" in html, "Klara" in resp.get_data(as_text=True))
@@ -0,0 +1,128 @@
+"""Single-flight tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_singleflight.py
+
+
+import multiprocessing
+import queue
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipUnless
+
+import singleflight
+from singleflight import SingleFlight
+
+
+# Run in worker processes, so they must be importable module functions
+
+def _lead(lock_dir, started):
+    def slow():
+        started.set()
+        time.sleep(0.5)
+        return {"a": 1}
+
+    SingleFlight(lock_dir=lock_dir, share_seconds=60).do("k", slow)
+
+
+def _follow(lock_dir, results):
+    flight = SingleFlight(lock_dir=lock_dir, share_seconds=60)
+    value = flight.do("k", lambda: {"a": 2})
+    results.put((value, flight.stats()["shared_across_processes"]))
+
+
+class SingleFlightTestCase(TestCase):
+    """Test request coalescing"""
+
+    def test_concurrent_callers_share_one_call(self):
+        """Do concurrent callers for one key run the function once?"""
+
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return "value"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+        leader.start()
+        started.wait(1)
+
+        followers = [threading.Thread(target=lambda: results.append(flight.do("k", slow))) for _ in range(4)]
+        for follower in followers:
+            follower.start()
+
+        deadline = time.monotonic() + 5
+        while flight.stats()["coalesced"] < 4:
+            if time.monotonic() > deadline:
+                release.set()
+                self.fail("Followers did not wait for the leader's call")
+            time.sleep(0.001)
+        release.set()
+
+        for thread in [leader] + followers:
+            thread.join(5)
+            self.assertFalse(thread.is_alive(), "A caller never returned")
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 5)
+
+    def test_error_is_not_cached(self):
+        """Does a failed call leave the key free for the next caller?"""
+
+        flight = SingleFlight()
+
+        with self.assertRaises(RuntimeError):
+            flight.do("k", lambda: (_ for _ in ()).throw(RuntimeError("boom")))
+
+        self.assertEqual(flight.do("k", lambda: 1), 1)
+
+    def test_result_shared_through_lock_dir(self):
+        """Does a second flight (another worker) reuse a fresh stored result?"""
+
+        with tempfile.TemporaryDirectory() as lock_dir:
+            first = SingleFlight(lock_dir=lock_dir, share_seconds=60)
+            second = SingleFlight(lock_dir=lock_dir, share_seconds=60)
+
+            self.assertEqual(first.do("k", lambda: {"a": 1}), {"a": 1})
+            self.assertEqual(second.do("k", lambda: {"a": 2}), {"a": 1})
+            self.assertEqual(second.stats()["shared_across_processes"], 1)
+
+    @skipUnless(singleflight.fcntl, "needs flock")
+    def test_follower_process_waits_for_leader(self):
+        """Does a worker that arrives mid-call wait on the lock file and reuse the result?"""
+
+        context = multiprocessing.get_context("fork")
+        started = context.Event()
+        results = context.Queue()
+
+        with tempfile.TemporaryDirectory() as lock_dir:
+            leader = context.Process(target=_lead, args=(lock_dir, started))
+            follower = context.Process(target=_follow, args=(lock_dir, results))
+            try:
+                leader.start()
+                if not started.wait(5):
+                    self.fail("The leader process never started its call")
+
+                follower.start()
+                try:
+                    result = results.get(timeout=5)
+                except queue.Empty:
+                    self.fail("The follower process never got a result")
+
+                for process in (leader, follower):
+                    process.join(5)
+                    self.assertFalse(process.is_alive(), "A worker process never finished")
+            finally:
+                for process in (leader, follower):
+                    if process.is_alive():
+                        process.terminate()
+
+        self.assertEqual(result, ({"a": 1}, 1))
@@ -8,7 +8,9 @@
 import os
 from unittest import TestCase
 from sqlalchemy import exc
-from models import db, User, Follows, Book, BookList, Rating, Review
+from aggregates import reconcile_user_counters
+from models import db, User, Follows, Book, BookList, Rating, Review, book_natural_key
+from passwords import PasswordHasher, hasher
 
 # Set an environmental variable to use a different database for tests 
 
@@ -131,6 +133,16 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.u2.is_followed_by(self.u1))
         self.assertFalse(self.u1.is_followed_by(self.u2))
 
+    def test_following_ids_among(self):
+        """Does the batch check return only the ids user1 follows?"""
+
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_ids_among([self.uid2, 9999]), {self.uid2})
+        self.assertEqual(self.u2.following_ids_among([self.uid1]), set())
+        self.assertEqual(self.u1.following_ids_among([]), set())
+
     #### Signup tests ########################################
 
     def test_valid_signup(self):
@@ -185,6 +197,19 @@ class UserModelTestCase(TestCase):
         self.assertIsNotNone(u)
         self.assertEqual(u.id, self.uid1)
     
+    def test_authentication_rehashes_old_cost(self):
+        """Is a hash made at another cost replaced on successful login?"""
+
+        old = PasswordHasher(workers=0, log_rounds=hasher.log_rounds - 1)
+        self.u1.password = old.hash("password")
+        db.session.commit()
+
+        self.assertTrue(User.authenticate(self.u1.username, "password"))
+
+        u = User.query.get(self.uid1)
+        self.assertFalse(hasher.needs_rehash(u.password))
+        self.assertTrue(User.authenticate(self.u1.username, "password"))
+
     def test_invalid_username(self):
         """Test for authentication when username is invalid"""
 
@@ -193,7 +218,150 @@ class UserModelTestCase(TestCase):
     def test_wrong_password(self):
         """Test for authentication when password is invalid"""
         self.assertFalse(User.authenticate(self.u1.username, "badpassword"))
-    
 
 
-    
\ No newline at end of file
+    #### Booklist, rating and review uniqueness tests ##########################
+
+    def test_booklist_unique_per_user_and_book(self):
+        """Is a second booklist entry for the same user and book rejected?"""
+
+        book = Book(title="TestBook", description="TestDescription", author="TestAuthor")
+        db.session.add(book)
+        db.session.commit()
+
+        db.session.add(BookList(user_id=self.uid1, book_id=book.id))
+        db.session.commit()
+
+        db.session.add(BookList(user_id=self.uid1, book_id=book.id))
+        with self.assertRaises(exc.IntegrityError):
+            db.session.commit()
+
+    #### Rating aggregate tests ###############################################
+
+    def test_rating_aggregates(self):
+        """Are a book's rating sum, count and average kept in step with its ratings?"""
+
+        book = Book(title="TestBook", description="TestDescription", author="TestAuthor")
+        db.session.add(book)
+        db.session.commit()
+        book_id = book.id
+
+        Rating.rate(self.uid1, book_id, 4)
+        Rating.rate(self.uid2, book_id, 1)
+        Rating.rate(self.uid2, book_id, 3)
+        db.session.commit()
+
+        book = Book.query.get(book_id)
+        self.assertEqual(book.num_of_ratings, 2)
+        self.assertEqual(book.rating_sum, 7)
+        self.assertEqual(book.avg_rating, 3.5)
+
+        Rating.unrate(self.uid1, book_id)
+        db.session.commit()
+        db.session.refresh(book)
+
+        self.assertEqual(book.num_of_ratings, 1)
+        self.assertEqual(book.avg_rating, 3)
+
+
+    #### Book natural key tests ###############################################
+
+    def test_book_natural_key_is_normalized(self):
+        """Do case, accents, spacing and punctuation leave a book's key unchanged?"""
+
+        self.assertEqual(book_natural_key("THE MIDNIGHT LIBRARY", "Matt Haig"),
+                         book_natural_key("The  Midnight Library!", "matt haig"))
+        self.assertEqual(book_natural_key("CAFÉ", "Zoë"), "cafe|zoe")
+
+    def test_book_get_or_create(self):
+        """Does get_or_create insert a new book once and resolve it afterwards?"""
+
+        book_id = Book.get_or_create("THE MIDNIGHT LIBRARY", "Matt Haig", description="TestDescription")
+        db.session.commit()
+
+        same_id = Book.get_or_create("The Midnight Library", "MATT HAIG", description="Other")
+        other_id = Book.get_or_create("THE MIDNIGHT LIBRARY", "Someone Else", description="TestDescription")
+        db.session.commit()
+
+        self.assertEqual(book_id, same_id)
+        self.assertNotEqual(book_id, other_id)
+        self.assertEqual(Book.query.get(book_id).description, "TestDescription")
+
+    def test_book_id_for_title(self):
+        """Is a saved book found by its normalized title, whatever the case and punctuation?"""
+
+        book_id = Book.get_or_create("THE MIDNIGHT LIBRARY", "Matt Haig", description="TestDescription")
+        Book.get_or_create("THE MIDNIGHT LIBRARY 2", "Matt Haig", description="TestDescription")
+        db.session.commit()
+
+        self.assertEqual(Book.id_for_title("The  Midnight Library!"), book_id)
+        self.assertIsNone(Book.id_for_title("The Midnight"))
+
+    def test_book_id_for_shared_title(self):
+        """Is a title shared by books of different authors only resolved with the author?"""
+
+        book_id = Book.get_or_create("THE MIDNIGHT LIBRARY", "Matt Haig", description="TestDescription")
+        other_id = Book.get_or_create("THE MIDNIGHT LIBRARY", "Someone Else", description="TestDescription")
+        db.session.commit()
+
+        self.assertIsNone(Book.id_for_title("The Midnight Library"))
+        self.assertEqual(Book.id_for_title("The Midnight Library", "matt haig"), book_id)
+        self.assertEqual(Book.id_for_title("The Midnight Library", "Someone Else"), other_id)
+        self.assertIsNone(Book.id_for_title("The Midnight Library", "Nobody"))
+
+    def test_review_add_and_remove(self):
+        """Are review counts kept on the user and the book as reviews come and go?"""
+
+        book = Book(title="TestBook", description="TestDescription", author="TestAuthor")
+        db.session.add(book)
+        db.session.commit()
+        book_id = book.id
+
+        self.assertTrue(Review.add(self.uid1, book_id, "Great"))
+        self.assertFalse(Review.add(self.uid1, book_id, "Again"))
+        self.assertTrue(Review.add(self.uid2, book_id, "Fine"))
+        db.session.commit()
+
+        self.assertEqual(Book.query.get(book_id).num_of_reviews, 2)
+        self.assertEqual(User.query.get(self.uid1).reviews_count, 1)
+
+        self.assertTrue(Review.remove(self.uid1, book_id))
+        self.assertFalse(Review.remove(self.uid1, book_id))
+        db.session.commit()
+
+        self.assertEqual(Book.query.get(book_id).num_of_reviews, 1)
+        self.assertEqual(User.query.get(self.uid1).reviews_count, 0)
+        self.assertEqual(User.query.get(self.uid2).reviews_count, 1)
+
+    #### User counter tests ###################################################
+
+    def test_user_counters(self):
+        """Are follow, booklist and rating counts kept in step, and is drift repaired?"""
+
+        book = Book(title="TestBook", description="TestDescription", author="TestAuthor")
+        db.session.add(book)
+        db.session.commit()
+        book_id = book.id
+
+        self.assertTrue(self.u1.follow(self.uid2))
+        self.assertFalse(self.u1.follow(self.uid2))
+        self.assertTrue(BookList.add(self.uid1, book_id))
+        Rating.rate(self.uid1, book_id, 5)
+        db.session.commit()
+
+        u1, u2 = User.query.get(self.uid1), User.query.get(self.uid2)
+        self.assertEqual((u1.following_count, u1.booklist_count, u1.ratings_count), (1, 1, 1))
+        self.assertEqual(u2.followers_count, 1)
+
+        self.assertTrue(u1.unfollow(self.uid2))
+        self.assertTrue(BookList.remove(self.uid1, book_id))
+        db.session.commit()
+
+        self.assertEqual((u1.following_count, u1.booklist_count), (0, 0))
+        self.assertEqual(u2.followers_count, 0)
+
+        u2.followers_count = 7
+        db.session.commit()
+
+        self.assertEqual(reconcile_user_counters(log=lambda message: None), 1)
+        self.assertEqual(User.query.get(self.uid2).followers_count, 0)
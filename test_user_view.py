@@ -10,6 +10,7 @@ from unittest import TestCase
 
 from models import db, User, Follows, Book, BookList, Rating, Review
 from bs4 import BeautifulSoup
+from sqlalchemy import event
 
 # Set an environmental variable to use a different database for tests 
 
@@ -17,6 +18,7 @@ os.environ['DATABASE_URL'] = "postgresql:///book_app-test"
 
 
 from app import app, CURR_USER_KEY
+from principal import CURR_USERNAME_KEY
 
 # Disable WTForms use of CSRF during testing.
 app.config['WTF_CSRF_ENABLED'] = False
@@ -162,11 +164,11 @@ class UserViewTestCase(TestCase):
     def setup_followers(self):
         """Set up followers"""
 
-        f1 = Follows(user_being_followed_id=self.u1_id, user_following_id=self.testuser_id)
-        f2 = Follows(user_being_followed_id=self.u2_id, user_following_id=self.testuser_id)
-        f3 = Follows(user_being_followed_id=self.testuser_id, user_following_id=self.u1_id)
-
-        db.session.add_all([f1,f2,f3])
+        # Follow through the model so the profile counters are kept in step
+        testuser = User.query.get(self.testuser_id)
+        testuser.follow(self.u1_id)
+        testuser.follow(self.u2_id)
+        User.query.get(self.u1_id).follow(self.testuser_id)
         db.session.commit()
 
 
@@ -256,4 +258,87 @@ class UserViewTestCase(TestCase):
             self.assertIn("Please signup and/or login.", str(resp.data))
 
 
-        
\ No newline at end of file
+        
+
+    def test_logged_in_page_without_user_queries(self):
+        """Does a page that only shows the username run no user query?"""
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[CURR_USERNAME_KEY] = "testuser"
+
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                resp = c.get("/no-such-page")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("testuser", str(resp.data))
+        self.assertFalse([statement for statement in statements if "users" in statement])
+
+    def test_delete_review(self):
+        """Does deleting a review update the user's and the book's review counts?"""
+
+        book_id = Book.query.filter_by(title="TestBook").one().id
+
+        Review.add(self.testuser_id, book_id, "Great")
+        db.session.commit()
+        review_id = Review.query.filter_by(user_id=self.testuser_id).one().id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post(f"/reviews/{review_id}/delete")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNone(Review.query.get(review_id))
+        self.assertEqual(Book.query.get(book_id).num_of_reviews, 0)
+        self.assertEqual(User.query.get(self.testuser_id).reviews_count, 0)
+
+    def test_book_page_for_user_with_book_saved(self):
+        """Does a user who saved and rated a book see the remove button and no rating form?"""
+
+        book_id = Book.query.filter_by(title="TestBook").one().id
+        db.session.add(BookList(user_id=self.testuser_id, book_id=book_id))
+        db.session.add(Rating(user_id=self.testuser_id, book_id=book_id, score=4))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/books/{book_id}")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Remove Book From My Booklist", html)
+        self.assertNotIn("Rate this book", html)
+        self.assertIn("Your rating for this book: 4", html)
+
+    def test_write_by_deleted_user_logs_out(self):
+        """Is a session whose user was deleted logged out, not allowed to write?"""
+
+        book_id = Book.query.filter_by(title="TestBook").one().id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 999999
+                sess[CURR_USERNAME_KEY] = "gone"
+
+            for url in (f"/books/{book_id}", f"/booklists/999999/add/{book_id}"):
+                resp = c.post(url, data={"book-rating": "4"})
+
+                self.assertEqual(resp.status_code, 302)
+                with c.session_transaction() as sess:
+                    self.assertNotIn(CURR_USER_KEY, sess)
+                    sess[CURR_USER_KEY] = 999999
+
+        self.assertEqual(Rating.query.count(), 0)